@@ -0,0 +1,236 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Bake ambient occlusion of static shapes to texel grids
+"""
+
+
+import math
+import struct
+import sys
+from array import array
+
+from sampler import *
+from scene import *
+from vector import *
+
+
+__all__ = ["AOBake",]
+
+
+class AOBake(object):
+    """
+        Ambient occlusion baked once per shape on a resolution x resolution
+        texel grid, every texel holds the unoccluded fraction of the
+        cosine weighted hemisphere at its center. The grid is mapped to
+        Squre by its right and up axes, to Triangle by the barycentric
+        coordinates of v1 and v2 and to Sphere by longitude and latitude.
+        Plane, TriangleMesh and emissive shapes are not baked, lookup
+        returns None for them.
+
+        The grids are indexed by the position of the shape in the scene,
+        the scene must not change between bake and load
+    """
+
+    MAGIC = b"AOBK"
+    VERSION = 1
+
+    def __init__(self, scene, resolution=32, sampler=None, sampler_num=64):
+        self.scene = scene
+        self.resolution = resolution
+        self.sampler = sampler
+        self.sampler_num = sampler_num
+        self.grids = {}
+
+    def getResolution(self):
+        return self.resolution
+
+    def getBakedShapeNum(self):
+        return len(self.grids)
+
+    @staticmethod
+    def isBakeable(shape):
+        if shape.shape_type not in (Shape.SQURE, Shape.TRIANGLE, Shape.SPHERE):
+            return False
+        material = shape.getMaterial()
+        return material is not None and material.getEmission() is None
+
+    def bake(self):
+        """
+            Trace the occlusion of every texel of every bakeable shape
+        """
+        if self.sampler is None:
+            self.sampler = MultiJitteredSampler()
+        shapes = self.scene.getAllShapes()
+        res = self.resolution
+        self.grids = {}
+        for index, shape in enumerate(shapes):
+            if AOBake.isBakeable(shape) is False:
+                continue
+            grid = array("d", bytes(8 * res * res))
+            for j in range(res):
+                for i in range(res):
+                    point, normal = self.__texelCenter(shape, (i + 0.5) / res,
+                                                       (j + 0.5) / res)
+                    grid[j * res + i] = self.__traceVisibility(shape, point,
+                                                               normal)
+            self.grids[shape] = grid
+            print("AO Bake: shape %d of %d" % (index + 1, len(shapes)))
+
+    def lookup(self, shape, point):
+        """
+            Return the bilinear filtered unoccluded fraction at a point of
+            the shape, None if the shape is not baked
+        """
+        grid = self.grids.get(shape)
+        if grid is None:
+            return None
+        u, v = self.__uvOf(shape, point)
+        return self.__sampleGrid(grid, u, v, shape.shape_type == Shape.SPHERE)
+
+    def save(self, file_name):
+        shapes = self.scene.getAllShapes()
+        with open(file_name, "wb") as f:
+            f.write(AOBake.MAGIC)
+            f.write(struct.pack("<iii", AOBake.VERSION, len(shapes),
+                                self.resolution))
+            for index, shape in enumerate(shapes):
+                grid = self.grids.get(shape)
+                if grid is None:
+                    continue
+                f.write(struct.pack("<ii", index, shape.shape_type))
+                if sys.byteorder == "big":
+                    grid = array("d", grid)
+                    grid.byteswap()
+                f.write(grid.tobytes())
+
+    @staticmethod
+    def load(file_name, scene):
+        """
+            Load a bake of the scene, raise ValueError if the file was
+            baked for another scene
+        """
+        shapes = scene.getAllShapes()
+        with open(file_name, "rb") as f:
+            data = f.read()
+        if data[:4] != AOBake.MAGIC:
+            raise ValueError("Not an AO bake file: %s" % (file_name,))
+        version, shape_num, res = struct.unpack_from("<iii", data, 4)
+        if version != AOBake.VERSION or shape_num != len(shapes):
+            raise ValueError("AO bake does not match the scene: %s" % (file_name,))
+
+        bake = AOBake(scene, res)
+        offset = 16
+        grid_size = 8 * res * res
+        while offset < len(data):
+            index, shape_type = struct.unpack_from("<ii", data, offset)
+            offset = offset + 8
+            if index >= len(shapes) or shapes[index].shape_type != shape_type:
+                raise ValueError("AO bake does not match the scene: %s" % (file_name,))
+            grid = array("d")
+            grid.frombytes(data[offset:offset + grid_size])
+            if sys.byteorder == "big":
+                grid.byteswap()
+            bake.grids[shapes[index]] = grid
+            offset = offset + grid_size
+        return bake
+
+    def __traceVisibility(self, shape, point, normal):
+        samplers = self.sampler.getNextHemiSphereSamplers(self.sampler_num, 1.0)
+
+        u, v, w = Vector.orthonormalBasis(normal)
+
+        visible_num = 0
+        for pu, pv, pw in samplers:
+            d = Vector(u.x * pu + v.x * pv + w.x * pw,
+                       u.y * pu + v.y * pv + w.y * pw,
+                       u.z * pu + v.z * pv + w.z * pw)
+            if self.scene.isIntersection(Ray(point, d), shape.getEp()) is False:
+                visible_num = visible_num + 1
+        return 1.0 * visible_num / len(samplers)
+
+    def __texelCenter(self, shape, u, v):
+        """
+            Return (point, normal) of the shape at the grid position (u, v)
+        """
+        if shape.shape_type == Shape.SQURE:
+            return shape.genSamplerPoint(Vector2(u, v)), shape.normal
+        elif shape.shape_type == Shape.TRIANGLE:
+            if u + v > 1.0:
+                # Texels across the hypotenuse use the closest edge point
+                s = 1.0 / (u + v)
+                u = u * s
+                v = v * s
+            e0 = shape.v1 - shape.v0
+            e1 = shape.v2 - shape.v0
+            point = shape.v0 + e0 * u + e1 * v
+            return point, shape.genNormal(point).normalized()
+        else:
+            phi = (u - 0.5) * 2.0 * math.pi
+            theta = v * math.pi
+            normal = Vector(math.sin(theta) * math.cos(phi), math.cos(theta),
+                            math.sin(theta) * math.sin(phi))
+            return shape.p + normal * shape.r, normal
+
+    def __uvOf(self, shape, point):
+        if shape.shape_type == Shape.SQURE:
+            local = point - shape.pos
+            return (Vector.dot(local, shape.right) / shape.size + 0.5,
+                    Vector.dot(local, shape.up) / shape.size + 0.5)
+        elif shape.shape_type == Shape.TRIANGLE:
+            e0 = shape.v1 - shape.v0
+            e1 = shape.v2 - shape.v0
+            local = point - shape.v0
+            d00 = Vector.dot(e0, e0)
+            d01 = Vector.dot(e0, e1)
+            d11 = Vector.dot(e1, e1)
+            d20 = Vector.dot(local, e0)
+            d21 = Vector.dot(local, e1)
+            denom = d00 * d11 - d01 * d01
+            return ((d11 * d20 - d01 * d21) / denom,
+                    (d00 * d21 - d01 * d20) / denom)
+        else:
+            normal = (point - shape.p).normalized()
+            phi = math.atan2(normal.z, normal.x)
+            theta = math.acos(max(-1.0, min(1.0, normal.y)))
+            return phi / (2.0 * math.pi) + 0.5, theta / math.pi
+
+    def __sampleGrid(self, grid, u, v, wrap_u):
+        res = self.resolution
+        x = u * res - 0.5
+        y = min(max(v * res - 0.5, 0.0), res - 1.0)
+        if wrap_u is False:
+            x = min(max(x, 0.0), res - 1.0)
+        x0 = int(math.floor(x))
+        y0 = int(y)
+        fx = x - x0
+        fy = y - y0
+        y1 = min(y0 + 1, res - 1)
+        if wrap_u is True:
+            x1 = (x0 + 1) % res
+            x0 = x0 % res
+        else:
+            x1 = min(x0 + 1, res - 1)
+        top = grid[y0 * res + x0] * (1.0 - fx) + grid[y0 * res + x1] * fx
+        bottom = grid[y1 * res + x0] * (1.0 - fx) + grid[y1 * res + x1] * fx
+        return top * (1.0 - fy) + bottom * fy
+
+
+if __name__ == "__main__":
+    from color import *
+    from material import *
+
+    s = Scene()
+    s.addShape(Squre(Vector(0.0, 0.0, 0.0), 10.0, Vector(0.0, 1.0, 0.0),
+                     Material.createMirror(0.1, 0.5, Color(1.0, 1.0, 1.0),
+                                           0.3, Color(1.0, 1.0, 1.0))))
+    s.addShape(Sphere(Vector(0.0, 1.0, 0.0), 1.0,
+                      Material.createMirror(0.1, 0.5, Color(1.0, 1.0, 1.0),
+                                            0.3, Color(1.0, 1.0, 1.0))))
+    bake = AOBake(s, 8, sampler_num=16)
+    bake.bake()
+    print(bake.lookup(s.getAllShapes()[0], Vector(0.0, 0.0, 0.0)))
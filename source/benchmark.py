@@ -0,0 +1,483 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Measure the cost of tracing a scene
+"""
+
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from array import array
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from camera import *
+from color import *
+from light import *
+from material import *
+from render import *
+from renderstats import *
+from sampler import *
+from scene import *
+from shade import *
+from tracer import *
+from vector import *
+from window import *
+
+
+__all__ = ["createBallsScene", "createMeshScene", "createAreaLightsScene",
+           "createAOScene", "createMirrorScene", "BENCH_SCENES",
+           "countAllocations", "benchAllocations", "measureScene",
+           "runBenchmarks"]
+
+
+def createBallsScene(width, height, sampler_num=4, ao_sampler_num=16,
+                     area_sampler_num=16):
+    """
+        The scene of main.render_many_balls with less samples, return the
+        tracer of the scene
+    """
+    s = Scene()
+    s.setAmbientLight(AmbientLight(0.7, Color(1.0, 1.0, 1.0)))
+
+    mat = Material.createEmission(10.0, Color(1.0, 1.0, 1.0))
+    shape = Squre(Vector(0.0, 30.0, 0.0), 40.0, Vector(0.0, -1.0, 0.0), mat)
+    shape.setEp(0.00001)
+    s.addShape(shape)
+    s.addAreaLight(AreaLight(shape, MultiJitteredSampler(), area_sampler_num))
+
+    balls = [(Vector(-8.1, 0.0, 8.1), Color(1.0, 0.0, 0.0)),
+             (Vector(8.1, 0.0, 8.1), Color(0.0, 1.0, 0.0)),
+             (Vector(8.1, 0.0, -8.1), Color(0.0, 0.0, 1.0)),
+             (Vector(-8.1, 0.0, -8.1), Color(1.0, 1.0, 0.0))]
+    for center, color in balls:
+        mat = Material.createMirror(0.1, 0.5, color, 0.3, Color(1.0, 1.0, 1.0))
+        shape = Sphere(center, 8.0, mat)
+        shape.setEp(0.00001)
+        s.addShape(shape)
+
+    mat = Material.createGlossy(0.6, 0.8, Color(1.0, 1.0, 1.0), 0.2,
+                                Color(0.0, 0.0, 1.0), 1.0)
+    shape = Squre(Vector(0.0, -8.0, 0.0), 400.0, Vector(0.0, 1.0, 0.0), mat)
+    shape.setEp(0.00001)
+    s.addShape(shape)
+
+    c = Camera(Vector(0.0, 60.0, -110.0), Vector(0.0, 0.0, 0.0), 0.01, 170.0,
+               1.0 * width / height)
+    sd = Phong(MultiJitteredSampler())
+    sd.setAOSamplerNum(ao_sampler_num)
+    sd.setEnableAO(True)
+    return Tracer(s, c, width, height, sd, 10, MultiJitteredSampler(), sampler_num)
+
+
+def createMeshScene(width, height, sampler_num=4, subdivision=24):
+    """
+        A sphere of 4 * subdivision^2 triangles on a plane, lit by one
+        area light, most of the time goes to the triangle tests
+    """
+    s = Scene()
+    s.setAmbientLight(AmbientLight(0.5, Color(1.0, 1.0, 1.0)))
+
+    mat = Material.createEmission(10.0, Color(1.0, 1.0, 1.0))
+    shape = Squre(Vector(0.0, 30.0, 0.0), 20.0, Vector(0.0, -1.0, 0.0), mat)
+    shape.setEp(0.00001)
+    s.addShape(shape)
+    s.addAreaLight(AreaLight(shape, MultiJitteredSampler(), 4))
+
+    vertices = array("d")
+    indices = array("i")
+    ring_num = subdivision
+    segment_num = 2 * subdivision
+    for i in range(ring_num + 1):
+        theta = math.pi * i / ring_num
+        for j in range(segment_num):
+            phi = 2.0 * math.pi * j / segment_num
+            vertices.extend((12.0 * math.sin(theta) * math.cos(phi),
+                             12.0 * math.cos(theta) + 4.0,
+                             12.0 * math.sin(theta) * math.sin(phi)))
+    for i in range(ring_num):
+        for j in range(segment_num):
+            v0 = i * segment_num + j
+            v1 = i * segment_num + (j + 1) % segment_num
+            v2 = v0 + segment_num
+            v3 = v1 + segment_num
+            indices.extend((v0, v2, v1, v1, v2, v3))
+    mat = Material.createGlossy(0.2, 0.7, Color(0.8, 0.6, 0.2), 0.3,
+                                Color(1.0, 1.0, 1.0), 20.0)
+    shape = TriangleMesh(vertices, indices, mat)
+    shape.setEp(0.00001)
+    s.addShape(shape)
+
+    mat = Material.createMirror(0.1, 0.6, Color(0.5, 0.5, 0.5), 0.2,
+                                Color(1.0, 1.0, 1.0))
+    shape = Squre(Vector(0.0, -8.0, 0.0), 400.0, Vector(0.0, 1.0, 0.0), mat)
+    shape.setEp(0.00001)
+    s.addShape(shape)
+
+    c = Camera(Vector(0.0, 30.0, -60.0), Vector(0.0, 0.0, 0.0), 0.01, 170.0,
+               1.0 * width / height)
+    sd = Phong(MultiJitteredSampler())
+    return Tracer(s, c, width, height, sd, 4, MultiJitteredSampler(), sampler_num)
+
+
+def createAreaLightsScene(width, height, sampler_num=4, light_num=16,
+                          area_sampler_num=16):
+    """
+        The balls under a grid of light_num small area lights of
+        different power, area_sampler_num shadow rays per shading point
+    """
+    tracer = createBallsScene(width, height, sampler_num, 4, 4)
+    s = tracer.getScene()
+    s.clearAreaLights()
+    side = int(math.ceil(math.sqrt(light_num)))
+    for index in range(light_num):
+        x = (index % side - 0.5 * (side - 1)) * 12.0
+        z = (index // side - 0.5 * (side - 1)) * 12.0
+        mat = Material.createEmission(2.0 + index % 4 * 4.0,
+                                      Color(1.0, 1.0, 1.0))
+        shape = Squre(Vector(x, 25.0, z), 4.0, Vector(0.0, -1.0, 0.0), mat)
+        shape.setEp(0.00001)
+        s.addShape(shape)
+        s.addAreaLight(AreaLight(shape, MultiJitteredSampler(), 4))
+    tracer.getShader().setAreaLightSampleNum(area_sampler_num)
+    tracer.getShader().setEnableAO(False)
+    return tracer
+
+
+def createAOScene(width, height, sampler_num=4, ao_sampler_num=64):
+    """
+        Spheres in a corner lit by the ambient light only, the time goes
+        to ambient occlusion rays
+    """
+    s = Scene()
+    s.setAmbientLight(AmbientLight(1.0, Color(1.0, 1.0, 1.0)))
+    color = Color(1.0, 1.0, 1.0)
+    mat = Material(AmbientMaterial(0.8, color), DiffuseMaterial(0.2, color),
+                   None, None, None)
+    walls = [(Vector(0.0, -8.0, 0.0), Vector(0.0, 1.0, 0.0)),
+             (Vector(0.0, 0.0, 20.0), Vector(0.0, 0.0, -1.0)),
+             (Vector(-20.0, 0.0, 0.0), Vector(1.0, 0.0, 0.0))]
+    for pos, normal in walls:
+        shape = Squre(pos, 80.0, normal, mat)
+        shape.setEp(0.00001)
+        s.addShape(shape)
+    for i in range(9):
+        shape = Sphere(Vector((i % 3) * 9.0 - 9.0, -4.0 + (i // 3) * 3.0,
+                              (i // 3) * 7.0 - 4.0), 4.0, mat)
+        shape.setEp(0.00001)
+        s.addShape(shape)
+
+    c = Camera(Vector(20.0, 25.0, -50.0), Vector(0.0, 0.0, 0.0), 0.01, 170.0,
+               1.0 * width / height)
+    sd = Phong(MultiJitteredSampler())
+    sd.setAOSamplerNum(ao_sampler_num)
+    sd.setEnableAO(True)
+    return Tracer(s, c, width, height, sd, 4, MultiJitteredSampler(), sampler_num)
+
+
+def createMirrorScene(width, height, sampler_num=4, depth=10):
+    """
+        A sphere between two facing mirrors, camera rays bounce up to
+        depth times
+    """
+    s = Scene()
+    s.setAmbientLight(AmbientLight(0.3, Color(1.0, 1.0, 1.0)))
+    s.setParallelLight(ParallelLight(1.0, Color(1.0, 1.0, 1.0),
+                                     Vector(-1.0, -2.0, 1.0).normalized()))
+    mat = Material.createMirror(0.05, 0.05, Color(1.0, 1.0, 1.0), 0.9,
+                                Color(1.0, 1.0, 1.0))
+    for x in (-20.0, 20.0):
+        shape = Squre(Vector(x, 0.0, 0.0), 200.0,
+                      Vector(-x / 20.0, 0.0, 0.0), mat)
+        shape.setEp(0.00001)
+        s.addShape(shape)
+    mat = Material.createMirror(0.1, 0.6, Color(1.0, 0.2, 0.2), 0.3,
+                                Color(1.0, 1.0, 1.0))
+    shape = Sphere(Vector(0.0, 0.0, 0.0), 6.0, mat)
+    shape.setEp(0.00001)
+    s.addShape(shape)
+
+    c = Camera(Vector(-12.0, 4.0, -30.0), Vector(20.0, 0.0, -20.0), 0.01, 170.0,
+               1.0 * width / height)
+    sd = Phong(MultiJitteredSampler())
+    return Tracer(s, c, width, height, sd, depth, MultiJitteredSampler(),
+                  sampler_num)
+
+
+# (name, function(width, height) returning the tracer) of the benchmark
+# scenes, in the order they are run
+BENCH_SCENES = [("balls", createBallsScene),
+                ("mesh", createMeshScene),
+                ("area_lights", createAreaLightsScene),
+                ("ao", createAOScene),
+                ("mirror", createMirrorScene)]
+
+
+def countAllocations(func, classes):
+    """
+        Call func and count the instances created of every class, return
+        (result of func, {class name: instance num})
+    """
+    counts = {}
+    inits = {}
+
+    def wrap(cls, init):
+        def countedInit(self, *args):
+            counts[cls.__name__] = counts[cls.__name__] + 1
+            init(self, *args)
+        return countedInit
+
+    for cls in classes:
+        counts[cls.__name__] = 0
+        inits[cls] = cls.__init__
+        cls.__init__ = wrap(cls, cls.__init__)
+    try:
+        result = func()
+    finally:
+        for cls in classes:
+            cls.__init__ = inits[cls]
+    return result, counts
+
+
+# Allocations of the tree before the __slots__ and in-place color work,
+# benchAllocations compares against them
+ALLOCATION_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   "allocation_baseline.json")
+
+
+def benchAllocations(width=16, height=16, seed=1, baseline_file=None,
+                     save=False):
+    """
+        Trace the balls scene with the scalar path, print the Vector and
+        Color allocations per ray, rays are shadow, occlusion and camera
+        rays alike. The counts are compared to the ones saved in the
+        JSON baseline_file for the same size and seed, save writes the
+        counts to it instead. Return {class name: instance num}
+    """
+    random.seed(seed)
+    tracer = createBallsScene(width, height)
+    tile = (0, 0, width, height)
+    start = time.time()
+    result, counts = countAllocations(lambda: tracer.traceTile(*tile),
+                                      [Vector, Color, Ray])
+    cost = time.time() - start
+    ray_num = max(counts["Ray"], 1)
+
+    baseline = None
+    if baseline_file is not None and save is True:
+        with open(baseline_file, "w") as f:
+            json.dump({"width": width, "height": height, "seed": seed,
+                       "counts": counts}, f, indent=2, sort_keys=True)
+    elif baseline_file is not None and os.path.exists(baseline_file):
+        with open(baseline_file, "r") as f:
+            baseline = json.load(f)
+        if (baseline["width"], baseline["height"], baseline["seed"]) != (
+            width, height, seed):
+            print("Baseline %s is for another size or seed" % (baseline_file,))
+            baseline = None
+
+    print("Rays: %d, Time: %fs" % (ray_num, cost))
+    for name in ("Vector", "Color"):
+        line = "%s: %d, %f per ray" % (name, counts[name],
+                                       1.0 * counts[name] / ray_num)
+        if baseline is not None:
+            base_ray_num = max(baseline["counts"]["Ray"], 1)
+            line = line + ", baseline %f per ray" % (
+                1.0 * baseline["counts"][name] / base_ray_num,)
+        print(line)
+    return counts
+
+
+def _getPeakRSS(who):
+    """
+        Return the peak resident set size in KB, None without resource
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss // 1024  # Bytes on macOS
+    return rss
+
+
+def measureScene(name, width, height, worker_num=1, seed=1, tile_size=16):
+    """
+        Render a benchmark scene with the tile renderer, return {wall_time,
+        ray_num, rays_per_second, peak_rss_kb, worker_peak_rss_kb}. The
+        peak RSS is the one of the process, run every measure in a fresh
+        process to get the peak of the scene, see runBenchmarks
+    """
+    random.seed(seed)
+    tracer = dict(BENCH_SCENES)[name](width, height)
+    stats = RenderStats()
+    tracer.setStats(stats)
+    with tempfile.TemporaryDirectory() as dir_name:
+        render = Render(Window(width, height, False), tracer,
+                        os.path.join(dir_name, "result.bmp"), worker_num,
+                        tile_size)
+        render.setSeed(seed)
+        render.render()
+    wall_time = render.getRenderTime()
+    if resource is None:
+        worker_peak_rss = None
+    else:
+        worker_peak_rss = _getPeakRSS(resource.RUSAGE_CHILDREN)
+    return {"wall_time": wall_time,
+            "ray_num": stats.getRayNum(),
+            "rays_per_second": stats.getRayNum() / max(wall_time, 1e-9),
+            "peak_rss_kb": None if resource is None
+                           else _getPeakRSS(resource.RUSAGE_SELF),
+            "worker_peak_rss_kb": worker_peak_rss}
+
+
+def _measureInProcess(conn, name, width, height, worker_num, seed, verbose):
+    if verbose is False:
+        sys.stdout = open(os.devnull, "w")
+    conn.send(measureScene(name, width, height, worker_num, seed))
+    conn.close()
+
+
+def _measureIsolated(name, width, height, worker_num, seed, verbose):
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_measureInProcess,
+                              args=(child_conn, name, width, height,
+                                    worker_num, seed, verbose))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    return result
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[mid]
+    return 0.5 * (values[mid - 1] + values[mid])
+
+
+def _findRegressions(history, entry, threshold, baseline_num):
+    """
+        Compare the rays per second of every scene to the median of the
+        last baseline_num runs of the same size. Only the serial measures
+        are compared, they repeat exactly at a fixed seed, see
+        Render.setSeed
+    """
+    regressions = []
+    for name, result in entry["scenes"].items():
+        for worker_key, measure in result["workers"].items():
+            if worker_key != "1":
+                continue
+            baseline = []
+            for old_entry in reversed(history):
+                old_result = old_entry["scenes"].get(name)
+                if (old_result is None
+                    or old_result["width"] != result["width"]
+                    or old_result["height"] != result["height"]
+                    or worker_key not in old_result["workers"]):
+                    continue
+                baseline.append(old_result["workers"][worker_key]["rays_per_second"])
+                if len(baseline) == baseline_num:
+                    break
+            if len(baseline) == 0:
+                continue
+            expected = _median(baseline)
+            if measure["rays_per_second"] < expected * (1.0 - threshold):
+                regressions.append(
+                    "%s with %s workers: %f rays per second, baseline %f"
+                    % (name, worker_key, measure["rays_per_second"], expected))
+    return regressions
+
+
+def runBenchmarks(names=None, width=48, height=48, worker_nums=(1, 2), seed=1,
+                  history_file="benchmark_history.json", threshold=0.1,
+                  baseline_num=5, verbose=False):
+    """
+        Measure every scene with every worker number, each measure in a
+        fresh process. The run is appended to the JSON history file,
+        None does not keep a history. Return (run entry, regressions),
+        a regression is a scene whose serial rays per second dropped more
+        than threshold below the median of the last baseline_num runs
+    """
+    if names is None:
+        names = [name for name, func in BENCH_SCENES]
+    entry = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+             "python": platform.python_version(),
+             "machine": platform.machine(),
+             "cpu_num": multiprocessing.cpu_count(),
+             "seed": seed,
+             "scenes": {}}
+    for name in names:
+        workers = {}
+        for worker_num in worker_nums:
+            measure = _measureIsolated(name, width, height, worker_num, seed,
+                                       verbose)
+            workers[str(worker_num)] = measure
+            print("Benchmark %s, %d workers: %fs, %d rays, %f rays per second, "
+                  "peak RSS %s KB"
+                  % (name, worker_num, measure["wall_time"], measure["ray_num"],
+                     measure["rays_per_second"], measure["peak_rss_kb"]))
+        base = workers.get("1")
+        for measure in workers.values():
+            measure["scaling"] = None
+            if base is not None:
+                measure["scaling"] = (measure["rays_per_second"]
+                                      / max(base["rays_per_second"], 1e-9))
+        entry["scenes"][name] = {"width": width, "height": height,
+                                 "workers": workers}
+
+    history = []
+    if history_file is not None and os.path.exists(history_file):
+        with open(history_file, "r") as f:
+            history = json.load(f)
+    regressions = _findRegressions(history, entry, threshold, baseline_num)
+    if history_file is not None:
+        history.append(entry)
+        with open(history_file, "w") as f:
+            json.dump(history, f, indent=2, sort_keys=True)
+    for regression in regressions:
+        print("Benchmark Regression: %s" % (regression,))
+    return entry, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render benchmark scenes")
+    parser.add_argument("--scenes", nargs="*", default=None,
+                        choices=[name for name, func in BENCH_SCENES])
+    parser.add_argument("--size", type=int, nargs=2, default=(48, 48))
+    parser.add_argument("--workers", type=int, nargs="*", default=(1, 2))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--history", default="benchmark_history.json")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--baseline", type=int, default=5)
+    parser.add_argument("--allocations", action="store_true")
+    parser.add_argument("--allocation-baseline", default=ALLOCATION_BASELINE)
+    parser.add_argument("--save-allocation-baseline", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.allocations is True:
+        benchAllocations(seed=args.seed,
+                         baseline_file=args.allocation_baseline,
+                         save=args.save_allocation_baseline)
+        sys.exit(0)
+    entry, regressions = runBenchmarks(args.scenes, args.size[0], args.size[1],
+                                       args.workers, args.seed, args.history,
+                                       args.threshold, args.baseline,
+                                       args.verbose)
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Bounding volume hierarchy, accelerate ray intersection queries
+"""
+
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from vector import *
+
+
+__all__ = ["AABB", "BVH"]
+
+
+class AABB(object):
+    """
+        Axis aligned bounding box
+    """
+
+    def __init__(self, pmin, pmax):
+        self.pmin = pmin
+        self.pmax = pmax
+
+    @staticmethod
+    def fromPoints(points):
+        pmin = Vector(points[0].x, points[0].y, points[0].z)
+        pmax = Vector(points[0].x, points[0].y, points[0].z)
+        for p in points[1:]:
+            pmin.x = min(pmin.x, p.x)
+            pmin.y = min(pmin.y, p.y)
+            pmin.z = min(pmin.z, p.z)
+            pmax.x = max(pmax.x, p.x)
+            pmax.y = max(pmax.y, p.y)
+            pmax.z = max(pmax.z, p.z)
+        return AABB(pmin, pmax)
+
+    @staticmethod
+    def union(b0, b1):
+        return AABB(Vector(min(b0.pmin.x, b1.pmin.x),
+                           min(b0.pmin.y, b1.pmin.y),
+                           min(b0.pmin.z, b1.pmin.z)),
+                    Vector(max(b0.pmax.x, b1.pmax.x),
+                           max(b0.pmax.y, b1.pmax.y),
+                           max(b0.pmax.z, b1.pmax.z)))
+
+    def getMin(self):
+        return self.pmin
+
+    def getMax(self):
+        return self.pmax
+
+    def getCenter(self):
+        return (self.pmin + self.pmax) * 0.5
+
+    def getBounds(self):
+        """
+            Return (min x, min y, min z, max x, max y, max z)
+        """
+        return (self.pmin.x, self.pmin.y, self.pmin.z,
+                self.pmax.x, self.pmax.y, self.pmax.z)
+
+
+class BVH(object):
+    """
+        Bounding volume hierarchy over a list of items, the bounds of every
+        item are given as (min x, min y, min z, max x, max y, max z), see
+        AABB.getBounds, or as a flat array('d') of these 6 values per item.
+        With items None the items are the indices 0..n-1, they are kept
+        in an array('i') so large meshes need no Python object per face.
+
+        The tree is stored depth first in flat arrays: the left child of an
+        interior node is the next node, the right child index is stored in
+        offsets. A leaf stores the index of its first item in offsets and
+        the number of items in counts, an interior node has a count of 0.
+
+        The items are opaque to the tree, queries take a hit function
+        hit_func(item, ray, t_min, t_max) that returns the hit distance of
+        the item, or None if the item is not hit inside (t_min, t_max).
+    """
+
+    LEAF_SIZE = 4
+
+    def __init__(self, items, bounds, leaf_size=LEAF_SIZE):
+        self.leaf_size = leaf_size
+        self.bounds = array("d")
+        self.offsets = array("l")
+        self.counts = array("l")
+        self.axes = array("b")
+        self.items = []
+
+        if not isinstance(bounds, array):
+            flat_bounds = array("d")
+            for b in bounds:
+                flat_bounds.extend(b)
+            bounds = flat_bounds
+        item_num = len(bounds) // 6
+        if item_num == 0:
+            return
+
+        # One array per bound and center component, the build reads them
+        # with min, max and sorted instead of a Python loop per item
+        bounds = [bounds[c::6] for c in range(6)]
+        centers = [array("d", map(lambda lo, hi: (lo + hi) * 0.5,
+                                  bounds[c], bounds[c + 3]))
+                   for c in range(3)]
+
+        order = array("i", range(item_num))
+        self.__build(order, 0, item_num, bounds, centers)
+        if items is None:
+            self.items = order
+        else:
+            self.items = [items[i] for i in order]
+
+    def getNodeNum(self):
+        return len(self.counts)
+
+    def getItems(self):
+        return self.items
+
+    def __build(self, order, start, end, bounds, centers):
+        # bounds and centers are lists of one array per component
+        # Build iteratively, a (start, end, parent) entry whose parent is
+        # not -1 patches the right child index of the parent node
+        stack = [(start, end, -1)]
+        while stack:
+            start, end, parent = stack.pop()
+            node = len(self.counts)
+            if parent >= 0:
+                self.offsets[parent] = node
+
+            items = order[start:end]
+            for c in range(3):
+                self.bounds.append(min(map(bounds[c].__getitem__, items)))
+            for c in range(3, 6):
+                self.bounds.append(max(map(bounds[c].__getitem__, items)))
+
+            # Split along the longest axis of the centers at the median
+            extent = tuple(max(map(centers[c].__getitem__, items))
+                           - min(map(centers[c].__getitem__, items))
+                           for c in range(3))
+            axis = extent.index(max(extent))
+            if end - start <= self.leaf_size or extent[axis] <= 0.0:
+                self.offsets.append(start)
+                self.counts.append(end - start)
+                self.axes.append(axis)
+                continue
+
+            self.offsets.append(0)
+            self.counts.append(0)
+            self.axes.append(axis)
+            order[start:end] = array("i", sorted(
+                items, key=centers[axis].__getitem__))
+            mid = (start + end) // 2
+            # Push the right child first so the left child is the next node
+            stack.append((mid, end, node))
+            stack.append((start, mid, -1))
+
+    def findItem(self, point, hit_func, ep=0.0):
+        """
+            Return the first item whose bounds contain the point (grown by
+            ep) and for which hit_func(item, point) is True, None if there
+            is no such item
+        """
+        if len(self.counts) == 0:
+            return None
+
+        px = point.x
+        py = point.y
+        pz = point.z
+        bounds = self.bounds
+        offsets = self.offsets
+        counts = self.counts
+        items = self.items
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            k = node * 6
+            if (px < bounds[k] - ep or px > bounds[k + 3] + ep or
+                py < bounds[k + 1] - ep or py > bounds[k + 4] + ep or
+                pz < bounds[k + 2] - ep or pz > bounds[k + 5] + ep):
+                continue
+
+            count = counts[node]
+            if count > 0:
+                first = offsets[node]
+                for i in range(first, first + count):
+                    if hit_func(items[i], point) is True:
+                        return items[i]
+            else:
+                stack.append(offsets[node])
+                stack.append(node + 1)
+        return None
+
+    def __invDir(self, ray):
+        d = ray.d
+        ix = 1.0 / d.x if d.x != 0.0 else 1e32
+        iy = 1.0 / d.y if d.y != 0.0 else 1e32
+        iz = 1.0 / d.z if d.z != 0.0 else 1e32
+        return ix, iy, iz
+
+    def closestHit(self, ray, hit_func, t_min=0.0, t_max=float("inf")):
+        """
+            Return (item, t) of the closest hit item, (None, t_max) if
+            nothing is hit
+        """
+        closest, t_max, face = self.__closestHit(ray, hit_func, t_min, t_max,
+                                                 False)
+        return closest, t_max
+
+    def closestHitFace(self, ray, hit_func, t_min=0.0, t_max=float("inf")):
+        """
+            Same as closestHit, but hit_func returns (t, face) with t None
+            for a miss. Return (item, t, face) of the closest hit item,
+            (None, t_max, None) if nothing is hit
+        """
+        return self.__closestHit(ray, hit_func, t_min, t_max, True)
+
+    def __closestHit(self, ray, hit_func, t_min, t_max, with_face):
+        closest = None
+        closest_face = None
+        if len(self.counts) == 0:
+            return closest, t_max, closest_face
+
+        ox = ray.o.x
+        oy = ray.o.y
+        oz = ray.o.z
+        ix, iy, iz = self.__invDir(ray)
+        neg = (ix < 0.0, iy < 0.0, iz < 0.0)
+        bounds = self.bounds
+        offsets = self.offsets
+        counts = self.counts
+        axes = self.axes
+        items = self.items
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            k = node * 6
+            tx0 = (bounds[k] - ox) * ix
+            tx1 = (bounds[k + 3] - ox) * ix
+            if tx0 > tx1:
+                tx0, tx1 = tx1, tx0
+            ty0 = (bounds[k + 1] - oy) * iy
+            ty1 = (bounds[k + 4] - oy) * iy
+            if ty0 > ty1:
+                ty0, ty1 = ty1, ty0
+            tz0 = (bounds[k + 2] - oz) * iz
+            tz1 = (bounds[k + 5] - oz) * iz
+            if tz0 > tz1:
+                tz0, tz1 = tz1, tz0
+            t_enter = max(tx0, ty0, tz0)
+            t_exit = min(tx1, ty1, tz1)
+            if t_enter > t_exit or t_exit < t_min or t_enter > t_max:
+                continue
+
+            count = counts[node]
+            if count > 0:
+                first = offsets[node]
+                for i in range(first, first + count):
+                    if with_face is True:
+                        t, face = hit_func(items[i], ray, t_min, t_max)
+                    else:
+                        t = hit_func(items[i], ray, t_min, t_max)
+                        face = None
+                    if t is not None:
+                        t_max = t
+                        closest = items[i]
+                        closest_face = face
+            elif neg[axes[node]]:
+                # Visit the near child first
+                stack.append(node + 1)
+                stack.append(offsets[node])
+            else:
+                stack.append(offsets[node])
+                stack.append(node + 1)
+        return closest, t_max, closest_face
+
+    def anyHit(self, ray, hit_func, t_min=0.0, t_max=float("inf")):
+        """
+            Return the first item found that is hit before t_max, None if
+            nothing is hit
+        """
+        if len(self.counts) == 0:
+            return None
+
+        ox = ray.o.x
+        oy = ray.o.y
+        oz = ray.o.z
+        ix, iy, iz = self.__invDir(ray)
+        bounds = self.bounds
+        offsets = self.offsets
+        counts = self.counts
+        items = self.items
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            k = node * 6
+            tx0 = (bounds[k] - ox) * ix
+            tx1 = (bounds[k + 3] - ox) * ix
+            if tx0 > tx1:
+                tx0, tx1 = tx1, tx0
+            ty0 = (bounds[k + 1] - oy) * iy
+            ty1 = (bounds[k + 4] - oy) * iy
+            if ty0 > ty1:
+                ty0, ty1 = ty1, ty0
+            tz0 = (bounds[k + 2] - oz) * iz
+            tz1 = (bounds[k + 5] - oz) * iz
+            if tz0 > tz1:
+                tz0, tz1 = tz1, tz0
+            t_enter = max(tx0, ty0, tz0)
+            t_exit = min(tx1, ty1, tz1)
+            if t_enter > t_exit or t_exit < t_min or t_enter > t_max:
+                continue
+
+            count = counts[node]
+            if count > 0:
+                first = offsets[node]
+                for i in range(first, first + count):
+                    if hit_func(items[i], ray, t_min, t_max) is not None:
+                        return items[i]
+            else:
+                stack.append(offsets[node])
+                stack.append(node + 1)
+        return None
+
+
+    def packetLeaves(self, origins, directions, t_min, t_max):
+        """
+            Cull a packet of rays given as numpy arrays against the tree,
+            origins is (3,) or (N, 3), directions is (N, 3) and t_max is
+            an array of N distances. Yield (items, rays) for every leaf
+            box hit by some rays, rays are their indices in the packet.
+            t_max is read again for every node, the caller may shorten it
+            between two leaves
+        """
+        if len(self.counts) == 0:
+            return
+
+        origins = numpy.broadcast_to(origins, directions.shape)
+        nonzero = directions != 0.0
+        inv_dirs = numpy.where(nonzero,
+                               1.0 / numpy.where(nonzero, directions, 1.0),
+                               1e32)
+        bounds = numpy.frombuffer(self.bounds, dtype=numpy.float64)
+        bounds = bounds.reshape(-1, 6)
+        offsets = self.offsets
+        counts = self.counts
+        items = self.items
+
+        stack = [(0, numpy.arange(len(directions)))]
+        while stack:
+            node, rays = stack.pop()
+            inv_dir = inv_dirs[rays]
+            t0 = (bounds[node, :3] - origins[rays]) * inv_dir
+            t1 = (bounds[node, 3:] - origins[rays]) * inv_dir
+            t_enter = numpy.minimum(t0, t1).max(axis=1)
+            t_exit = numpy.maximum(t0, t1).min(axis=1)
+            rays = rays[(t_enter <= t_exit) & (t_exit >= t_min)
+                        & (t_enter <= t_max[rays])]
+            if len(rays) == 0:
+                continue
+
+            count = counts[node]
+            if count > 0:
+                first = offsets[node]
+                yield items[first:first + count], rays
+            else:
+                stack.append((offsets[node], rays))
+                stack.append((node + 1, rays))
+
+
+if __name__ == "__main__":
+    import random
+
+    class Point(object):
+        def __init__(self, p):
+            self.p = p
+
+    points = []
+    bounds = []
+    for i in range(1000):
+        p = Vector(random.random(), random.random(), random.random())
+        points.append(Point(p))
+        box = AABB(p - Vector(0.01, 0.01, 0.01), p + Vector(0.01, 0.01, 0.01))
+        bounds.append(box.getBounds())
+    bvh = BVH(points, bounds)
+    print(bvh.getNodeNum())
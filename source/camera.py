@@ -33,6 +33,7 @@ class Camera(object):
         up = Vector(0.0, 1.0, 0.0)
         self.view_x_axis = Vector.cross(up, look_at)
         self.view_y_axis = Vector.cross(look_at, self.view_x_axis)
+        self.ray_tables = {}
 
     def getPos(self):
         return self.pos
@@ -64,6 +65,47 @@ class Camera(object):
     def getViewYAxis(self):
         return self.view_y_axis
 
+    def getRayTable(self, width, height):
+        """
+            Return (cols, rows, step_x, step_y) of an image of width x
+            height pixels, the direction to the subpixel (sx, sy) in [0, 1)
+            of the pixel (x, y) is
+            cols[x] + rows[y] + step_x * sx + step_y * sy
+            All entries are (x, y, z) tuples, rows include the offset from
+            the camera to the view center. The table is built once per
+            resolution
+        """
+        key = (width, height)
+        if key not in self.ray_tables:
+            self.ray_tables[key] = self.__buildRayTable(width, height)
+        return self.ray_tables[key]
+
+    def __buildRayTable(self, width, height):
+        # The subpixel (x - 0.5 + sx, y - 0.5 + sy) is at
+        # center + x_axis * ((x - 0.5 + sx) / width - 0.5) * view_width
+        #        + y_axis * (0.5 - (y - 0.5 + sy) / height) * view_height
+        x_axis = self.view_x_axis
+        y_axis = self.view_y_axis
+        center = self.view_center - self.pos
+
+        cols = []
+        for x in range(width):
+            scene_x = ((x - 0.5) / width - 0.5) * self.view_width
+            cols.append((x_axis.x * scene_x, x_axis.y * scene_x, x_axis.z * scene_x))
+
+        rows = []
+        for y in range(height):
+            scene_y = (0.5 - (y - 0.5) / height) * self.view_height
+            rows.append((center.x + y_axis.x * scene_y,
+                         center.y + y_axis.y * scene_y,
+                         center.z + y_axis.z * scene_y))
+
+        dx = self.view_width / width
+        dy = -self.view_height / height
+        step_x = (x_axis.x * dx, x_axis.y * dx, x_axis.z * dx)
+        step_y = (y_axis.x * dy, y_axis.y * dy, y_axis.z * dy)
+        return cols, rows, step_x, step_y
+
 
 if __name__ == "__main__":
     c = Camera(Vector(0.0, 0.0, 0.0), Vector(0.0, 0.0, 100.0), 1.0, 90.0, 800.0 / 600.0)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Save and restore the state of an unfinished render
+"""
+
+
+import os
+import struct
+import time
+from array import array
+
+
+__all__ = ["Checkpoint",]
+
+
+class Checkpoint(object):
+    """
+        Render state on disk: the render settings, the current pass, the
+        indices of the tiles finished in that pass and the raw content of
+        the frame buffers. The file is written next to its final name and
+        renamed, a killed process leaves the previous checkpoint intact
+    """
+
+    MAGIC = b"RTCK"
+    VERSION = 1
+
+    def __init__(self, file_name, interval=60.0):
+        self.file_name = file_name
+        self.interval = interval
+        self.save_time = time.time()
+
+    def getFileName(self):
+        return self.file_name
+
+    def getInterval(self):
+        return self.interval
+
+    def isDue(self):
+        return time.time() - self.save_time >= self.interval
+
+    def save(self, settings, pass_index, done_tiles, buffers):
+        """
+            settings is a tuple of ints that must match on load, buffers
+            is a list of FrameBuffer
+        """
+        tmp_name = self.file_name + ".tmp"
+        done_tiles = array("i", sorted(done_tiles))
+        with open(tmp_name, "wb") as f:
+            f.write(Checkpoint.MAGIC)
+            f.write(struct.pack("<iii", Checkpoint.VERSION, len(settings),
+                                pass_index))
+            f.write(array("i", settings).tobytes())
+            f.write(struct.pack("<i", len(done_tiles)))
+            f.write(done_tiles.tobytes())
+            for buf in buffers:
+                data = buf.toBytes()
+                f.write(struct.pack("<q", len(data)))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, self.file_name)
+        self.save_time = time.time()
+
+    def load(self, settings, buffers):
+        """
+            Fill the buffers from the checkpoint and return (pass index,
+            set of finished tile indices). Return None and leave the
+            buffers untouched if there is no checkpoint or it was saved
+            with other settings
+        """
+        if not os.path.exists(self.file_name):
+            return None
+        with open(self.file_name, "rb") as f:
+            data = f.read()
+        if data[:4] != Checkpoint.MAGIC:
+            return None
+        version, setting_num, pass_index = struct.unpack_from("<iii", data, 4)
+        offset = 16
+        saved_settings = array("i")
+        saved_settings.frombytes(data[offset:offset + 4 * setting_num])
+        offset = offset + 4 * setting_num
+        if version != Checkpoint.VERSION or tuple(saved_settings) != tuple(settings):
+            return None
+
+        tile_num = struct.unpack_from("<i", data, offset)[0]
+        offset = offset + 4
+        done_tiles = array("i")
+        done_tiles.frombytes(data[offset:offset + 4 * tile_num])
+        offset = offset + 4 * tile_num
+
+        chunks = []
+        for buf in buffers:
+            size = struct.unpack_from("<q", data, offset)[0]
+            offset = offset + 8
+            if size != buf.getMemorySize():
+                return None
+            chunks.append(data[offset:offset + size])
+            offset = offset + size
+        for buf, chunk in zip(buffers, chunks):
+            buf.fromBytes(chunk)
+        self.save_time = time.time()
+        return pass_index, set(done_tiles)
+
+    def remove(self):
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+
+if __name__ == "__main__":
+    from framebuffer import *
+
+    fb = FrameBuffer(2, 2)
+    fb[0] = 0.5
+    cp = Checkpoint("checkpoint.bin")
+    cp.save((2, 2), 0, set([1]), [fb])
+    fb2 = FrameBuffer(2, 2)
+    print(cp.load((2, 2), [fb2]), fb2[0])
+    cp.remove()
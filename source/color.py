@@ -16,31 +16,68 @@ __all__ = ["Color",]
 
 
 class Color(object):
+    """
+        RGB color. The operators return new colors, the in place methods
+        iadd, iscale, iaddScaled and iaddProduct modify the color and
+        return it, they are used to accumulate light without temporaries
+    """
+
+    __slots__ = ("r", "g", "b")
+
     def __init__(self, r,g ,b):
         self.r = r
         self.g = g
         self.b = b
 
     def __add__(self, c):
-        result = Color(0.0, 0.0, 0.0)
-        result.r = self.r + c.r
-        result.g = self.g + c.g
-        result.b = self.b + c.b
-        return result
+        return Color(self.r + c.r, self.g + c.g, self.b + c.b)
     
     def __mul__(self, f):
-        result = Color(0.0, 0.0, 0.0)
-        if isinstance(f, float):
-            result.r = self.r * f
-            result.g = self.g * f
-            result.b = self.b * f
-        elif isinstance(f, Color):
-            result.r = self.r * f.r
-            result.g = self.g * f.g
-            result.b = self.b * f.b
-        else:
-            raise TypeError
-        return result
+        """
+            Multiply by a color component wise, or by a number
+        """
+        if f.__class__ is Color:
+            return Color(self.r * f.r, self.g * f.g, self.b * f.b)
+        return Color(self.r * f, self.g * f, self.b * f)
+
+    def scale(self, f):
+        return Color(self.r * f, self.g * f, self.b * f)
+
+    def modulate(self, c):
+        return Color(self.r * c.r, self.g * c.g, self.b * c.b)
+
+    def iadd(self, c):
+        self.r = self.r + c.r
+        self.g = self.g + c.g
+        self.b = self.b + c.b
+        return self
+
+    def iscale(self, f):
+        self.r = self.r * f
+        self.g = self.g * f
+        self.b = self.b * f
+        return self
+
+    def iaddScaled(self, c, f):
+        """
+            self = self + c * f
+        """
+        self.r = self.r + c.r * f
+        self.g = self.g + c.g * f
+        self.b = self.b + c.b * f
+        return self
+
+    def iaddProduct(self, c0, c1, f):
+        """
+            self = self + c0 * c1 * f
+        """
+        self.r = self.r + c0.r * c1.r * f
+        self.g = self.g + c0.g * c1.g * f
+        self.b = self.b + c0.b * c1.b * f
+        return self
+
+    def getLuminance(self):
+        return 0.2126 * self.r + 0.7152 * self.g + 0.0722 * self.b
 
     def getColorStr(self):
         s = "#"
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Distribute the tiles of a render to worker machines over TCP
+"""
+
+
+import multiprocessing
+import pickle
+import queue
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+from array import array
+
+from renderstats import *
+
+
+__all__ = ["DEFAULT_PORT", "Coordinator", "runWorker", "startLocalWorkers"]
+
+
+DEFAULT_PORT = 7130
+
+
+def _sendBytes(sock, data):
+    sock.sendall(struct.pack("<q", len(data)))
+    sock.sendall(data)
+
+
+def _sendMessage(sock, message):
+    _sendBytes(sock, pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+
+def _recvExactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        size = size - len(chunk)
+    return b"".join(chunks)
+
+
+def _recvMessage(sock):
+    """
+        Return the next message, None if the peer closed the connection
+    """
+    header = _recvExactly(sock, 8)
+    if header is None:
+        return None
+    data = _recvExactly(sock, struct.unpack("<q", header)[0])
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+
+class Coordinator(object):
+    """
+        Hand out the tiles of a render to the workers connected over TCP.
+        The tracer is pickled once and the same bytes are sent to every
+        worker when it connects, after that only (tile, sampler_num, seed)
+        tasks and the traced tiles go over the wire. A worker that
+        disconnects, fails to send or takes longer than tile_timeout
+        seconds for a tile is dropped and its tile is queued again for the
+        other workers.
+
+        Workers may connect and leave at any time while the coordinator is
+        running. Messages are pickles, only use it on a trusted network
+    """
+
+    def __init__(self, tracer, host="", port=DEFAULT_PORT, tile_timeout=None):
+        self.tracer = tracer
+        self.host = host
+        self.port = port
+        self.tile_timeout = tile_timeout
+        self.tracer_data = None
+        self.server = None
+        self.accept_thread = None
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.closed = False
+        self.retry_num = 0
+
+    def getAddress(self):
+        """
+            Return the (host, port) the coordinator listens on, the port
+            is the bound one if the coordinator was created with port 0
+        """
+        if self.server is None:
+            return self.host, self.port
+        return self.server.getsockname()[:2]
+
+    def getWorkerNum(self):
+        with self.lock:
+            return len(self.connections)
+
+    def getRetryNum(self):
+        """
+            Return the number of tiles queued again after their worker
+            was lost
+        """
+        return self.retry_num
+
+    def start(self):
+        self.tracer_data = pickle.dumps(self.tracer, pickle.HIGHEST_PROTOCOL)
+        self.closed = False
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(16)
+        self.server.settimeout(0.2)
+        self.accept_thread = threading.Thread(target=self.__acceptLoop)
+        self.accept_thread.daemon = True
+        self.accept_thread.start()
+        print("Coordinator: listen on %s:%d, tracer %d bytes"
+              % (self.getAddress() + (len(self.tracer_data),)))
+
+    def traceTiles(self, tasks, buffers):
+        """
+            Trace the (tile, sampler_num, seed) tasks on the workers, see
+            render._traceTileWith, every tile
+            is written to the (color FrameBuffer, spp FrameBuffer) buffers.
+            Yield (tile, cache stats, stats counters) in the order the
+            tiles finish, like the tasks of the worker pool of Render
+        """
+        color_buf, spp_buf = buffers
+        for task in tasks:
+            self.tasks.put(task)
+        remain_num = len(tasks)
+        wait_time = time.time()
+        try:
+            while remain_num > 0:
+                try:
+                    result = self.results.get(timeout=1.0)
+                except queue.Empty:
+                    if self.getWorkerNum() == 0 and time.time() - wait_time > 5.0:
+                        print("Coordinator: waiting for workers on %s:%d"
+                              % self.getAddress())
+                        wait_time = time.time()
+                    continue
+                if result[0] == "error":
+                    raise RuntimeError("Worker failed on tile %s:\n%s"
+                                       % (result[1], result[2]))
+                tile, tile_buf, tile_spp_buf, stats, counters = result[1:]
+                x0, y0, x1, y1 = tile
+                color_buf.writeTile(x0, y0, x1, y1, tile_buf)
+                spp_buf.writeTile(x0, y0, x1, y1, tile_spp_buf)
+                remain_num = remain_num - 1
+                yield tile, stats, counters
+        finally:
+            if remain_num > 0:
+                self.__dropTasks()
+
+    def close(self):
+        """
+            Tell the idle workers to quit and drop the busy ones
+        """
+        self.closed = True
+        if self.accept_thread is not None:
+            self.accept_thread.join()
+            self.accept_thread = None
+        with self.lock:
+            connections = list(self.connections.items())
+        for conn, thread in connections:
+            thread.join(1.0)
+            if thread.is_alive() is True:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                thread.join()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    def __dropTasks(self):
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __acceptLoop(self):
+        while self.closed is False:
+            try:
+                conn, address = self.server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            thread = threading.Thread(target=self.__serveWorker,
+                                      args=(conn, address))
+            thread.daemon = True
+            with self.lock:
+                self.connections[conn] = thread
+            thread.start()
+
+    def __serveWorker(self, conn, address):
+        print("Coordinator: worker %s:%d connected" % address[:2])
+        task = None
+        try:
+            _sendBytes(conn, self.tracer_data)
+            conn.settimeout(self.tile_timeout)
+            while self.closed is False:
+                try:
+                    task = self.tasks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                _sendMessage(conn, ("tile",) + task)
+                result = _recvMessage(conn)
+                if result is None:
+                    break
+                self.results.put(result)
+                task = None
+            if self.closed is True:
+                _sendMessage(conn, ("quit",))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        finally:
+            if task is not None and self.closed is False:
+                with self.lock:
+                    self.retry_num = self.retry_num + 1
+                self.tasks.put(task)
+                print("Coordinator: worker %s:%d lost, retry tile %s"
+                      % (address[0], address[1], task[0]))
+            with self.lock:
+                del self.connections[conn]
+            conn.close()
+
+
+def _serveCoordinator(sock):
+    """
+        Trace tiles for one coordinator until it says quit, return the
+        number of traced tiles
+    """
+    header = _recvExactly(sock, 8)
+    if header is None:
+        return 0
+    data = _recvExactly(sock, struct.unpack("<q", header)[0])
+    if data is None:
+        return 0
+    tracer = pickle.loads(data)
+    random.seed()
+    tile_num = 0
+    while True:
+        message = _recvMessage(sock)
+        if message is None or message[0] == "quit":
+            return tile_num
+        tile, sampler_num, seed = message[1:]
+        if seed is not None:
+            random.seed(seed)
+        x0, y0, x1, y1 = tile
+        try:
+            tile_buf = array("f", tracer.traceTile(x0, y0, x1, y1, sampler_num))
+            tile_spp_buf = array("i", tracer.getTileSppBuf())
+        except Exception:
+            _sendMessage(sock, ("error", tile, traceback.format_exc()))
+            return tile_num
+        _sendMessage(sock, ("done", tile, tile_buf, tile_spp_buf,
+                            popOcclusionCacheStats(tracer),
+                            popStatsCounters(tracer)))
+        tile_num = tile_num + 1
+
+
+def runWorker(host="localhost", port=DEFAULT_PORT, connect_timeout=30.0,
+              persistent=False):
+    """
+        Connect to the coordinator and trace the tiles it sends, keep
+        trying to connect for connect_timeout seconds, forever if it is
+        None. A persistent worker waits for the next coordinator after a
+        render is done, for example the next frame of an animation.
+        Return the number of traced tiles
+    """
+    tile_num = 0
+    while True:
+        sock = None
+        start = time.time()
+        while sock is None:
+            try:
+                sock = socket.create_connection((host, port))
+            except OSError:
+                if (connect_timeout is not None
+                    and time.time() - start > connect_timeout):
+                    return tile_num
+                time.sleep(0.2)
+        try:
+            tile_num = tile_num + _serveCoordinator(sock)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+        if persistent is False:
+            return tile_num
+
+
+def startLocalWorkers(host, port, worker_num):
+    """
+        Start worker_num worker processes on this machine, return them
+        so they can be joined. They are spawned, not forked, a forked
+        worker would hold copies of the sockets of the coordinator and
+        hide the disconnect of other workers
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(worker_num):
+        worker = context.Process(target=runWorker, args=(host, port))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+if __name__ == "__main__":
+    # Start a worker: distributed.py host [port] [--persistent]
+    argv = [arg for arg in sys.argv[1:] if arg != "--persistent"]
+    host = "localhost"
+    port = DEFAULT_PORT
+    if len(argv) > 0:
+        host = argv[0]
+    if len(argv) > 1:
+        port = int(argv[1])
+    print("Worker: %d tiles traced"
+          % (runWorker(host, port, persistent="--persistent" in sys.argv),))
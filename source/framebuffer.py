@@ -0,0 +1,186 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Typed frame buffer, can be shared with worker processes
+"""
+
+
+from array import array
+from multiprocessing import sharedctypes
+
+
+__all__ = ["FrameBuffer", "TileView", "AccumulationBuffer"]
+
+
+class FrameBuffer(object):
+    """
+        Flat buffer of width * height pixels with channel_num values each,
+        backed by array(typecode), or by shared memory if shared is True.
+        A shared buffer must be created before the worker processes, they
+        write to it in place
+    """
+
+    def __init__(self, width, height, channel_num=3, typecode="f", shared=False):
+        self.width = width
+        self.height = height
+        self.channel_num = channel_num
+        self.typecode = typecode
+        self.shared = shared
+        size = width * height * channel_num
+        if shared is True:
+            self.data = sharedctypes.RawArray(typecode, size)
+        else:
+            self.data = array(typecode, bytes(array(typecode).itemsize * size))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice) and self.shared is False:
+            value = array(self.typecode, value)
+        self.data[key] = value
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+    def getChannelNum(self):
+        return self.channel_num
+
+    def getData(self):
+        """
+            Return the underlying array, it supports the buffer protocol
+        """
+        return self.data
+
+    def getMemorySize(self):
+        return len(self.data) * array(self.typecode).itemsize
+
+    def toBytes(self):
+        return memoryview(self.data).cast("B").tobytes()
+
+    def fromBytes(self, data):
+        """
+            Overwrite the whole buffer with data of getMemorySize bytes
+        """
+        memoryview(self.data).cast("B")[:] = data
+
+    def getTileView(self, x0, y0, x1, y1):
+        return TileView(self, x0, y0, x1, y1)
+
+    def writeTile(self, x0, y0, x1, y1, tile_buf):
+        self.getTileView(x0, y0, x1, y1).assign(tile_buf)
+
+    def readTile(self, x0, y0, x1, y1):
+        return self.getTileView(x0, y0, x1, y1).tolist()
+
+
+class TileView(object):
+    """
+        View of the pixels in [x0, x1) x [y0, y1) of a FrameBuffer, indexed
+        with flat indices in row order of the tile
+    """
+
+    def __init__(self, frame_buffer, x0, y0, x1, y1):
+        self.frame_buffer = frame_buffer
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.row_size = (x1 - x0) * frame_buffer.channel_num
+
+    def __len__(self):
+        return self.row_size * (self.y1 - self.y0)
+
+    def __getitem__(self, i):
+        return self.frame_buffer.data[self.__index(i)]
+
+    def __setitem__(self, i, value):
+        self.frame_buffer.data[self.__index(i)] = value
+
+    def __index(self, i):
+        row, col = divmod(i, self.row_size)
+        fb = self.frame_buffer
+        return ((self.y0 + row) * fb.width + self.x0) * fb.channel_num + col
+
+    def assign(self, tile_buf):
+        """
+            Copy a flat tile buffer into the view, one slice per row
+        """
+        fb = self.frame_buffer
+        for y in range(self.y0, self.y1):
+            start = (y * fb.width + self.x0) * fb.channel_num
+            src = (y - self.y0) * self.row_size
+            fb[start:start + self.row_size] = tile_buf[src:src + self.row_size]
+
+    def tolist(self):
+        fb = self.frame_buffer
+        result = []
+        for y in range(self.y0, self.y1):
+            start = (y * fb.width + self.x0) * fb.channel_num
+            result.extend(fb.data[start:start + self.row_size])
+        return result
+
+
+class AccumulationBuffer(object):
+    """
+        Running sums of the samples and sample counts of every pixel, the
+        average of a pixel is its sum divided by its count
+    """
+
+    def __init__(self, width, height, shared=False):
+        self.sums = FrameBuffer(width, height, 3, "d", shared)
+        self.counts = FrameBuffer(width, height, 1, "i", shared)
+
+    def getSums(self):
+        return self.sums
+
+    def getCounts(self):
+        return self.counts
+
+    def addTile(self, x0, y0, x1, y1, tile_buf, tile_spp_buf):
+        """
+            Add a tile of averaged colors, tile_spp_buf holds the number of
+            samples behind every average
+        """
+        sums = self.sums.getTileView(x0, y0, x1, y1)
+        counts = self.counts.getTileView(x0, y0, x1, y1)
+        for i in range(len(tile_spp_buf)):
+            spp = tile_spp_buf[i]
+            counts[i] = counts[i] + spp
+            for c in range(i * 3, i * 3 + 3):
+                sums[c] = sums[c] + tile_buf[c] * spp
+
+    def resolveTile(self, x0, y0, x1, y1, frame_buffer):
+        """
+            Write the averages of the tile to frame_buffer, return them
+        """
+        sums = self.sums.readTile(x0, y0, x1, y1)
+        counts = self.counts.readTile(x0, y0, x1, y1)
+        tile_buf = []
+        for i in range(len(counts)):
+            inv_count = 1.0 / max(counts[i], 1)
+            tile_buf.append(sums[i * 3] * inv_count)
+            tile_buf.append(sums[i * 3 + 1] * inv_count)
+            tile_buf.append(sums[i * 3 + 2] * inv_count)
+        frame_buffer.writeTile(x0, y0, x1, y1, tile_buf)
+        return tile_buf
+
+
+if __name__ == "__main__":
+    fb = FrameBuffer(4, 4)
+    fb.writeTile(1, 1, 3, 3, [0.5] * 12)
+    print(fb.readTile(0, 0, 4, 4))
+    print(fb.getMemorySize())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Read high dynamic range image files to float buffers
+"""
+
+
+import math
+import os
+import struct
+import sys
+from array import array
+
+
+__all__ = ["loadPFM", "loadHDR", "loadImage"]
+
+
+def loadPFM(file_name):
+    """
+        Portable float map, PF for RGB or Pf for gray. Return (width,
+        height, array('f') of r,g,b) with rows from top to bottom, PFM
+        stores them bottom up
+    """
+    with open(file_name, "rb") as f:
+        kind = f.readline().strip()
+        if kind not in (b"PF", b"Pf"):
+            raise ValueError("Not a PFM file: %s" % (file_name,))
+        try:
+            width, height = [int(v) for v in f.readline().split()]
+            scale = float(f.readline())
+        except ValueError:
+            raise ValueError("Bad PFM header in %s" % (file_name,))
+        raster = f.read()
+
+    channel_num = 3 if kind == b"PF" else 1
+    size = width * height * channel_num
+    raster = raster[:4 * size]
+    if len(raster) != 4 * size:
+        raise ValueError("Truncated PFM file: %s" % (file_name,))
+    values = array("f")
+    values.frombytes(raster)
+    if (scale < 0.0) != (sys.byteorder == "little"):
+        values.byteswap()
+
+    pixels = array("f")
+    row_size = width * channel_num
+    for y in range(height - 1, -1, -1):
+        row = values[y * row_size:(y + 1) * row_size]
+        if channel_num == 1:
+            for value in row:
+                pixels.extend((value, value, value))
+        else:
+            pixels.extend(row)
+    return width, height, pixels
+
+
+def _readRGBERow(data, offset, width, file_name):
+    """
+        Return (row bytes of r,g,b,e quadruples, next offset), the row is
+        flat or run length encoded channel by channel
+    """
+    if (width < 8 or width > 0x7fff or data[offset] != 2
+        or data[offset + 1] != 2 or data[offset + 2] & 0x80):
+        end = offset + 4 * width
+        if end > len(data):
+            raise ValueError("Truncated HDR file: %s" % (file_name,))
+        return data[offset:end], end
+
+    if (data[offset + 2] << 8 | data[offset + 3]) != width:
+        raise ValueError("Bad HDR scanline in %s" % (file_name,))
+    offset = offset + 4
+    row = bytearray(4 * width)
+    try:
+        for c in range(4):
+            x = 0
+            while x < width:
+                count = data[offset]
+                if count == 0:
+                    raise ValueError("Empty run")
+                if count > 128:
+                    count = count - 128
+                    row[4 * x + c:4 * (x + count) + c:4] = (
+                        data[offset + 1:offset + 2] * count)
+                    offset = offset + 2
+                else:
+                    row[4 * x + c:4 * (x + count) + c:4] = (
+                        data[offset + 1:offset + 1 + count])
+                    offset = offset + 1 + count
+                x = x + count
+    except (IndexError, ValueError):
+        raise ValueError("Bad HDR scanline in %s" % (file_name,))
+    return bytes(row), offset
+
+
+def loadHDR(file_name):
+    """
+        Radiance RGBE picture with the standard -Y height +X width
+        orientation. Return (width, height, array('f') of r,g,b) with rows
+        from top to bottom
+    """
+    with open(file_name, "rb") as f:
+        data = f.read()
+    if not data.startswith(b"#?"):
+        raise ValueError("Not a Radiance HDR file: %s" % (file_name,))
+
+    # Header lines up to an empty line, then the resolution line
+    offset = 0
+    while True:
+        end = data.find(b"\n", offset)
+        if end < 0:
+            raise ValueError("Truncated HDR header in %s" % (file_name,))
+        line = data[offset:end].strip()
+        offset = end + 1
+        if len(line) == 0:
+            break
+        if line.startswith(b"FORMAT=") and line != b"FORMAT=32-bit_rle_rgbe":
+            raise ValueError("Unsupported HDR format %s in %s"
+                             % (line[7:].decode("ascii", "replace"), file_name))
+    end = data.find(b"\n", offset)
+    resolution = data[offset:end].split()
+    if (len(resolution) != 4 or resolution[0] != b"-Y"
+        or resolution[2] != b"+X"):
+        raise ValueError("Unsupported HDR orientation in %s" % (file_name,))
+    height = int(resolution[1])
+    width = int(resolution[3])
+    offset = end + 1
+
+    # Every exponent maps to its scale once
+    scales = [0.0] + [math.ldexp(1.0, e - 136) for e in range(1, 256)]
+    pixels = array("f")
+    for y in range(height):
+        if offset >= len(data):
+            raise ValueError("Truncated HDR file: %s" % (file_name,))
+        row, offset = _readRGBERow(data, offset, width, file_name)
+        for r, g, b, e in struct.iter_unpack("4B", row):
+            scale = scales[e]
+            pixels.extend((r * scale, g * scale, b * scale))
+    return width, height, pixels
+
+
+_READERS = {
+    ".pfm": loadPFM,
+    ".hdr": loadHDR,
+    }
+
+
+def loadImage(file_name):
+    """
+        Read an HDR image, the format is chosen by the file extension,
+        one of .pfm and .hdr
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext not in _READERS:
+        raise ValueError("Unsupported image format: %s" % (ext,))
+    return _READERS[ext](file_name)
+
+
+if __name__ == "__main__":
+    with open("gradient.pfm", "wb") as f:
+        f.write(b"PF\n4 2\n-1.0\n")
+        f.write(array("f", [x / 3.0 for x in range(24)]).tobytes())
+    print(loadImage("gradient.pfm"))
+    os.remove("gradient.pfm")
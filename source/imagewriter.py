@@ -0,0 +1,106 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Convert color buffer to 8 bit RGB and write image files
+"""
+
+
+import os
+import struct
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+__all__ = ["toRGB8", "savePPM", "saveBMP", "savePNG", "saveImage"]
+
+
+def toRGB8(color_buf):
+    """
+        Convert a flat r,g,b float buffer in [0, 1] to 8 bit RGB bytes in
+        one pass, values out of range are clamped. color_buf is a list, an
+        array or a FrameBuffer
+    """
+    if hasattr(color_buf, "getData"):
+        color_buf = color_buf.getData()
+    if numpy is not None:
+        if not isinstance(color_buf, (list, tuple)):
+            # Typed arrays are read in place through the buffer protocol
+            color_buf = memoryview(color_buf)
+        values = numpy.floor(numpy.asarray(color_buf, dtype=numpy.float64) * 255)
+        return numpy.clip(values, 0, 255).astype(numpy.uint8).tobytes()
+    return bytes([min(255, max(0, int(value * 255))) for value in color_buf])
+
+
+def savePPM(file_name, rgb, width, height):
+    with open(file_name, "wb") as f:
+        f.write(("P6\n%d %d\n255\n" % (width, height)).encode("ascii"))
+        f.write(rgb)
+
+
+def saveBMP(file_name, rgb, width, height):
+    """
+        24 bit bottom up BMP, rows are stored as BGR padded to 4 bytes
+    """
+    row_size = width * 3
+    padding = b"\x00" * ((4 - row_size % 4) % 4)
+    image_size = (row_size + len(padding)) * height
+    with open(file_name, "wb") as f:
+        f.write(struct.pack("<2sIHHI", b"BM", 54 + image_size, 0, 0, 54))
+        f.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0,
+                            image_size, 2835, 2835, 0, 0))
+        for y in range(height - 1, -1, -1):
+            row = bytearray(rgb[y * row_size:(y + 1) * row_size])
+            row[0::3], row[2::3] = row[2::3], row[0::3]
+            f.write(row)
+            f.write(padding)
+
+
+def savePNG(file_name, rgb, width, height):
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    row_size = width * 3
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # No filter
+        raw.extend(rgb[y * row_size:(y + 1) * row_size])
+    with open(file_name, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+_WRITERS = {
+    ".ppm": savePPM,
+    ".bmp": saveBMP,
+    ".png": savePNG,
+    }
+
+
+def saveImage(file_name, color_buf, width, height):
+    """
+        Save a flat r,g,b float buffer, the format is chosen by the file
+        extension, one of .ppm, .bmp and .png
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext not in _WRITERS:
+        raise ValueError("Unsupported image format: %s" % (ext,))
+    _WRITERS[ext](file_name, toRGB8(color_buf), width, height)
+
+
+if __name__ == "__main__":
+    color_buf = []
+    for y in range(64):
+        for x in range(64):
+            color_buf.extend((x / 63.0, y / 63.0, 0.5))
+    saveImage("gradient.png", color_buf, 64, 64)
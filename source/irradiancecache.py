@@ -0,0 +1,173 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Irradiance cache, reuse hemisphere estimates across a surface
+"""
+
+
+import math
+from collections import deque
+
+
+__all__ = ["IrradianceRecord", "IrradianceCache"]
+
+
+class IrradianceRecord(object):
+    """
+        Hemisphere estimate at a point, value is a tuple of floats and
+        radius the harmonic mean distance to the surrounding geometry
+    """
+
+    __slots__ = ("point", "normal", "value", "radius", "cells")
+
+    def __init__(self, point, normal, value, radius):
+        self.point = point
+        self.normal = normal
+        self.value = value
+        self.radius = radius
+        self.cells = []
+
+
+class IrradianceCache(object):
+    """
+        Irradiance cache of Ward. A record at p_i with normal n_i and
+        radius R_i is reused at p with normal n with the weight
+        w = 1 / (|p - p_i| / R_i + sqrt(1 - n . n_i))
+        if w > 1 / max_error, the value at p is the weighted average of
+        all such records. The records are kept in a spatial hash, every
+        record is stored in the cells its area of influence overlaps.
+
+        Radius is clamped to [min_radius, max_radius] in scene units. If
+        there are more than max_record_num records the oldest ones are
+        evicted
+    """
+
+    def __init__(self, max_error=0.3, min_radius=0.1, max_radius=10.0,
+                 max_record_num=100000):
+        self.max_error = max_error
+        self.min_radius = min_radius
+        self.max_radius = max_radius
+        self.max_record_num = max_record_num
+        self.cell_size = max_error * max_radius
+        self.cells = {}
+        self.records = deque()
+        self.query_num = 0
+        self.hit_num = 0
+
+    def getQueryNum(self):
+        return self.query_num
+
+    def getHitNum(self):
+        return self.hit_num
+
+    def getMissNum(self):
+        return self.query_num - self.hit_num
+
+    def getHitRate(self):
+        if self.query_num == 0:
+            return 0.0
+        return 1.0 * self.hit_num / self.query_num
+
+    def resetStats(self):
+        self.query_num = 0
+        self.hit_num = 0
+
+    def getRecordNum(self):
+        return len(self.records)
+
+    def clear(self):
+        self.cells = {}
+        self.records = deque()
+
+    def lookup(self, point, normal):
+        """
+            Return the interpolated value at the point, None if no record
+            is close enough and a new one has to be computed
+        """
+        self.query_num = self.query_num + 1
+        records = self.cells.get(self.__cellOf(point.x, point.y, point.z))
+        if records is None:
+            return None
+
+        min_weight = 1.0 / self.max_error
+        total_weight = 0.0
+        total = None
+        for record in records:
+            p = record.point
+            n = record.normal
+            dx = point.x - p.x
+            dy = point.y - p.y
+            dz = point.z - p.z
+
+            # Skip records in front of the point, they see other geometry
+            if (dx * (normal.x + n.x) + dy * (normal.y + n.y)
+                + dz * (normal.z + n.z)) < -0.01 * record.radius:
+                continue
+
+            cos = normal.x * n.x + normal.y * n.y + normal.z * n.z
+            error = (math.sqrt(dx * dx + dy * dy + dz * dz) / record.radius
+                     + math.sqrt(max(0.0, 1.0 - cos)))
+            if error * min_weight >= 1.0:
+                continue
+            weight = 1.0 / max(error, 1e-6)
+            if total is None:
+                total = [v * weight for v in record.value]
+            else:
+                for i in range(len(total)):
+                    total[i] = total[i] + record.value[i] * weight
+            total_weight = total_weight + weight
+
+        if total is None:
+            return None
+        self.hit_num = self.hit_num + 1
+        return tuple(v / total_weight for v in total)
+
+    def add(self, point, normal, value, radius):
+        """
+            Store a new record, radius is the harmonic mean distance of
+            the hemisphere rays of the estimate
+        """
+        radius = min(max(radius, self.min_radius), self.max_radius)
+        record = IrradianceRecord(point, normal, tuple(value), radius)
+        reach = self.max_error * radius
+        x0, y0, z0 = self.__cellOf(point.x - reach, point.y - reach, point.z - reach)
+        x1, y1, z1 = self.__cellOf(point.x + reach, point.y + reach, point.z + reach)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                for z in range(z0, z1 + 1):
+                    cell = (x, y, z)
+                    if cell not in self.cells:
+                        self.cells[cell] = []
+                    self.cells[cell].append(record)
+                    record.cells.append(cell)
+        self.records.append(record)
+
+        while len(self.records) > self.max_record_num:
+            self.__evict(self.records.popleft())
+
+    def __evict(self, record):
+        for cell in record.cells:
+            records = self.cells[cell]
+            records.remove(record)
+            if len(records) == 0:
+                del self.cells[cell]
+
+    def __cellOf(self, x, y, z):
+        size = self.cell_size
+        return (int(math.floor(x / size)), int(math.floor(y / size)),
+                int(math.floor(z / size)))
+
+
+if __name__ == "__main__":
+    from vector import *
+
+    cache = IrradianceCache(max_record_num=2)
+    n = Vector(0.0, 1.0, 0.0)
+    cache.add(Vector(0.0, 0.0, 0.0), n, (0.5,), 1.0)
+    print(cache.lookup(Vector(0.1, 0.0, 0.0), n))
+    print(cache.lookup(Vector(5.0, 0.0, 0.0), n))
+    print(cache.getHitRate())
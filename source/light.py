@@ -9,8 +9,59 @@
 """
 
 import math
+import random
+from array import array
 
 from color import *
+from imagereader import *
+from vector import *
+
+
+class AliasTable(object):
+    """
+        Pick an index with probability proportional to its weight in
+        constant time, built with the alias method of Vose
+    """
+
+    def __init__(self, weights):
+        num = len(weights)
+        total = 1.0 * sum(weights)
+        if num == 0 or total <= 0.0:
+            raise ValueError("AliasTable needs a positive total weight")
+
+        self.probs = array("d", [w / total for w in weights])
+        self.thresholds = array("d", [1.0] * num)
+        self.aliases = array("l", range(num))
+
+        scaled = [p * num for p in self.probs]
+        small = [i for i in range(num) if scaled[i] < 1.0]
+        large = [i for i in range(num) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.thresholds[s] = scaled[s]
+            self.aliases[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+    def getSize(self):
+        return len(self.probs)
+
+    def getProbability(self, index):
+        return self.probs[index]
+
+    def sample(self, u):
+        """
+            Map u in [0, 1) to an index
+        """
+        x = u * len(self.probs)
+        index = min(int(x), len(self.probs) - 1)
+        if x - index < self.thresholds[index]:
+            return index
+        return self.aliases[index]
 
 
 class AmbientLight(object):
@@ -43,6 +94,7 @@ class AreaLight(object):
         self.shape = shape
         self.sampler = sampler
         self.sampler_num = sampler_num
+        self.point_sets = None
 
     def getPDF(self):
         return 1.0 / self.shape.getArea()
@@ -50,13 +102,40 @@ class AreaLight(object):
     def getShape(self):
         return self.shape
 
+    def getSamplerNum(self):
+        return self.sampler_num
+
+    def getLightColor(self):
+        emission = self.shape.getMaterial().getEmission()
+        return emission.getCe() * emission.getKe()
+
+    def getPower(self):
+        """
+            Emitted power up to a constant, ke * area * luminance of ce
+        """
+        emission = self.shape.getMaterial().getEmission()
+        return (emission.getKe() * self.shape.getArea()
+                * emission.getCe().getLuminance())
+
+    def samplePoint(self, u, v):
+        """
+            Return the point of the light at (u, v) in [0, 1) x [0, 1)
+        """
+        return self.shape.genSamplerPoint(Vector2(u, v))
+
     def getSamplers(self):
-        self.sampler.genSamplersInUnitSqure(self.sampler_num)
-        samplers = self.sampler.getSamplers()
-        sampler_point_in_area = []
-        for sampler in samplers:
-            sampler_point_in_area.append(self.shape.genSamplerPoint(sampler))
-        return sampler_point_in_area
+        """
+            Return the next set of sampler points on the light, the points
+            of every set in the sampler pool are mapped to the light once
+        """
+        if self.point_sets is None:
+            self.point_sets = []
+            for samplers in self.sampler.getSamplerSets(self.sampler_num):
+                sampler_point_in_area = []
+                for sampler in samplers:
+                    sampler_point_in_area.append(self.shape.genSamplerPoint(sampler))
+                self.point_sets.append(sampler_point_in_area)
+        return self.point_sets[self.sampler.nextSetIndex()]
 
 class EnvLight(object):
     def __init__(self, kenv, cenv, sampler, sampler_num):
@@ -69,14 +148,118 @@ class EnvLight(object):
         return cos / math.pi
 
     def getSamplers(self):
-        self.sampler.genSamplersInUnitSqure(self.sampler_num)
-        self.sampler.mapToHemiSphere()
-        return self.sampler.getSamplers()
+        """
+            Return the next set of cosine weighted (u, v, w) directions in
+            the local frame of the shading point
+        """
+        return self.sampler.getNextHemiSphereSamplers(self.sampler_num, 1.0)
+
+    def getSamplerArray(self):
+        """
+            Return the next set of getSamplers as a (num, 3) numpy array
+        """
+        return self.sampler.getNextHemiSphereArray(self.sampler_num, 1.0)
 
     def getLightColor(self):
         return self.cenv * self.kenv
 
 
+class EnvMapLight(object):
+    """
+        Environment light from an equirectangular HDR image, .pfm or
+        .hdr. The top row of the image looks along +y, u = 0 along +x
+        and u turns towards +z. Directions are importance sampled in
+        constant time, an AliasTable built at load picks a pixel by its
+        luminance times its solid angle, then a uniform point inside the
+        pixel is taken. getPDF is the density of this sampling per solid
+        angle
+    """
+
+    def __init__(self, kenv, file_name, sampler_num):
+        self.kenv = kenv
+        self.file_name = file_name
+        self.sampler_num = sampler_num
+        self.width, self.height, self.pixels = loadImage(file_name)
+
+        # Luminance of Color.getLuminance, a pixel row at polar angle
+        # theta covers a solid angle proportional to sin(theta)
+        pixels = self.pixels
+        weights = []
+        for y in range(self.height):
+            sin_theta = math.sin(math.pi * (y + 0.5) / self.height)
+            for i in range(3 * y * self.width, 3 * (y + 1) * self.width, 3):
+                luminance = (0.2126 * pixels[i] + 0.7152 * pixels[i + 1]
+                             + 0.0722 * pixels[i + 2])
+                weights.append(sin_theta * max(luminance, 0.0))
+        try:
+            self.table = AliasTable(weights)
+        except ValueError:
+            raise ValueError("Environment map is black: %s" % (file_name,))
+        # pdf per solid angle of a direction is pdf_pixel * pdf_scale / sin
+        self.pdf_scale = self.width * self.height / (2.0 * math.pi * math.pi)
+
+    def getFileName(self):
+        return self.file_name
+
+    def getSamplerNum(self):
+        return self.sampler_num
+
+    def getSize(self):
+        return self.width, self.height
+
+    def getRadiance(self, d):
+        """
+            Return the radiance arriving from the direction d
+        """
+        return self.__pixelColor(self.__pixelIndex(d))
+
+    def getPDF(self, d):
+        sin_theta = math.sqrt(max(0.0, 1.0 - d.y * d.y))
+        return self.__pdf(self.__pixelIndex(d), sin_theta)
+
+    def sampleDirection(self, u0, u1, u2):
+        """
+            Return (direction, radiance, pdf) for u0, u1, u2 in [0, 1),
+            u0 picks the pixel and (u1, u2) the point inside it
+        """
+        index = self.table.sample(u0)
+        y, x = divmod(index, self.width)
+        theta = math.pi * (y + u1) / self.height
+        phi = 2.0 * math.pi * (x + u2) / self.width
+        sin_theta = math.sin(theta)
+        d = Vector(sin_theta * math.cos(phi), math.cos(theta),
+                   sin_theta * math.sin(phi))
+        return d, self.__pixelColor(index), self.__pdf(index, sin_theta)
+
+    def getSamples(self):
+        """
+            Return sampler_num (direction, radiance, pdf) samples
+        """
+        return [self.sampleDirection(random.random(), random.random(),
+                                     random.random())
+                for i in range(self.sampler_num)]
+
+    def __pixelIndex(self, d):
+        theta = math.acos(min(max(d.y, -1.0), 1.0))
+        phi = math.atan2(d.z, d.x)
+        if phi < 0.0:
+            phi = phi + 2.0 * math.pi
+        x = min(int(phi / (2.0 * math.pi) * self.width), self.width - 1)
+        y = min(int(theta / math.pi * self.height), self.height - 1)
+        return y * self.width + x
+
+    def __pixelColor(self, index):
+        pixels = self.pixels
+        return Color(pixels[3 * index] * self.kenv,
+                     pixels[3 * index + 1] * self.kenv,
+                     pixels[3 * index + 2] * self.kenv)
+
+    def __pdf(self, index, sin_theta):
+        if sin_theta <= 0.0:
+            return 0.0
+        return self.table.getProbability(index) * self.pdf_scale / sin_theta
+
+
 if __name__ == "__main__":
     ambient = AmbientLight(0.1, Color(1.0, 1.0, 1.0))
     print(ambient.c.getColorStr())
@@ -8,6 +8,7 @@
 
 import multiprocessing
 import random
+import sys
 import time
 
 from camera import *
@@ -17,6 +18,7 @@ from material import *
 from render import *
 from sampler import *
 from scene import *
+from scenefile import *
 from shade import *
 from tracer import *
 from vector import *
@@ -73,11 +75,23 @@ def render_many_balls():
     sd = Phong(MultiJitteredSampler())
     sd.setAOSamplerNum(100)
     sd.setEnableAO(True)
+    sd.setRussianRoulette(True)
     
     t = Tracer(s, c, SCREEN_WIDTH, SCREEN_HEIGHT, sd, 10, MultiJitteredSampler(), 16)
-    render = Render(w, t)
+    t.setEnablePacket(True)
+    render = Render(w, t, worker_num=multiprocessing.cpu_count(), tile_size=16)
+    render.render()
+
+
+def render_scene_file(file_name):
+    t = loadScene(file_name)
+    w = Window(t.getWidth(), t.getHeight())
+    render = Render(w, t, worker_num=multiprocessing.cpu_count(), tile_size=16)
     render.render()
 
 
 if __name__ == "__main__":
-    render_many_balls()
+    if len(sys.argv) > 1:
+        render_scene_file(sys.argv[1])
+    else:
+        render_many_balls()
@@ -35,6 +35,20 @@ class MaterialBase(object):
     def getBRDF(self, p, n, wi, wo):
         pass
 
+    def sampleDirection(self, n, wo, u, v):
+        """
+            Return (wi, pdf) of a direction sampled from the lobe of the
+            BRDF with (u, v) in [0, 1) x [0, 1), pdf is per solid angle.
+            None if the material can not sample its lobe
+        """
+        return None
+
+    def getPDF(self, n, wi, wo):
+        """
+            Return the solid angle pdf of sampleDirection returning wi
+        """
+        return 0.0
+
 
 class AmbientMaterial(MaterialBase):
     def __init__(self, ka, cd):
@@ -91,6 +105,41 @@ class GlossyMaterial(MaterialBase):
         v = math.pow(v, self.e)
         return self.cs * (self.ks * v)
 
+    def getBRDFPacket(self, n, wis, wo):
+        """
+            Return a numpy array of ks * cos^e for the (N, 3) numpy array
+            of directions wis, the BRDF of wis[i] is getCs() * result[i]
+        """
+        # dot(reflect(n, wi), wo) without building the reflections
+        wis_n = wis.dot((n.x, n.y, n.z))
+        wis_wo = wis.dot((wo.x, wo.y, wo.z))
+        v = 2.0 * wis_n * Vector.dot(n, wo) - wis_wo
+        return self.ks * (v.clip(0.0, None) ** self.e)
+
+    def sampleDirection(self, n, wo, u, v):
+        """
+            Sample cos^e of the angle to the mirror direction of wo, the
+            direction may be below the surface
+        """
+        # Orthonormal basis around the mirror direction
+        a, b, w = Vector.orthonormalBasis(Vector.reflect(n, wo))
+
+        cos_alpha = math.pow(u, 1.0 / (self.e + 1.0))
+        sin_alpha = math.sqrt(max(0.0, 1.0 - cos_alpha * cos_alpha))
+        phi = 2.0 * math.pi * v
+        pu = sin_alpha * math.cos(phi)
+        pv = sin_alpha * math.sin(phi)
+        wi = Vector(a.x * pu + b.x * pv + w.x * cos_alpha,
+                    a.y * pu + b.y * pv + w.y * cos_alpha,
+                    a.z * pu + b.z * pv + w.z * cos_alpha)
+        return wi, (self.e + 1.0) / (2.0 * math.pi) * math.pow(cos_alpha, self.e)
+
+    def getPDF(self, n, wi, wo):
+        cos_alpha = Vector.dot(Vector.reflect(n, wo), wi)
+        if cos_alpha <= 0.0:
+            return 0.0
+        return (self.e + 1.0) / (2.0 * math.pi) * math.pow(cos_alpha, self.e)
+
 
 class EmissionMaterial(MaterialBase):
     def __init__(self, ke, ce):
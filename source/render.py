@@ -10,25 +10,462 @@
 
 
 import multiprocessing
+import os
+import random
+import signal
+import time
 
 import tracer
 import window
+from checkpoint import *
+from distributed import *
+from framebuffer import *
+from renderstats import *
 
 
-__all__ = ["Render",]
+__all__ = ["Render", "genTiles"]
+
+
+def genTiles(width, height, tile_size):
+    """
+        Split the image into tiles, return a list of (x0, y0, x1, y1)
+    """
+    tiles = []
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            y1 = min(y0 + tile_size, height)
+            tiles.append((x0, y0, x1, y1))
+    return tiles
+
+
+# Tracer of the worker process, set once by the pool initializer so the
+# scene is only pickled one time per worker instead of once per tile
+_worker_tracer = None
+
+# (color FrameBuffer, spp FrameBuffer) in shared memory, the workers write
+# the traced tiles to them in place
+_worker_buffers = None
+
+
+def _initWorker(worker_tracer, buffers):
+    global _worker_tracer
+    global _worker_buffers
+    _worker_tracer = worker_tracer
+    _worker_buffers = buffers
+    random.seed()  # Forked workers inherit the same random state, tasks
+                   # with a seed reseed for every tile
+    # A worker forked after the display is open inherits the SIGTERM
+    # handler of SDL and would survive Pool.terminate
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _taskSeed(seed, pass_index, tile):
+    """
+        Seed of the random state for a tile of a pass, None without a
+        render seed
+    """
+    if seed is None:
+        return None
+    return "%s %d %d %d" % (seed, pass_index, tile[0], tile[1])
+
+
+def _traceTile(task):
+    return _traceTileWith(_worker_tracer, _worker_buffers, task)
+
+
+def _traceTileWith(tracer, buffers, task):
+    """
+        Trace a (tile, sampler_num, seed) task, a sampler_num of None uses
+        the samples per pixel of the tracer, a seed of None keeps the
+        random state. The tile is written to the color
+        and spp buffers, only the tile, the cache stats and the counters
+        of the RenderStats are returned, the pixels never go through the
+        result queue
+    """
+    color_buf, spp_buf = buffers
+    tile, sampler_num, seed = task
+    if seed is not None:
+        random.seed(seed)
+    x0, y0, x1, y1 = tile
+    tile_buf = tracer.traceTile(x0, y0, x1, y1, sampler_num)
+    color_buf.writeTile(x0, y0, x1, y1, tile_buf)
+    spp_buf.writeTile(x0, y0, x1, y1, tracer.getTileSppBuf())
+    return tile, popOcclusionCacheStats(tracer), popStatsCounters(tracer)
+
+
+def _tileArea(tile):
+    x0, y0, x1, y1 = tile
+    return (x1 - x0) * (y1 - y0)
 
 
 class Render(object):
-    def __init__(self, window, tracer, img_name="result.bmp"):
+    def __init__(self, window, tracer, img_name="result.bmp",
+                 worker_num=1, tile_size=32):
         self.window = window
         self.tracer = tracer
         self.img_name = img_name
+        self.worker_num = worker_num
+        self.tile_size = tile_size
+        self.render_time = 0.0
+        self.occlusion_cache_stats = {}
+        self.spp_buf = []
+        self.enable_progressive = False
+        self.pass_num = 8
+        self.pass_sampler_num = 4
+        self.checkpoint = None
+        self.enable_resume = False
+        self.coordinator = None
+        self.seed = None
+
+    def setWorkerNum(self, num):
+        self.worker_num = num
+
+    def getWorkerNum(self):
+        return self.worker_num
+
+    def setTileSize(self, size):
+        self.tile_size = size
+
+    def getTileSize(self):
+        return self.tile_size
+
+    def setProgressive(self, enable, pass_num=8, pass_sampler_num=4):
+        """
+            Progressive rendering, the first pass traces 1 sample per pixel,
+            the following pass_num - 1 passes add pass_sampler_num samples
+            per pixel each. Every finished tile is drawn to the window
+        """
+        self.enable_progressive = enable
+        self.pass_num = pass_num
+        self.pass_sampler_num = pass_sampler_num
+
+    def setCheckpoint(self, file_name, interval=60.0):
+        """
+            Save the finished tiles and the sample sums to file_name every
+            interval seconds and after every progressive pass. The file is
+            removed once the render is done, None disables checkpoints
+        """
+        self.checkpoint = None
+        if file_name is not None:
+            self.checkpoint = Checkpoint(file_name, interval)
+
+    def setResume(self, enable):
+        """
+            Continue from the checkpoint file if there is one saved with
+            the same settings, finished tiles and passes are skipped
+        """
+        self.enable_resume = enable
+
+    def setDistributed(self, host="", port=DEFAULT_PORT, tile_timeout=None):
+        """
+            Trace the tiles on the workers connected to port instead of
+            the local worker pool, start them with distributed.py on every
+            machine. host None disables the distributed mode
+        """
+        self.coordinator = None
+        if host is not None:
+            self.coordinator = Coordinator(self.tracer, host, port, tile_timeout)
+
+    def getCoordinator(self):
+        return self.coordinator
+
+    def setSeed(self, seed):
+        """
+            Reseed the random state from (seed, pass, tile) before every
+            tile, on the workers too, None keeps the random state. Serial
+            renders repeat exactly, with several workers the sampler set
+            order still carries over between the tiles of a worker
+        """
+        self.seed = seed
+
+    def getSeed(self):
+        return self.seed
+
+    def getRenderTime(self):
+        return self.render_time
+
+    def getSppBuf(self):
+        """
+            Return the samples per pixel map of the last render
+        """
+        return self.spp_buf
+
+    def getOcclusionCacheStats(self):
+        """
+            Return {cache name: (query num, hit num)} of the last render,
+            summed over all workers
+        """
+        return self.occlusion_cache_stats
+
+    def getStats(self):
+        """
+            Return the RenderStats of the tracer, the counters of all
+            workers are added to it, None if the tracer has no stats
+        """
+        return self.tracer.getStats()
 
     def render(self):
-        color_buf = []
-        for index in range(self.window.getWidth() * self.window.getHeight() * 3):
-            color_buf.append(0.0)
-        self.tracer.trace(color_buf)
-        self.window.update(color_buf)
+        color_buf = self.__createColorBuf(self.__isPooled())
+        self.__trace(color_buf)
+        if self.enable_progressive is False or self.window.isOpen() is True:
+            self.window.update(color_buf)
         self.window.save(self.img_name, color_buf,
                          self.window.getWidth(), self.window.getHeight())
+        if self.tracer.isAdaptive() is True:
+            self.__saveSppMap()
+
+    def __saveSppMap(self):
+        """
+            Save the samples per pixel map as a gray image next to the
+            result, white is the largest sample number
+        """
+        max_spp = max(self.spp_buf)
+        spp_color_buf = []
+        for spp in self.spp_buf:
+            value = 1.0 * spp / max_spp
+            spp_color_buf.extend((value, value, value))
+        name, ext = os.path.splitext(self.img_name)
+        self.window.save(name + "_spp" + ext, spp_color_buf,
+                         self.window.getWidth(), self.window.getHeight())
+
+    def measureSpeedup(self):
+        """
+            Trace the image with the serial Tracer.trace path and with the
+            tile pool, return the speedup of the tile pool
+        """
+        color_buf = self.__createColorBuf()
+        start = time.time()
+        self.tracer.trace(color_buf)
+        serial_time = time.time() - start
+
+        color_buf = self.__createColorBuf(self.__isPooled())
+        self.__trace(color_buf)
+        speedup = serial_time / max(self.render_time, 1e-9)
+        print("Render Serial: %fs, Parallel(%d workers, %d tile): %fs, Speedup: %f"
+              % (serial_time, self.worker_num, self.tile_size,
+                 self.render_time, speedup))
+        return speedup
+
+    def __isPooled(self):
+        return self.worker_num > 1 and self.coordinator is None
+
+    def __createColorBuf(self, shared=False):
+        """
+            The buffer must be shared to be written by the workers, it is
+            created before the pool
+        """
+        return FrameBuffer(self.window.getWidth(), self.window.getHeight(),
+                           shared=shared)
+
+    def __trace(self, color_buf):
+        self.occlusion_cache_stats = {}
+        popOcclusionCacheStats(self.tracer)
+        start = time.time()
+        if self.enable_progressive is True:
+            self.__traceProgressive(color_buf)
+        elif (self.worker_num > 1 or self.checkpoint is not None
+              or self.coordinator is not None):
+            self.__traceTiles(color_buf)
+        else:
+            self.tracer.trace(color_buf)
+            self.spp_buf = FrameBuffer(self.tracer.getWidth(),
+                                       self.tracer.getHeight(), 1, "i")
+            self.spp_buf[:] = self.tracer.getSppBuf()
+            self.__addOcclusionCacheStats(popOcclusionCacheStats(self.tracer))
+        self.render_time = time.time() - start
+        print("Render Time: %fs" % (self.render_time,))
+        render_stats = self.tracer.getStats()
+        if render_stats is not None:
+            render_stats.stop()
+            print("Render Rays: %d, %f per second"
+                  % (render_stats.getRayNum(), render_stats.getRaysPerSecond()))
+        print("Render Samples: %d, %f per pixel"
+              % (sum(self.spp_buf), 1.0 * sum(self.spp_buf) / len(self.spp_buf)))
+        for name in sorted(self.occlusion_cache_stats):
+            query_num, hit_num = self.occlusion_cache_stats[name]
+            print("Cache %s: %d queries, %d hits, hit rate %f"
+                  % (name, query_num, hit_num,
+                     1.0 * hit_num / max(query_num, 1)))
+
+    def __addOcclusionCacheStats(self, stats):
+        for name, (query_num, hit_num) in stats.items():
+            total_query_num, total_hit_num = self.occlusion_cache_stats.get(
+                name, (0, 0))
+            self.occlusion_cache_stats[name] = (total_query_num + query_num,
+                                                total_hit_num + hit_num)
+
+    def __startStats(self, total_work):
+        if self.tracer.getStats() is not None:
+            self.tracer.getStats().start(total_work)
+
+    def __addStatsCounters(self, tile, counters):
+        """
+            Add the counters of a tile traced by a worker to the stats of
+            the tracer, a tile traced here is popped and added back
+        """
+        render_stats = self.tracer.getStats()
+        if render_stats is None:
+            return
+        if counters is not None:
+            render_stats.mergeCounters(counters)
+        render_stats.addProgress(_tileArea(tile))
+
+    def __traceTiles(self, color_buf):
+        width = self.tracer.getWidth()
+        height = self.tracer.getHeight()
+        tiles = genTiles(width, height, self.tile_size)
+        shared = self.__isPooled()
+        self.spp_buf = FrameBuffer(width, height, 1, "i", shared)
+        buffers = (color_buf, self.spp_buf)
+        settings = (width, height, self.tile_size, 0,
+                    self.tracer.getSamplerNum())
+        pass_index, done_tiles = self.__resume(settings, list(buffers))
+        self.tracer.getScene().getBVH()  # Build once before the workers start
+        self.__startStats(sum(_tileArea(tile) for index, tile in enumerate(tiles)
+                              if index not in done_tiles))
+
+        pool = self.__startWorkers(buffers)
+        try:
+            print("Tracer Process: Start")
+            tasks = [(tile, None, _taskSeed(self.seed, 0, tile))
+                     for index, tile in enumerate(tiles)
+                     if index not in done_tiles]
+            tile_indices = dict((tile, index) for index, tile in enumerate(tiles))
+            results = self.__traceTasks(pool, buffers, tasks)
+            for tile, stats, counters in results:
+                self.__addOcclusionCacheStats(stats)
+                self.__addStatsCounters(tile, counters)
+                done_tiles.add(tile_indices[tile])
+                self.__saveCheckpoint(settings, 0, done_tiles, buffers, False)
+                ratio = 100.0 * len(done_tiles) / len(tiles)
+                print("Tracer Process: %f" % (ratio,))
+            print("Tracer Process: End")
+        finally:
+            self.__stopWorkers(pool)
+        self.__removeCheckpoint()
+
+    def __traceProgressive(self, color_buf):
+        """
+            The workers write every pass to the pass buffers, the samples
+            of a finished tile are added to the sums here. The sums never
+            hold a part of a tile, so they can be saved at any time
+        """
+        width = self.tracer.getWidth()
+        height = self.tracer.getHeight()
+        tiles = genTiles(width, height, self.tile_size)
+        shared = self.__isPooled()
+        accumulation_buf = AccumulationBuffer(width, height)
+        self.spp_buf = accumulation_buf.getCounts()
+        buffers = (FrameBuffer(width, height, 3, "f", shared),
+                   FrameBuffer(width, height, 1, "i", shared))
+        sum_buffers = (accumulation_buf.getSums(), accumulation_buf.getCounts())
+        settings = (width, height, self.tile_size, 1, self.pass_num,
+                    self.pass_sampler_num)
+        first_pass, done_tiles = self.__resume(settings, list(sum_buffers))
+        self.tracer.getScene().getBVH()  # Build once before the workers start
+        self.__startStats(width * height * (self.pass_num - first_pass)
+                          - sum(_tileArea(tiles[index]) for index in done_tiles))
+
+        # Start the workers before the display is opened, forked workers
+        # must not inherit the window
+        pool = self.__startWorkers(buffers)
+        self.window.open()
+        if first_pass > 0 or len(done_tiles) > 0:
+            self.window.drawTile(0, 0, width, height,
+                                 accumulation_buf.resolveTile(0, 0, width, height,
+                                                              color_buf))
+        try:
+            for pass_index in range(first_pass, self.pass_num):
+                sampler_num = self.pass_sampler_num
+                if pass_index == 0:
+                    sampler_num = 1
+                tasks = [(tile, sampler_num,
+                          _taskSeed(self.seed, pass_index, tile))
+                         for index, tile in enumerate(tiles)
+                         if index not in done_tiles]
+                tile_indices = dict((tile, index) for index, tile in enumerate(tiles))
+                results = self.__traceTasks(pool, buffers, tasks)
+
+                for tile, stats, counters in results:
+                    x0, y0, x1, y1 = tile
+                    accumulation_buf.addTile(x0, y0, x1, y1,
+                                             buffers[0].readTile(x0, y0, x1, y1),
+                                             buffers[1].readTile(x0, y0, x1, y1))
+                    display_buf = accumulation_buf.resolveTile(x0, y0, x1, y1,
+                                                               color_buf)
+                    self.__addOcclusionCacheStats(stats)
+                    self.__addStatsCounters(tile, counters)
+                    done_tiles.add(tile_indices[tile])
+                    self.window.drawTile(x0, y0, x1, y1, display_buf)
+                    if self.window.processEvents() is False:
+                        print("Tracer Pass %d: Stop" % (pass_index,))
+                        self.__saveCheckpoint(settings, pass_index, done_tiles,
+                                              sum_buffers, True)
+                        if pool is not None:
+                            pool.terminate()
+                        return
+                    self.__saveCheckpoint(settings, pass_index, done_tiles,
+                                          sum_buffers, False)
+                print("Tracer Pass %d: End, %f" % (pass_index,
+                                                   100.0 * len(done_tiles) / len(tiles)))
+                done_tiles = set()
+                self.__saveCheckpoint(settings, pass_index + 1, done_tiles,
+                                      sum_buffers, True)
+        finally:
+            self.__stopWorkers(pool)
+        self.__removeCheckpoint()
+
+    def __startWorkers(self, buffers):
+        """
+            Start the worker pool or the coordinator, return the pool
+        """
+        if self.coordinator is not None:
+            self.coordinator.start()
+        elif self.worker_num > 1:
+            return multiprocessing.Pool(self.worker_num, _initWorker,
+                                        (self.tracer, buffers))
+        return None
+
+    def __stopWorkers(self, pool):
+        if self.coordinator is not None:
+            self.coordinator.close()
+        elif pool is not None:
+            pool.close()
+            pool.join()
+
+    def __traceTasks(self, pool, buffers, tasks):
+        """
+            Trace the tasks on the workers, or here if there are none.
+            Return an iterator of (tile, cache stats, stats counters) of
+            the finished tiles
+        """
+        if self.coordinator is not None:
+            return self.coordinator.traceTiles(tasks, buffers)
+        elif pool is not None:
+            return pool.imap_unordered(_traceTile, tasks)
+        return (_traceTileWith(self.tracer, buffers, task) for task in tasks)
+
+    def __resume(self, settings, buffers):
+        """
+            Return (pass index, set of finished tile indices) to start from
+        """
+        if self.checkpoint is None or self.enable_resume is False:
+            return 0, set()
+        state = self.checkpoint.load(settings, buffers)
+        if state is None:
+            print("Render Resume: no checkpoint for these settings in %s"
+                  % (self.checkpoint.getFileName(),))
+            return 0, set()
+        print("Render Resume: pass %d, %d tiles done" % (state[0], len(state[1])))
+        return state
+
+    def __saveCheckpoint(self, settings, pass_index, done_tiles, buffers, force):
+        if self.checkpoint is None:
+            return
+        if force is True or self.checkpoint.isDue() is True:
+            self.checkpoint.save(settings, pass_index, done_tiles, buffers)
+
+    def __removeCheckpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
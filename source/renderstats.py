@@ -0,0 +1,238 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Count rays and intersection tests, time the shading stages
+"""
+
+
+import json
+import time
+
+
+__all__ = ["RenderStats", "popOcclusionCacheStats", "popStatsCounters"]
+
+
+class RenderStats(object):
+    """
+        Render instrumentation, set it with Tracer.setStats. Rays and
+        intersection tests are counted per ray type, countRay sets the
+        type the following intersection tests are counted for. Shading
+        stages are timed exclusive of each other, the stage of a mirror
+        ray only holds its hit, its shading goes to the other stages.
+
+        Nothing is counted or timed if the tracer has no stats, every
+        instrumented place only checks for None
+    """
+
+    PRIMARY = "primary"
+    MIRROR = "mirror"
+    AO = "ao"
+    ENV = "env"
+    AREA_LIGHT = "area_light"
+    PARALLEL_LIGHT = "parallel_light"
+    RAY_TYPES = (PRIMARY, MIRROR, AO, ENV, AREA_LIGHT, PARALLEL_LIGHT)
+
+    PRIMARY_HIT = "primary_hit"
+    MIRROR_HIT = "mirror_hit"
+    ENV_LIGHT = "env_light"
+    AMBIENT_LIGHT = "ambient_light"
+    PARALLEL_LIGHT_STAGE = "parallel_light"
+    AREA_LIGHT_STAGE = "area_light"
+    STAGES = (PRIMARY_HIT, MIRROR_HIT, ENV_LIGHT, AMBIENT_LIGHT,
+              PARALLEL_LIGHT_STAGE, AREA_LIGHT_STAGE)
+
+    def __init__(self, progress_callback=None, progress_interval=1.0):
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.ray_type = RenderStats.PRIMARY
+        self.ray_nums = dict.fromkeys(RenderStats.RAY_TYPES, 0)
+        self.test_nums = dict.fromkeys(RenderStats.RAY_TYPES, 0)
+        self.stage_times = dict.fromkeys(RenderStats.STAGES, 0.0)
+        self.total_work = 0
+        self.done_work = 0
+        self.start_time = None
+        self.stop_time = None
+        self.progress_time = 0.0
+
+    def __getstate__(self):
+        # The callback belongs to the process that started the render
+        state = self.__dict__.copy()
+        state["progress_callback"] = None
+        return state
+
+    def setProgressCallback(self, callback, interval=1.0):
+        """
+            callback(progress) is called with the dict of getProgress at
+            most every interval seconds and when the render is done
+        """
+        self.progress_callback = callback
+        self.progress_interval = interval
+
+    def start(self, total_work):
+        """
+            Start the clock, total_work is the number of pixels to trace
+        """
+        self.total_work = total_work
+        self.done_work = 0
+        self.start_time = time.time()
+        self.stop_time = None
+        self.progress_time = self.start_time
+
+    def stop(self):
+        if self.start_time is not None and self.stop_time is None:
+            self.stop_time = time.time()
+
+    def countRay(self, ray_type, num=1):
+        self.ray_type = ray_type
+        self.ray_nums[ray_type] = self.ray_nums[ray_type] + num
+
+    def addTests(self, num):
+        self.test_nums[self.ray_type] = self.test_nums[self.ray_type] + num
+
+    def hitShape(self, shape, ray, t_min, t_max):
+        """
+            Hit function of the scene queries that counts the test
+        """
+        self.test_nums[self.ray_type] = self.test_nums[self.ray_type] + 1
+        return shape.hitT(ray, t_min, t_max)
+
+    def hitShapeFace(self, shape, ray, t_min, t_max):
+        """
+            Same as hitShape for the queries that need the hit face
+        """
+        self.test_nums[self.ray_type] = self.test_nums[self.ray_type] + 1
+        return shape.hitFace(ray, t_min, t_max)
+
+    def timeStage(self, stage, func, arg):
+        """
+            Return func(arg), its run time is added to the stage
+        """
+        start = time.perf_counter()
+        result = func(arg)
+        self.stage_times[stage] = (self.stage_times[stage]
+                                   + time.perf_counter() - start)
+        return result
+
+    def addStageTime(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times[stage] + seconds
+
+    def addProgress(self, work):
+        self.done_work = self.done_work + work
+        if self.progress_callback is None:
+            return
+        now = time.time()
+        if (now - self.progress_time >= self.progress_interval
+            or self.done_work >= self.total_work):
+            self.progress_time = now
+            self.progress_callback(self.getProgress())
+
+    def getProgress(self):
+        """
+            Return {"done", "total", "ratio", "elapsed", "eta",
+            "rays_per_second"}, eta is None before any work is done
+        """
+        elapsed = self.getElapsedTime()
+        ratio = 1.0 * self.done_work / max(self.total_work, 1)
+        eta = None
+        if self.done_work > 0:
+            eta = elapsed * (self.total_work - self.done_work) / self.done_work
+        return {"done": self.done_work, "total": self.total_work,
+                "ratio": ratio, "elapsed": elapsed, "eta": eta,
+                "rays_per_second": self.getRaysPerSecond()}
+
+    def getRayNum(self, ray_type=None):
+        if ray_type is None:
+            return sum(self.ray_nums.values())
+        return self.ray_nums[ray_type]
+
+    def getTestNum(self, ray_type=None):
+        if ray_type is None:
+            return sum(self.test_nums.values())
+        return self.test_nums[ray_type]
+
+    def getStageTime(self, stage):
+        return self.stage_times[stage]
+
+    def getElapsedTime(self):
+        if self.start_time is None:
+            return 0.0
+        if self.stop_time is None:
+            return time.time() - self.start_time
+        return self.stop_time - self.start_time
+
+    def getRaysPerSecond(self):
+        return self.getRayNum() / max(self.getElapsedTime(), 1e-9)
+
+    def popCounters(self):
+        """
+            Return the counters and clear them, worker processes send them
+            to the render process after every tile
+        """
+        counters = {"rays": self.ray_nums, "tests": self.test_nums,
+                    "stage_times": self.stage_times}
+        self.ray_nums = dict.fromkeys(RenderStats.RAY_TYPES, 0)
+        self.test_nums = dict.fromkeys(RenderStats.RAY_TYPES, 0)
+        self.stage_times = dict.fromkeys(RenderStats.STAGES, 0.0)
+        return counters
+
+    def mergeCounters(self, counters):
+        for ray_type, num in counters["rays"].items():
+            self.ray_nums[ray_type] = self.ray_nums[ray_type] + num
+        for ray_type, num in counters["tests"].items():
+            self.test_nums[ray_type] = self.test_nums[ray_type] + num
+        for stage, seconds in counters["stage_times"].items():
+            self.stage_times[stage] = self.stage_times[stage] + seconds
+
+    def toDict(self):
+        return {"elapsed_time": self.getElapsedTime(),
+                "ray_num": self.getRayNum(),
+                "test_num": self.getTestNum(),
+                "rays_per_second": self.getRaysPerSecond(),
+                "rays": dict(self.ray_nums),
+                "intersection_tests": dict(self.test_nums),
+                "stage_times": dict(self.stage_times),
+                "progress": {"done": self.done_work, "total": self.total_work}}
+
+    def toJSON(self, indent=2):
+        return json.dumps(self.toDict(), indent=indent, sort_keys=True)
+
+    def save(self, file_name):
+        with open(file_name, "w") as f:
+            f.write(self.toJSON())
+            f.write("\n")
+
+
+def popOcclusionCacheStats(tracer):
+    """
+        Return the occlusion cache stats of the shader of the tracer and
+        reset them, workers send them with every traced tile
+    """
+    shader = tracer.getShader()
+    stats = shader.getOcclusionCacheStats()
+    shader.resetOcclusionCacheStats()
+    return stats
+
+
+def popStatsCounters(tracer):
+    """
+        Return the counters of the RenderStats of the tracer and clear
+        them, None if the tracer has no stats
+    """
+    if tracer.getStats() is None:
+        return None
+    return tracer.getStats().popCounters()
+
+
+if __name__ == "__main__":
+    stats = RenderStats(lambda progress: print(progress), 0.0)
+    stats.start(2)
+    stats.countRay(RenderStats.PRIMARY)
+    stats.addTests(3)
+    stats.addProgress(1)
+    stats.addProgress(1)
+    stats.stop()
+    print(stats.toJSON())
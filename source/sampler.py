@@ -13,6 +13,11 @@ import math
 import random
 from abc import ABCMeta, abstractmethod
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from color import *
 from vector import *
 from window import *
@@ -27,10 +32,20 @@ class Sampler(metaclass=ABCMeta):
     NROOK = 2
     MULTIJITTERED = 3
     HAMMERSLEY = 4
+
+    # Number of sampler sets in a pool
+    SET_NUM = 83
     
     def __init__(self, sampler_type):
         self.type = sampler_type
         self.samplers = []
+        # Pools keyed by the number of samplers, the hemisphere pools by
+        # (number of samplers, cosine power)
+        self.sets = {}
+        self.hemi_sphere_sets = {}
+        self.hemi_sphere_arrays = {}
+        self.shuffled_indices = []
+        self.count = 0
 
     @abstractmethod
     def genSamplersInUnitSqure(self, num):
@@ -45,6 +60,84 @@ class Sampler(metaclass=ABCMeta):
     def getSamplers(self):
         return self.samplers
 
+    def genSamplerSets(self, num, set_num=SET_NUM):
+        """
+            Precompute a pool of set_num sets of num samplers, the pools
+            of the other numbers are kept
+        """
+        sets = []
+        for i in range(set_num):
+            self.genSamplersInUnitSqure(num)
+            sets.append(self.samplers)
+        self.sets[num] = sets
+        for key in [key for key in self.hemi_sphere_sets if key[0] == num]:
+            del self.hemi_sphere_sets[key]
+        for key in [key for key in self.hemi_sphere_arrays if key[0] == num]:
+            del self.hemi_sphere_arrays[key]
+        self.shuffled_indices = list(range(set_num))
+        self.count = len(self.shuffled_indices)
+
+    def getSamplerSets(self, num):
+        if num not in self.sets:
+            self.genSamplerSets(num)
+        return self.sets[num]
+
+    def getHemiSphereSets(self, num, e):
+        """
+            Return the pool mapped to the hemisphere with cosine power e,
+            every sampler is a (u, v, w) direction in the local frame
+        """
+        sets = self.getSamplerSets(num)
+        if (num, e) not in self.hemi_sphere_sets:
+            hemi_sphere_sets = []
+            for samplers in sets:
+                directions = []
+                for sampler in samplers:
+                    phi = 2 * math.pi * sampler.x
+                    cos_theta = pow(1 - sampler.y, 1 / (e + 1))
+                    sin_theta = math.sqrt(max(0.0, 1 - cos_theta * cos_theta))
+                    directions.append((sin_theta * math.cos(phi),
+                                       sin_theta * math.sin(phi),
+                                       cos_theta))
+                hemi_sphere_sets.append(directions)
+            self.hemi_sphere_sets[(num, e)] = hemi_sphere_sets
+        return self.hemi_sphere_sets[(num, e)]
+
+    def getHemiSphereArrays(self, num, e):
+        """
+            Return the hemisphere pool of getHemiSphereSets as a numpy
+            array of (set num, num, 3), needs numpy
+        """
+        sets = self.getHemiSphereSets(num, e)
+        if (num, e) not in self.hemi_sphere_arrays:
+            self.hemi_sphere_arrays[(num, e)] = numpy.array(
+                sets, dtype=numpy.float64)
+        return self.hemi_sphere_arrays[(num, e)]
+
+    def nextSetIndex(self):
+        """
+            Hand out the sets of the pool in shuffled order, the order is
+            shuffled again after every set has been used
+        """
+        if self.count >= len(self.shuffled_indices):
+            random.shuffle(self.shuffled_indices)
+            self.count = 0
+        index = self.shuffled_indices[self.count]
+        self.count = self.count + 1
+        return index
+
+    def getNextSamplers(self, num):
+        return self.getSamplerSets(num)[self.nextSetIndex()]
+
+    def getNextHemiSphereSamplers(self, num, e):
+        return self.getHemiSphereSets(num, e)[self.nextSetIndex()]
+
+    def getNextHemiSphereArray(self, num, e):
+        """
+            Return the next hemisphere set as a (num, 3) numpy array
+        """
+        return self.getHemiSphereArrays(num, e)[self.nextSetIndex()]
+
 
 class RandomSampler(Sampler):
     def __init__(self):
@@ -89,15 +182,12 @@ class NRookSampler(Sampler):
     def genSamplersInUnitSqure(self, num):
         self.samplers = []
         step = 1.0 / num
-        col_list = []
+        col_list = list(range(num))
+        random.shuffle(col_list)
         for i in range(num):
-                col_list.append(i)
-        for i in range(num):
-            r = random.randint(0, len(col_list) - 1)
-            col = col_list[r]
+            col = col_list[i]
             x = col * step + random.random() * step
             y = i * step + random.random() * step
-            col_list.remove(col)
             self.samplers.append(Vector2(x, y))
 
 
@@ -119,27 +209,27 @@ class MultiJitteredSampler(Sampler):
             return
 
         step = 1.0 / num
-        
+        t = int(t)
+
+        # Every column of cells uses each sub column once, every row of
+        # cells uses each sub row once
         col_lists = []
         row_lists = []
-        for i in range(int(t)):
-            col_lists.append([])
-            row_lists.append([])
-            for j in range(int(t)):
-                col_lists[i].append(j)
-                row_lists[i].append(j)
-
-        for i in range(int(t)):
-            for j in range(int(t)):
-                col = col_lists[j][random.randint(0, len(col_lists[j]) - 1)]
-                row = row_lists[i][random.randint(0, len(row_lists[i]) - 1)]
+        for i in range(t):
+            col_lists.append(list(range(t)))
+            random.shuffle(col_lists[i])
+            row_lists.append(list(range(t)))
+            random.shuffle(row_lists[i])
+
+        for i in range(t):
+            for j in range(t):
+                col = col_lists[j][i]
+                row = row_lists[i][j]
                 x = j * t + col
                 y = i * t + row
                 x = x * step + random.random() * step
                 y = y * step + random.random() * step
                 self.samplers.append(Vector2(x, y))
-                col_lists[j].remove(col)
-                row_lists[i].remove(row)
 
 class HammersleySampler(Sampler):
     def __init__(self):
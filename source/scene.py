@@ -11,14 +11,22 @@
 
 import math
 from abc import ABCMeta, abstractmethod
+from array import array
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bvh import *
 from color import *
 from light import *
 from material import *
 from vector import *
 
 
-__all__ = ["Ray", "Shape", "Sphere", "Scene", "Plane", "Triangle", "Squre"]
+__all__ = ["Ray", "Shape", "Sphere", "Scene", "Plane", "Triangle", "Squre",
+           "TriangleMesh", "OcclusionCache"]
 
 
 class Ray:
@@ -31,6 +39,39 @@ class Ray:
         self.d = direction
 
 
+class OcclusionCache(object):
+    """
+        Remember the shape that blocked the last visibility ray, the next
+        query tests it first before traversing the whole scene
+    """
+
+    def __init__(self):
+        self.last_occluder = None
+        self.query_num = 0
+        self.hit_num = 0
+
+    def getLastOccluder(self):
+        return self.last_occluder
+
+    def setLastOccluder(self, shape):
+        self.last_occluder = shape
+
+    def getQueryNum(self):
+        return self.query_num
+
+    def getHitNum(self):
+        return self.hit_num
+
+    def getHitRate(self):
+        if self.query_num == 0:
+            return 0.0
+        return 1.0 * self.hit_num / self.query_num
+
+    def resetStats(self):
+        self.query_num = 0
+        self.hit_num = 0
+
+
 class Shape(metaclass=ABCMeta):
     """
         Basic shape interface, all subclass must implement isIntersection method
@@ -40,6 +81,7 @@ class Shape(metaclass=ABCMeta):
     PLANE = 1
     TRIANGLE = 2
     SQURE = 3
+    TRIANGLE_MESH = 4
     
     def __init__(self, shapeType, material):
         self.shape_type = shapeType
@@ -69,6 +111,31 @@ class Shape(metaclass=ABCMeta):
         """
         pass
 
+    def hitT(self, ray, t_min=0.0, t_max=float("inf")):
+        """
+            Return the distance of the closest hit inside (t_min, t_max),
+            None if there is no such hit. The hit point is not computed,
+            shapes override it to reject hits out of range early
+        """
+        b,p,t = self.isIntersection(ray)
+        if b is True and t_min < t and t < t_max:
+            return t
+        return None
+
+    def hitFace(self, ray, t_min=0.0, t_max=float("inf")):
+        """
+            Return (t, face) of the closest hit like hitT, face tells the
+            hit part of shapes built from several, like the triangles of a
+            mesh. It is None for the other shapes
+        """
+        return self.hitT(ray, t_min, t_max), None
+
+    def genHitNormal(self, point, face):
+        """
+            Return the normal at a hit point, face is the one of hitFace
+        """
+        return self.genNormal(point)
+
     @abstractmethod
     def genNormal(self, point):
         """
@@ -76,6 +143,21 @@ class Shape(metaclass=ABCMeta):
         """
         pass
 
+    def getBoundingBox(self):
+        """
+            Return AABB of the shape, None if the shape is unbounded
+        """
+        return None
+
+    def isIntersectionPacket(self, origins, directions):
+        """
+            Intersect a packet of rays given as numpy arrays, origins is
+            (3,) or (N, 3), directions is (N, 3). Return an array of N hit
+            distances with inf for missed rays, or None if the shape has
+            no packet intersection
+        """
+        return None
+
 
 class Sphere(Shape):
     """
@@ -88,45 +170,51 @@ class Sphere(Shape):
         self.r = radius
 
     def isIntersection(self, ray):
-        a = Vector.dot(ray.d, ray.d)
-        b = 2 * Vector.dot(ray.o - self.p, ray.d)
-        c = Vector.dot((ray.o - self.p), (ray.o - self.p)) - (self.r * self.r)
-        
-        d = b * b - 4 * a * c
-        if d < 0:
-            return False, Vector(0.0, 0.0, 0.0), 0.0
-        elif d == 0:
-            t = -b / (2 * a)
-            q = ray.o + ray.d * t
-            if (t > 0.0):
-                return True, q, t
-            else:
-                return False, Vector(0.0, 0.0, 0.0), 0.0
-        else:
-            t0 = (-b + math.sqrt(d)) / (2 * a)
-            t1 = (-b - math.sqrt(d)) / (2 * a)
-            if t0 < 0.0 and t1 < 0.0:
-                return False, Vector(0.0, 0.0, 0.0), 0.0
-            elif t0 < 0.0 and t1 > 0.0:
-                q = ray.o + ray.d * t1
-                return True, q, t1
-            elif t0 > 0.0 and t1 < 0.0:
-                q = ray.o + ray.d * t0
-                return True, q, t0
-            else:
-                t = 0.0
-                if t0 > t1:
-                    t = t1
-                else:
-                    t = t0
-                q = ray.o + ray.d * t
-                return True, q, t
+        return _toIntersection(ray, self.hitT(ray))
+
+    def hitT(self, ray, t_min=0.0, t_max=float("inf")):
+        d = ray.d
+        ox = ray.o.x - self.p.x
+        oy = ray.o.y - self.p.y
+        oz = ray.o.z - self.p.z
+        a = d.x * d.x + d.y * d.y + d.z * d.z
+        b = 2 * (ox * d.x + oy * d.y + oz * d.z)
+        c = ox * ox + oy * oy + oz * oz - (self.r * self.r)
+
+        disc = b * b - 4 * a * c
+        if disc < 0:
+            return None
+        sqrt_disc = math.sqrt(disc)
+        t = (-b - sqrt_disc) / (2 * a)
+        if t_min < t and t < t_max:
+            return t
+        t = (-b + sqrt_disc) / (2 * a)
+        if t_min < t and t < t_max:
+            return t
+        return None
             
     def genNormal(self, point):
         normal = point - self.p
         normal.normalize()
         return normal
 
+    def getBoundingBox(self):
+        r = Vector(self.r, self.r, self.r)
+        return AABB(self.p - r, self.p + r)
+
+    def isIntersectionPacket(self, origins, directions):
+        oc = origins - numpy.array((self.p.x, self.p.y, self.p.z))
+        a = numpy.sum(directions * directions, axis=-1)
+        b = 2 * numpy.sum(oc * directions, axis=-1)
+        c = numpy.sum(oc * oc, axis=-1) - (self.r * self.r)
+
+        d = b * b - 4 * a * c
+        sqrt_d = numpy.sqrt(numpy.maximum(d, 0.0))
+        t0 = (-b + sqrt_d) / (2 * a)
+        t1 = (-b - sqrt_d) / (2 * a)
+        t = numpy.where(t1 > 0.0, t1, numpy.where(t0 > 0.0, t0, numpy.inf))
+        return numpy.where(d < 0.0, numpy.inf, t)
+
 
 class Plane(Shape):
     """
@@ -139,21 +227,31 @@ class Plane(Shape):
         self.normal = normal
 
     def isIntersection(self, ray):
-        t = self.pos - ray.o
-        a = Vector.dot(t, self.normal)
-        b = Vector.dot(ray.d, self.normal)
+        return _toIntersection(ray, self.hitT(ray))
+
+    def hitT(self, ray, t_min=0.0, t_max=float("inf")):
+        n = self.normal
+        b = Vector.dot(ray.d, n)
         if abs(b) < 0.0001:
-            return False, Vector(0.0, 0.0, 0.0), 0.0
-        else:
-            t = a / b
-            if t > 0.0:
-                return True, ray.o + ray.d * t, t
-            else:
-                return False, Vector(0.0, 0.0, 0.0), 0.0
+            return None
+        t = ((self.pos.x - ray.o.x) * n.x + (self.pos.y - ray.o.y) * n.y
+             + (self.pos.z - ray.o.z) * n.z) / b
+        if t_min < t and t < t_max:
+            return t
+        return None
 
     def genNormal(self, point):
         return self.normal
 
+    def isIntersectionPacket(self, origins, directions):
+        n = numpy.array((self.normal.x, self.normal.y, self.normal.z))
+        a = numpy.sum((numpy.array((self.pos.x, self.pos.y, self.pos.z))
+                       - origins) * n, axis=-1)
+        b = numpy.sum(directions * n, axis=-1)
+        parallel = numpy.abs(b) < 0.0001
+        t = a / numpy.where(parallel, 1.0, b)
+        return numpy.where(parallel | (t <= 0.0), numpy.inf, t)
+
 
 class Triangle(Shape):
     def __init__(self, v0, v1, v2, material):
@@ -168,6 +266,9 @@ class Triangle(Shape):
         self.normal = Vector.cross(e0, e1)
 
     def isIntersection(self, ray):
+        return _toIntersection(ray, self.hitT(ray))
+
+    def hitT(self, ray, t_min=0.0, t_max=float("inf")):
         a = self.v0.x - self.v1.x
         b = self.v0.x - self.v2.x
         c = ray.d.x
@@ -190,37 +291,77 @@ class Triangle(Shape):
         s = e * j - f * i
 
         if abs(a * m + b * q + c * s) < 0.0001:
-            return False, Vector(0, 0, 0), 0.0
+            return None
         
         inv_denom = 1.0 / (a * m + b * q + c * s)
 
+        # Reject by distance first, the closest hit query shrinks t_max
+        r = e * l - h * i
+        e3 = a * p - b * r + d * s
+        t = e3 * inv_denom
+
+        if t < 0.0001 or t <= t_min or t >= t_max:
+            return None
+
         e1 = d * m - b * n - c * p
         beta = e1 * inv_denom
 
         if beta < 0.0:
-            return False, Vector(0, 0, 0), 0.0
+            return None
 
-        r = e * l - h * i
         e2 = a * n + d * q + c * r
         gamma = e2 * inv_denom
 
         if gamma < 0.0:
-            return False, Vector(0.0, 0.0, 0.0), 0.0
+            return None
 
         if beta + gamma > 1.0:
-            return False, Vector(0.0, 0.0, 0.0), 0.0
+            return None
 
-        e3 = a * p - b * r + d * s
-        t = e3 * inv_denom
-
-        if t < 0.0001:
-            return False, Vector(0.0, 0.0, 0.0), 0.0
-
-        return True, ray.o + ray.d * t, t
+        return t
 
     def genNormal(self, point):
         return self.normal
 
+    def getBoundingBox(self):
+        return AABB.fromPoints([self.v0, self.v1, self.v2])
+
+    def isIntersectionPacket(self, origins, directions):
+        origins = numpy.broadcast_to(origins, directions.shape)
+        a = self.v0.x - self.v1.x
+        b = self.v0.x - self.v2.x
+        c = directions[:, 0]
+        d = self.v0.x - origins[:, 0]
+
+        e = self.v0.y - self.v1.y
+        f = self.v0.y - self.v2.y
+        g = directions[:, 1]
+        h = self.v0.y - origins[:, 1]
+
+        i = self.v0.z - self.v1.z
+        j = self.v0.z - self.v2.z
+        k = directions[:, 2]
+        l = self.v0.z - origins[:, 2]
+
+        m = f * k - g * j
+        n = h * k - g * l
+        p = f * l - h * j
+        q = g * i - e * k
+        s = e * j - f * i
+
+        denom = a * m + b * q + c * s
+        miss = numpy.abs(denom) < 0.0001
+        inv_denom = 1.0 / numpy.where(miss, 1.0, denom)
+
+        beta = (d * m - b * n - c * p) * inv_denom
+        r = e * l - h * i
+        gamma = (a * n + d * q + c * r) * inv_denom
+        t = (a * p - b * r + d * s) * inv_denom
+
+        miss = (miss | (beta < 0.0) | (gamma < 0.0) | (beta + gamma > 1.0)
+                | (t < 0.0001))
+        return numpy.where(miss, numpy.inf, t)
+
 
 class Squre(Shape):
     def __init__(self, p, s, n, material):
@@ -253,13 +394,13 @@ class Squre(Shape):
         self.up = up
 
     def isIntersection(self, ray):
-        b,p,t = self.tr0.isIntersection(ray)
-        if b is True:
-            return b,p,t
-        b,p,t = self.tr1.isIntersection(ray)
-        if b is True:
-            return b,p,t
-        return False, Vector(0,0,0), 0.0
+        return _toIntersection(ray, self.hitT(ray))
+
+    def hitT(self, ray, t_min=0.0, t_max=float("inf")):
+        t = self.tr0.hitT(ray, t_min, t_max)
+        if t is None:
+            t = self.tr1.hitT(ray, t_min, t_max)
+        return t
 
     def genNormal(self, shadeInfo):
         return self.normal
@@ -270,22 +411,240 @@ class Squre(Shape):
 
     def getArea(self):
         return self.size * self.size
+
+    def getBoundingBox(self):
+        return AABB.union(self.tr0.getBoundingBox(), self.tr1.getBoundingBox())
+
+    def isIntersectionPacket(self, origins, directions):
+        t = self.tr0.isIntersectionPacket(origins, directions)
+        return numpy.where(numpy.isinf(t),
+                           self.tr1.isIntersectionPacket(origins, directions), t)
     
 
+class TriangleMesh(Shape):
+    """
+        Triangle mesh, vertices are stored in a flat array('d') of x,y,z
+        and faces in a flat array('i') of vertex index triples. Face
+        normals are computed the first time they are needed, the faces
+        are intersected through a BVH of their own
+    """
+
+    def __init__(self, vertices, indices, material):
+        super().__init__(Shape.TRIANGLE_MESH, material)
+        self.vertices = vertices
+        self.indices = indices
+        self.normals = None
+        self.normal_flags = None
+        self.bvh = None
+
+    @staticmethod
+    def createFromOBJ(file_name, material):
+        """
+            Load the v and f records of an OBJ file line by line, polygons
+            are split into triangle fans
+        """
+        vertices = array("d")
+        indices = array("i")
+        with open(file_name, "r") as f:
+            for line in f:
+                if line.startswith("v "):
+                    parts = line.split()
+                    vertices.append(float(parts[1]))
+                    vertices.append(float(parts[2]))
+                    vertices.append(float(parts[3]))
+                elif line.startswith("f "):
+                    vertex_num = len(vertices) // 3
+                    face = []
+                    for part in line.split()[1:]:
+                        index = int(part.split("/")[0])
+                        if index < 0:
+                            face.append(vertex_num + index)
+                        else:
+                            face.append(index - 1)
+                    for i in range(1, len(face) - 1):
+                        indices.append(face[0])
+                        indices.append(face[i])
+                        indices.append(face[i + 1])
+        return TriangleMesh(vertices, indices, material)
+
+    def getVertexNum(self):
+        return len(self.vertices) // 3
+
+    def getFaceNum(self):
+        return len(self.indices) // 3
+
+    def getVertex(self, index):
+        k = index * 3
+        return Vector(self.vertices[k], self.vertices[k + 1], self.vertices[k + 2])
+
+    def getFaceNormal(self, face):
+        if self.normals is None:
+            self.normals = array("d", bytes(8 * len(self.indices)))
+            self.normal_flags = bytearray(self.getFaceNum())
+
+        k = face * 3
+        if self.normal_flags[face] == 0:
+            v0 = self.getVertex(self.indices[k])
+            e0 = self.getVertex(self.indices[k + 1]) - v0
+            e1 = self.getVertex(self.indices[k + 2]) - v0
+            normal = Vector.cross(e0, e1)
+            normal.normalize()
+            self.normals[k] = normal.x
+            self.normals[k + 1] = normal.y
+            self.normals[k + 2] = normal.z
+            self.normal_flags[face] = 1
+        return Vector(self.normals[k], self.normals[k + 1], self.normals[k + 2])
+
+    def getBVH(self):
+        if self.bvh is None:
+            # Face bounds go straight to a flat array, the BVH keeps the
+            # face indices in an array('i')
+            v = self.vertices
+            indices = self.indices
+            bounds = array("d", bytes(8 * 2 * len(indices)))
+            for k in range(0, len(indices), 3):
+                i0 = indices[k] * 3
+                i1 = indices[k + 1] * 3
+                i2 = indices[k + 2] * 3
+                j = k * 2
+                bounds[j] = min(v[i0], v[i1], v[i2])
+                bounds[j + 1] = min(v[i0 + 1], v[i1 + 1], v[i2 + 1])
+                bounds[j + 2] = min(v[i0 + 2], v[i1 + 2], v[i2 + 2])
+                bounds[j + 3] = max(v[i0], v[i1], v[i2])
+                bounds[j + 4] = max(v[i0 + 1], v[i1 + 1], v[i2 + 1])
+                bounds[j + 5] = max(v[i0 + 2], v[i1 + 2], v[i2 + 2])
+            self.bvh = BVH(None, bounds)
+        return self.bvh
+
+    def isIntersection(self, ray):
+        return _toIntersection(ray, self.hitT(ray))
+
+    def hitT(self, ray, t_min=0.0, t_max=float("inf")):
+        return self.hitFace(ray, t_min, t_max)[0]
+
+    def hitFace(self, ray, t_min=0.0, t_max=float("inf")):
+        face, t = self.getBVH().closestHit(ray, self.__hitFace, t_min, t_max)
+        if face is None:
+            return None, None
+        return t, face
+
+    def genHitNormal(self, point, face):
+        if face is None:
+            return self.genNormal(point)
+        return self.getFaceNormal(face)
+
+    def genNormal(self, point):
+        """
+            Normal of a point on the mesh, without a hit face the face is
+            searched by the point
+        """
+        face = self.getBVH().findItem(point, self.__isOnFace, 0.0001)
+        if face is None:
+            raise ValueError("Point is not on the mesh")
+        return self.getFaceNormal(face)
+
+    def getBoundingBox(self):
+        if len(self.vertices) == 0:
+            return None
+        v = self.vertices
+        return AABB(Vector(min(v[0::3]), min(v[1::3]), min(v[2::3])),
+                    Vector(max(v[0::3]), max(v[1::3]), max(v[2::3])))
+
+    def __hitFace(self, face, ray, t_min, t_max):
+        """
+            Same test as Triangle.isIntersection, read from the buffers
+        """
+        v = self.vertices
+        k = face * 3
+        i0 = self.indices[k] * 3
+        i1 = self.indices[k + 1] * 3
+        i2 = self.indices[k + 2] * 3
+
+        a = v[i0] - v[i1]
+        b = v[i0] - v[i2]
+        c = ray.d.x
+        d = v[i0] - ray.o.x
+
+        e = v[i0 + 1] - v[i1 + 1]
+        f = v[i0 + 1] - v[i2 + 1]
+        g = ray.d.y
+        h = v[i0 + 1] - ray.o.y
+
+        i = v[i0 + 2] - v[i1 + 2]
+        j = v[i0 + 2] - v[i2 + 2]
+        k = ray.d.z
+        l = v[i0 + 2] - ray.o.z
+
+        m = f * k - g * j
+        n = h * k - g * l
+        p = f * l - h * j
+        q = g * i - e * k
+        s = e * j - f * i
+
+        denom = a * m + b * q + c * s
+        if abs(denom) < 0.0001:
+            return None
+        inv_denom = 1.0 / denom
+
+        beta = (d * m - b * n - c * p) * inv_denom
+        if beta < 0.0:
+            return None
+
+        r = e * l - h * i
+        gamma = (a * n + d * q + c * r) * inv_denom
+        if gamma < 0.0 or beta + gamma > 1.0:
+            return None
+
+        t = (a * p - b * r + d * s) * inv_denom
+        if t < 0.0001 or t <= t_min or t >= t_max:
+            return None
+        return t
+
+    def __isOnFace(self, face, point):
+        """
+            Return True if the point lies on the face, up to a small error
+        """
+        k = face * 3
+        v0 = self.getVertex(self.indices[k])
+        v1 = self.getVertex(self.indices[k + 1])
+        v2 = self.getVertex(self.indices[k + 2])
+        normal = self.getFaceNormal(face)
+        ep = 0.0001 * max((v1 - v0).length(), (v2 - v0).length(), 1e-6)
+        if abs(Vector.dot(point - v0, normal)) > ep:
+            return False
+        for e0, e1 in ((v0, v1), (v1, v2), (v2, v0)):
+            edge_normal = Vector.cross(normal, e1 - e0)
+            edge_normal.normalize()
+            if Vector.dot(point - e0, edge_normal) < -ep:
+                return False
+        return True
+
+
 class Scene(object):
     """
         Scene, hold all the geometry
     """
 
+    # Below this number of shapes a linear scan is faster than the BVH
+    BVH_MIN_SHAPE_NUM = 8
+
     def __init__(self):
         self.shapes = []
         self.ambient_light = None
         self.parallel_light = None
         self.env_light = None
         self.area_lights = []
+        self.area_light_table = None
+        self.area_light_indices = None
+        self.enable_bvh = True
+        self.bvh = None
+        self.unbounded_shapes = []
+        self.shape_indices = {}
+        self.stats = None
 
     def addShape(self, shape):
         self.shapes.append(shape)
+        self.bvh = None
 
     def getAllShapes(self):
         return self.shapes
@@ -304,36 +663,324 @@ class Scene(object):
 
     def addAreaLight(self, light):
         self.area_lights.append(light)
+        self.area_light_table = None
+        self.area_light_indices = None
+
+    def clearAreaLights(self):
+        """
+            Remove all area lights, their shapes stay in the scene
+        """
+        self.area_lights = []
+        self.area_light_table = None
+        self.area_light_indices = None
 
     def getAreaLights(self):
         return self.area_lights
 
+    def getAreaLightTable(self):
+        """
+            Return the AliasTable of the area lights weighted by their
+            power, built the first time it is needed. None if the lights
+            emit no power at all, like emissions with a ke of 0
+        """
+        if self.area_light_table is None:
+            powers = [light.getPower() for light in self.area_lights]
+            if sum(powers) <= 0.0:
+                return None
+            self.area_light_table = AliasTable(powers)
+        return self.area_light_table
+
+    def getAreaLightIndex(self, shape):
+        """
+            Return the index of the area light of the shape, None if the
+            shape is not an area light
+        """
+        if self.area_light_indices is None:
+            self.area_light_indices = dict(
+                (light.getShape(), index)
+                for index, light in enumerate(self.area_lights))
+        return self.area_light_indices.get(shape)
+
     def setEnvLight(self, light):
         self.env_light = light
 
     def getEnvLight(self):
         return self.env_light
 
-    def isIntersection(self, ray, ep = 0.0):
+    def setStats(self, stats):
+        """
+            Count the intersection tests of the queries in a RenderStats,
+            None disables counting
+        """
+        self.stats = stats
+
+    def setEnableBVH(self, enable):
+        self.enable_bvh = enable
+        self.bvh = None
+
+    def buildBVH(self):
+        """
+            Build the BVH over all bounded shapes, unbounded shapes like
+            Plane are kept in a list and tested for every ray
+        """
+        bounded_shapes = []
+        bounds = []
+        self.unbounded_shapes = []
+        self.shape_indices = dict(
+            (shape, index) for index, shape in enumerate(self.shapes))
+        use_bvh = (self.enable_bvh is True
+                   and len(self.shapes) >= Scene.BVH_MIN_SHAPE_NUM)
         for shape in self.shapes:
-            b,p,t = shape.isIntersection(ray)
-            if b is True:
-                if t > ep:
-                    return True
-        return False
+            box = None
+            if use_bvh is True:
+                box = shape.getBoundingBox()
+            if box is None:
+                self.unbounded_shapes.append(shape)
+            else:
+                bounded_shapes.append(shape)
+                bounds.append(box.getBounds())
+        self.bvh = BVH(bounded_shapes, bounds)
 
-    def isTwoPointsVisible(self, p0, ep0, p1, ep1):
+    def getBVH(self):
+        if self.bvh is None:
+            self.buildBVH()
+        return self.bvh
+
+    def hitClosest(self, ray, ep = 0.0, t_max = float("inf")):
+        """
+            Return (shape, t) of the closest shape hit in (ep, t_max),
+            (None, t_max) if nothing is hit
+        """
+        hit_func = _hitShape
+        if self.stats is not None:
+            hit_func = self.stats.hitShape
+        closest, t_max, face = self.__closestHit(ray, hit_func, ep, t_max,
+                                                 False)
+        return closest, t_max
+
+    def hitClosestFace(self, ray, ep = 0.0, t_max = float("inf")):
+        """
+            Return (shape, t, face) of the closest shape hit in (ep,
+            t_max), face is the one of Shape.hitFace. (None, t_max, None)
+            if nothing is hit
+        """
+        hit_func = _hitShapeFace
+        if self.stats is not None:
+            hit_func = self.stats.hitShapeFace
+        return self.__closestHit(ray, hit_func, ep, t_max, True)
+
+    def __closestHit(self, ray, hit_func, ep, t_max, with_face):
+        bvh = self.getBVH()
+        closest = None
+        closest_face = None
+        for shape in self.unbounded_shapes:
+            if with_face is True:
+                t, face = hit_func(shape, ray, ep, t_max)
+            else:
+                t = hit_func(shape, ray, ep, t_max)
+                face = None
+            if t is not None:
+                t_max = t
+                closest = shape
+                closest_face = face
+        if with_face is True:
+            shape, t_max, face = bvh.closestHitFace(ray, hit_func, ep, t_max)
+        else:
+            shape, t_max = bvh.closestHit(ray, hit_func, ep, t_max)
+            face = None
+        if shape is not None:
+            closest = shape
+            closest_face = face
+        return closest, t_max, closest_face
+
+    def hitClosestPacket(self, origins, directions, ep = 0.0,
+                         t_max = float("inf")):
+        """
+            Closest hit of a packet of rays given as numpy arrays, see
+            Shape.isIntersectionPacket. The packet is culled against the
+            BVH, a shape is only tested against the rays that reach its
+            leaf. Return (t, index, face) arrays holding the hit distance,
+            the index of the hit shape in getAllShapes, -1 for missed
+            rays, and the face of Shape.hitFace, -1 if None
+        """
+        bvh = self.getBVH()
+        ray_num = len(directions)
+        closest_t = numpy.full(ray_num, t_max)
+        closest_index = numpy.full(ray_num, -1, dtype=numpy.int64)
+        closest_face = numpy.full(ray_num, -1, dtype=numpy.int64)
+        closest = (closest_t, closest_index, closest_face)
+        for shape in self.unbounded_shapes:
+            self.__hitPacketShape(shape, origins, directions, None, ep,
+                                  closest)
+        for shapes, rays in bvh.packetLeaves(origins, directions, ep,
+                                             closest_t):
+            for shape in shapes:
+                self.__hitPacketShape(shape, origins, directions, rays, ep,
+                                      closest)
+        return closest
+
+    def __hitPacketShape(self, shape, origins, directions, rays, ep,
+                         closest):
+        """
+            Test a shape against the rays of a packet, all of them if rays
+            is None. Closer hits are written to the (t, index, face)
+            arrays of closest
+        """
+        closest_t, closest_index, closest_face = closest
+        if rays is None:
+            limit = closest_t
+        else:
+            origins = numpy.broadcast_to(origins, directions.shape)[rays]
+            directions = directions[rays]
+            limit = closest_t[rays]
+        if self.stats is not None:
+            self.stats.addTests(len(directions))
+
+        faces = None
+        t = shape.isIntersectionPacket(origins, directions)
+        if t is None:
+            faces = numpy.full(len(directions), -1, dtype=numpy.int64)
+            t = self.__hitPacketPerRay(shape, origins, directions, faces)
+        closer = (t > ep) & (t < limit)
+        hit_rays = closer if rays is None else rays[closer]
+        closest_t[hit_rays] = t[closer]
+        closest_index[hit_rays] = self.shape_indices[shape]
+        if faces is None:
+            closest_face[hit_rays] = -1
+        else:
+            closest_face[hit_rays] = faces[closer]
+
+    def isIntersectionPacket(self, origins, directions, ep = 0.0,
+                             t_max = float("inf")):
+        """
+            Occlusion of a packet of rays given as numpy arrays, see
+            Shape.isIntersectionPacket. Return a bool array, True for the
+            rays blocked inside (ep, t_max). The packet is culled against
+            the BVH and a blocked ray is dropped from it, the following
+            shapes only test the others
+        """
+        bvh = self.getBVH()
+        origins = numpy.broadcast_to(origins, directions.shape)
+        blocked = numpy.zeros(len(directions), dtype=bool)
+        remain = numpy.arange(len(directions))
+        for shape in self.unbounded_shapes:
+            if len(remain) == 0:
+                return blocked
+            remain = self.__blockPacketShape(shape, origins, directions,
+                                             remain, ep, t_max, blocked)
+
+        # A blocked ray gets a t_max of -inf, the BVH culls it
+        limits = numpy.where(blocked, -numpy.inf, t_max)
+        for shapes, rays in bvh.packetLeaves(origins, directions, ep, limits):
+            rays = rays[~blocked[rays]]
+            for shape in shapes:
+                if len(rays) == 0:
+                    break
+                rays = self.__blockPacketShape(shape, origins, directions,
+                                               rays, ep, t_max, blocked)
+            limits[blocked] = -numpy.inf
+        return blocked
+
+    def __blockPacketShape(self, shape, origins, directions, rays, ep, t_max,
+                           blocked):
+        """
+            Test a shape against the rays of a packet, mark the rays it
+            blocks in blocked and return the others
+        """
+        if self.stats is not None:
+            self.stats.addTests(len(rays))
+        ray_origins = origins[rays]
+        ray_directions = directions[rays]
+        t = shape.isIntersectionPacket(ray_origins, ray_directions)
+        if t is None:
+            t = self.__hitPacketPerRay(shape, ray_origins, ray_directions)
+        hit = (t > ep) & (t < t_max)
+        blocked[rays[hit]] = True
+        return rays[~hit]
+
+    def __hitPacketPerRay(self, shape, origins, directions, faces=None):
+        """
+            Hit distances of a shape without packet intersection, traced
+            ray by ray. The hit faces are written to faces if it is given
+        """
+        origins = numpy.broadcast_to(origins, directions.shape)
+        t = numpy.full(len(directions), numpy.inf)
+        for i in range(len(directions)):
+            ray = Ray(Vector(*origins[i].tolist()),
+                      Vector(*directions[i].tolist()))
+            hit_t, face = shape.hitFace(ray)
+            if hit_t is not None:
+                t[i] = hit_t
+                if faces is not None and face is not None:
+                    faces[i] = face
+        return t
+
+    def isIntersection(self, ray, ep = 0.0, cache = None):
+        return self.__findOccluder(ray, ep, float("inf"), cache) is not None
+
+    def isTwoPointsVisible(self, p0, ep0, p1, ep1, cache = None):
         d = p0 - p1
         l = d.length()
         l = l - ep0
         d.normalize()
         r = Ray(p1, d)
-        for shape in self.shapes:
-            b,p,t = shape.isIntersection(r)
-            if b is True:
-                if ep1 < t and t < l:
-                    return False
-        return True
+        return self.__findOccluder(r, ep1, l, cache) is None
+
+    def __findOccluder(self, ray, t_min, t_max, cache):
+        """
+            Return a shape hit inside (t_min, t_max), None if the ray is
+            not blocked. With an OcclusionCache the last occluder is
+            tested first and the scene traversal is skipped if it blocks
+        """
+        hit_func = _hitShape
+        if self.stats is not None:
+            hit_func = self.stats.hitShape
+        if cache is not None:
+            cache.query_num = cache.query_num + 1
+            last_occluder = cache.last_occluder
+            if (last_occluder is not None and
+                hit_func(last_occluder, ray, t_min, t_max) is not None):
+                cache.hit_num = cache.hit_num + 1
+                return last_occluder
+
+        bvh = self.getBVH()
+        occluder = None
+        for shape in self.unbounded_shapes:
+            if hit_func(shape, ray, t_min, t_max) is not None:
+                occluder = shape
+                break
+        if occluder is None:
+            occluder = bvh.anyHit(ray, hit_func, t_min, t_max)
+
+        if cache is not None and occluder is not None:
+            cache.last_occluder = occluder
+        return occluder
+
+
+def _hitShape(shape, ray, t_min, t_max):
+    """
+        Hit function of the scene BVH, return t of the shape hit inside
+        (t_min, t_max), None if the shape is not hit
+    """
+    return shape.hitT(ray, t_min, t_max)
+
+
+def _hitShapeFace(shape, ray, t_min, t_max):
+    """
+        Hit function of Scene.hitClosestFace, return (t, face) of
+        Shape.hitFace
+    """
+    return shape.hitFace(ray, t_min, t_max)
+
+
+def _toIntersection(ray, t):
+    """
+        Return the (isIntersection, intersectionPoint, t) result of
+        Shape.isIntersection for a hit distance of t, None for no hit
+    """
+    if t is None:
+        return False, Vector(0.0, 0.0, 0.0), 0.0
+    return True, (ray.d * t).iadd(ray.o), t
 
 
 if __name__ == "__main__":
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3.2
+
+
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Load scenes from JSON or TOML files through a compiled cache
+"""
+
+
+import hashlib
+import json
+import os
+import pickle
+import random
+import struct
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+from camera import *
+from color import *
+from light import *
+from material import *
+from sampler import *
+from scene import *
+from shade import *
+from tracer import *
+from vector import *
+
+
+__all__ = ["SceneFile", "loadScene"]
+
+
+class SceneFile(object):
+    """
+        A scene description file, JSON or TOML by its extension. It holds
+        the image size, camera, tracer and shader settings, materials,
+        lights and shapes, see scenes/many_balls.json:
+
+        image     {width, height}
+        seed      random seed set before the scene is built and again
+                  after it is built or read from the cache
+        camera    {pos, target, dist, fov}
+        tracer    {depth, sampler, sampler_num, packet,
+                   adaptive {min_num, max_num, threshold}}
+        shader    {type phong|matte, sampler, ao, ao_sampler_num,
+                   area_light_sample_num, russian_roulette {start_depth},
+                   glossy_mis {lobe_sample_num}, packet,
+                   irradiance_cache {max_error, min_radius, max_radius}}
+        lights    {ambient {k, color}, parallel {k, color, dir},
+                   env {k, color, sampler, sampler_num},
+                   env_map {k, file, sampler_num}}
+        materials {name: {type glossy|mirror|matte|emission, ...}}
+        shapes    [{type sphere|plane|triangle|squre|mesh, material, ep,
+                    cast_shadow, area_light {sampler, sampler_num}, ...}]
+        bvh       false disables the BVH of the scene
+
+        Meshes are read from the OBJ file named by obj and environment
+        maps from the .pfm or .hdr file named by file, relative to the
+        scene file. The built Tracer, with the BVH of the scene and of
+        every mesh, is compiled to a cache file keyed by the hash of the
+        scene file and of the renderer sources, a later load with the
+        same content reads the cache and skips parsing and building. Any
+        change to the sources of the pickled classes gives a new key, an
+        old cache is never unpickled into changed classes. A cache whose
+        pickle does not match its sha256, like a truncated file, is
+        rebuilt. The cache holds pickles, only read caches you wrote
+        yourself
+    """
+
+    MAGIC = b"RTSC"
+    # Layout of the cache file, changes to the pickled classes are caught
+    # by the source digest of the cache key
+    VERSION = 3
+
+    # sha256 of the renderer sources, computed once per process
+    source_digest = None
+
+    SAMPLERS = {"random": RandomSampler,
+                "jittered": JitteredSampler,
+                "n_rook": NRookSampler,
+                "multi_jittered": MultiJitteredSampler}
+
+    def __init__(self, file_name, cache_dir=None):
+        self.file_name = file_name
+        self.cache_dir = cache_dir
+        if cache_dir is None:
+            self.cache_dir = os.path.join(os.path.dirname(file_name) or ".",
+                                          ".scenecache")
+        self.cache_hit = False
+
+    def isCacheHit(self):
+        """
+            Return True if the last load was read from the cache
+        """
+        return self.cache_hit
+
+    def getCacheFileName(self, data=None):
+        if data is None:
+            with open(self.file_name, "rb") as f:
+                data = f.read()
+        digest = hashlib.sha256(data + SceneFile.getSourceDigest()).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".rtsc")
+
+    @staticmethod
+    def getSourceDigest():
+        """
+            Return the sha256 of the .py files next to this module, the
+            classes of the cached Tracer are defined in them
+        """
+        if SceneFile.source_digest is None:
+            source_dir = os.path.dirname(os.path.abspath(__file__))
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(source_dir)):
+                if name.endswith(".py"):
+                    h.update(name.encode("utf-8"))
+                    h.update(_hashFile(os.path.join(source_dir, name)))
+            SceneFile.source_digest = h.digest()
+        return SceneFile.source_digest
+
+    def load(self, use_cache=True):
+        """
+            Return the Tracer of the scene file
+        """
+        with open(self.file_name, "rb") as f:
+            data = f.read()
+        cache_file_name = self.getCacheFileName(data)
+        self.cache_hit = False
+        compiled = None
+        if use_cache is True:
+            compiled = self.__readCache(cache_file_name)
+            self.cache_hit = compiled is not None
+        if compiled is None:
+            desc = self.__parse(data)
+            dependencies = []
+            compiled = (desc.get("seed"), self.__build(desc, dependencies))
+            if use_cache is True:
+                self.__writeCache(cache_file_name, compiled, dependencies)
+
+        # Render from the same random state whether built or cached
+        seed, tracer = compiled
+        if seed is not None:
+            random.seed(seed)
+        return tracer
+
+    def __parse(self, data):
+        if os.path.splitext(self.file_name)[1].lower() == ".toml":
+            if tomllib is None:
+                raise ValueError("TOML scenes need tomllib: %s" % (self.file_name,))
+            return tomllib.loads(data.decode("utf-8"))
+        return json.loads(data.decode("utf-8"))
+
+    def __readCache(self, cache_file_name):
+        """
+            Return the cached (seed, Tracer), None if there is no valid cache or
+            a file the scene depends on has changed
+        """
+        if not os.path.exists(cache_file_name):
+            return None
+        with open(cache_file_name, "rb") as f:
+            data = f.read()
+        if data[:4] != SceneFile.MAGIC:
+            return None
+        # A truncated or garbled cache is rebuilt
+        try:
+            version, dependency_num = struct.unpack_from("<ii", data, 4)
+            if version != SceneFile.VERSION:
+                return None
+            offset = 12
+            for i in range(dependency_num):
+                size = struct.unpack_from("<i", data, offset)[0]
+                offset = offset + 4
+                path = data[offset:offset + size].decode("utf-8")
+                offset = offset + size
+                digest = data[offset:offset + 32]
+                offset = offset + 32
+                if not os.path.exists(path) or _hashFile(path) != digest:
+                    return None
+            digest = data[offset:offset + 32]
+            payload = data[offset + 32:]
+            if hashlib.sha256(payload).digest() != digest:
+                return None
+            return pickle.loads(payload)
+        except (struct.error, UnicodeDecodeError, pickle.UnpicklingError,
+                AttributeError, EOFError, ImportError):
+            return None
+
+    def __writeCache(self, cache_file_name, compiled, dependencies):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_name = cache_file_name + ".tmp"
+        with open(tmp_name, "wb") as f:
+            f.write(SceneFile.MAGIC)
+            f.write(struct.pack("<ii", SceneFile.VERSION, len(dependencies)))
+            for path in dependencies:
+                path_data = path.encode("utf-8")
+                f.write(struct.pack("<i", len(path_data)))
+                f.write(path_data)
+                f.write(_hashFile(path))
+            payload = pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL)
+            f.write(hashlib.sha256(payload).digest())
+            f.write(payload)
+        os.replace(tmp_name, cache_file_name)
+
+    def __build(self, desc, dependencies):
+        if "seed" in desc:
+            random.seed(desc["seed"])
+        image = desc.get("image", {})
+        width = image.get("width", 400)
+        height = image.get("height", 400)
+
+        s = Scene()
+        s.setEnableBVH(desc.get("bvh", True))
+        self.__buildLights(s, desc.get("lights", {}), dependencies)
+        materials = {}
+        for name, mat_desc in desc.get("materials", {}).items():
+            materials[name] = self.__buildMaterial(mat_desc)
+        for shape_desc in desc.get("shapes", []):
+            self.__buildShape(s, shape_desc, materials, dependencies)
+
+        camera_desc = desc.get("camera", {})
+        c = Camera(_vector(camera_desc.get("pos", (0.0, 0.0, -10.0))),
+                   _vector(camera_desc.get("target", (0.0, 0.0, 0.0))),
+                   camera_desc.get("dist", 0.01), camera_desc.get("fov", 170.0),
+                   1.0 * width / height)
+
+        shader = self.__buildShader(desc.get("shader", {}))
+        tracer_desc = desc.get("tracer", {})
+        t = Tracer(s, c, width, height, shader, tracer_desc.get("depth", 10),
+                   self.__buildSampler(tracer_desc.get("sampler")),
+                   tracer_desc.get("sampler_num", 16))
+        t.setEnablePacket(tracer_desc.get("packet", False))
+        adaptive = tracer_desc.get("adaptive")
+        if adaptive is not None:
+            t.setAdaptive(True, adaptive.get("min_num", 4),
+                          adaptive.get("max_num", 64),
+                          adaptive.get("threshold", 0.01))
+
+        # Build the acceleration structures once, they go to the cache
+        s.getBVH()
+        for shape in s.getAllShapes():
+            if shape.shape_type == Shape.TRIANGLE_MESH:
+                shape.getBVH()
+        return t
+
+    def __buildSampler(self, name):
+        if name is None:
+            name = "multi_jittered"
+        if name not in SceneFile.SAMPLERS:
+            raise ValueError("Unknown sampler %s in %s" % (name, self.file_name))
+        return SceneFile.SAMPLERS[name]()
+
+    def __buildLights(self, s, desc, dependencies):
+        if "ambient" in desc:
+            ambient = desc["ambient"]
+            s.setAmbientLight(AmbientLight(ambient["k"], _color(ambient["color"])))
+        if "parallel" in desc:
+            parallel = desc["parallel"]
+            s.setParallelLight(ParallelLight(parallel["k"],
+                                             _color(parallel["color"]),
+                                             _vector(parallel["dir"]).normalized()))
+        if "env" in desc:
+            env = desc["env"]
+            s.setEnvLight(EnvLight(env["k"], _color(env["color"]),
+                                   self.__buildSampler(env.get("sampler")),
+                                   env.get("sampler_num", 16)))
+        if "env_map" in desc:
+            env_map = desc["env_map"]
+            path = os.path.join(os.path.dirname(self.file_name), env_map["file"])
+            s.setEnvLight(EnvMapLight(env_map.get("k", 1.0), path,
+                                      env_map.get("sampler_num", 16)))
+            dependencies.append(path)
+
+    def __buildMaterial(self, desc):
+        mat_type = desc["type"]
+        if mat_type == "glossy":
+            return Material.createGlossy(desc["ka"], desc["kd"], _color(desc["cd"]),
+                                         desc["ks"], _color(desc["cs"]), desc["e"])
+        elif mat_type == "mirror":
+            return Material.createMirror(desc["ka"], desc["kd"], _color(desc["cd"]),
+                                         desc["km"], _color(desc["cm"]))
+        elif mat_type == "matte":
+            cd = _color(desc["cd"])
+            return Material(AmbientMaterial(desc["ka"], cd),
+                            DiffuseMaterial(desc["kd"], cd), None, None, None)
+        elif mat_type == "emission":
+            return Material.createEmission(desc["ke"], _color(desc["ce"]))
+        raise ValueError("Unknown material type %s in %s" % (mat_type, self.file_name))
+
+    def __buildShape(self, s, desc, materials, dependencies):
+        mat = desc.get("material")
+        if isinstance(mat, dict):
+            mat = self.__buildMaterial(mat)
+        elif mat is not None:
+            if mat not in materials:
+                raise ValueError("Unknown material %s in %s" % (mat, self.file_name))
+            mat = materials[mat]
+
+        shape_type = desc["type"]
+        if shape_type == "sphere":
+            shape = Sphere(_vector(desc["center"]), desc["radius"], mat)
+        elif shape_type == "plane":
+            shape = Plane(_vector(desc["pos"]), _vector(desc["normal"]), mat)
+        elif shape_type == "triangle":
+            shape = Triangle(_vector(desc["v0"]), _vector(desc["v1"]),
+                             _vector(desc["v2"]), mat)
+        elif shape_type in ("squre", "square"):
+            shape = Squre(_vector(desc["pos"]), desc["size"],
+                          _vector(desc["normal"]), mat)
+        elif shape_type == "mesh":
+            path = os.path.join(os.path.dirname(self.file_name), desc["obj"])
+            shape = TriangleMesh.createFromOBJ(path, mat)
+            dependencies.append(path)
+        else:
+            raise ValueError("Unknown shape type %s in %s" % (shape_type, self.file_name))
+
+        if "ep" in desc:
+            shape.setEp(desc["ep"])
+        if "cast_shadow" in desc:
+            shape.setEnableCastShadow(desc["cast_shadow"])
+        s.addShape(shape)
+
+        area_light = desc.get("area_light")
+        if area_light is not None:
+            s.addAreaLight(AreaLight(shape,
+                                     self.__buildSampler(area_light.get("sampler")),
+                                     area_light.get("sampler_num", 16)))
+
+    def __buildShader(self, desc):
+        shader_type = desc.get("type", "phong")
+        sampler = self.__buildSampler(desc.get("sampler"))
+        if shader_type == "matte":
+            shader = Matte(sampler)
+        elif shader_type == "phong":
+            shader = Phong(sampler)
+            shader.setAreaLightSampleNum(desc.get("area_light_sample_num", 0))
+            roulette = desc.get("russian_roulette")
+            if roulette is not None and roulette is not False:
+                if roulette is True:
+                    roulette = {}
+                shader.setRussianRoulette(True, roulette.get("start_depth", 2))
+            glossy_mis = desc.get("glossy_mis")
+            if glossy_mis is not None and glossy_mis is not False:
+                if glossy_mis is True:
+                    glossy_mis = {}
+                shader.setGlossyMIS(True, glossy_mis.get("lobe_sample_num", 4))
+            shader.setEnablePacket(desc.get("packet", False))
+            cache = desc.get("irradiance_cache")
+            if cache is not None and cache is not False:
+                if cache is True:
+                    cache = {}
+                shader.setIrradianceCache(True, cache.get("max_error", 0.3),
+                                          cache.get("min_radius", 0.1),
+                                          cache.get("max_radius", 10.0))
+        else:
+            raise ValueError("Unknown shader type %s in %s" % (shader_type, self.file_name))
+        shader.setAOSamplerNum(desc.get("ao_sampler_num", 256))
+        shader.setEnableAO(desc.get("ao", False))
+        return shader
+
+
+def _vector(values):
+    return Vector(float(values[0]), float(values[1]), float(values[2]))
+
+
+def _color(values):
+    return Color(float(values[0]), float(values[1]), float(values[2]))
+
+
+def _hashFile(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def loadScene(file_name, cache_dir=None, use_cache=True):
+    """
+        Return the Tracer of a scene file, see SceneFile
+    """
+    return SceneFile(file_name, cache_dir).load(use_cache)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    start = time.time()
+    scene_file = SceneFile(sys.argv[1])
+    scene_file.load()
+    print("Load %s: %fs, cache hit %s" % (sys.argv[1], time.time() - start,
+                                          scene_file.isCacheHit()))
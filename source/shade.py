@@ -10,10 +10,20 @@
 
 
 import math
+import random
+import time
 from abc import ABCMeta, abstractmethod
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from color import *
+from irradiancecache import *
+from light import *
 from material import *
+from renderstats import *
 from sampler import *
 from scene import *
 from vector import *
@@ -33,6 +43,7 @@ class ShadeInfo(object):
         self.ep = 0.0
         self.depth = 0
         self.ray = None
+        self.shape = None
 
     def setNormal(self, normal):
         self.normal = normal
@@ -88,6 +99,12 @@ class ShadeInfo(object):
     def getRay(self):
         return self.ray
 
+    def setShape(self, shape):
+        self.shape = shape
+
+    def getShape(self):
+        return self.shape
+
 
 class Shader(metaclass=ABCMeta):
     MATTE = 0
@@ -98,6 +115,7 @@ class Shader(metaclass=ABCMeta):
         self.ao_sampler = ao_sampler
         self.ao_sampler_num = 256
         self.enable_ao = False
+        self.stats = None
 
     def setAOSamplerNum(self, num):
         self.ao_sampler_num = num
@@ -105,6 +123,18 @@ class Shader(metaclass=ABCMeta):
     def setEnableAO(self, enable):
         self.enable_ao = enable
 
+    def setStats(self, stats):
+        self.stats = stats
+
+    def getOcclusionCacheStats(self):
+        """
+            Return {cache name: (query num, hit num)}
+        """
+        return {}
+
+    def resetOcclusionCacheStats(self):
+        pass
+
     @abstractmethod
     def shade(self, shadeInfo):
         """
@@ -148,23 +178,173 @@ class Matte(Shader):
 class Phong(Shader):
     def __init__(self, ao_sampler):
         super().__init__(Shader.PHONG, ao_sampler)
+        self.ao_occlusion_cache = OcclusionCache()
+        self.env_occlusion_cache = OcclusionCache()
+        self.area_light_occlusion_caches = []
+        self.area_light_sample_num = 0
+        self.ao_irradiance_cache = None
+        self.env_irradiance_cache = None
+        self.ao_bake = None
+        self.roulette_depth = None
+        self.glossy_lobe_sample_num = 0
+        self.enable_packet = False
+
+    def setEnablePacket(self, enable):
+        """
+            Trace the ambient occlusion and environment rays of a shading
+            point as one numpy packet, the directions are taken from numpy
+            tables of the sampler sets. It falls back to the ray by ray
+            path if numpy is not installed
+        """
+        self.enable_packet = enable and numpy is not None
 
-    def shade(self, shadeInfo):
-        emission_mat = shadeInfo.getMaterial().getEmission()
-        if emission_mat is not None:
-            emission_color = emission_mat.getCe() * emission_mat.getKe()
-            return emission_color
+    def setAreaLightSampleNum(self, num):
+        """
+            Trace num shadow rays per shading point spread over all area
+            lights, picked with probability proportional to their power.
+            With 0 every area light takes the samples of its own sampler
+        """
+        self.area_light_sample_num = num
+
+    def getAreaLightSampleNum(self):
+        return self.area_light_sample_num
+
+    def setGlossyMIS(self, enable, lobe_sample_num=4):
+        """
+            Light glossy materials from the area lights with multiple
+            importance sampling, the light samples are combined with
+            lobe_sample_num directions sampled from the glossy lobe by
+            the power heuristic. High exponents need far less light
+            samples for the same noise
+        """
+        self.glossy_lobe_sample_num = 0
+        if enable is True:
+            self.glossy_lobe_sample_num = lobe_sample_num
 
-        # Direct Lighting
-        result_direct_color = self.__direct(shadeInfo)
+    def getGlossyLobeSampleNum(self):
+        return self.glossy_lobe_sample_num
 
-        # InDirect Lighting
-        result_indirect_color = self.__indirect(shadeInfo)
+    def setRussianRoulette(self, enable, start_depth=2):
+        """
+            End mirror bounce chains at random once they reach start_depth
+            bounces. A bounce survives with the probability of the largest
+            channel of the throughput and is weighted by its inverse, the
+            image stays unbiased. Disabled, chains end at the tracer depth
+        """
+        self.roulette_depth = None
+        if enable is True:
+            self.roulette_depth = start_depth
+
+    def getRussianRouletteDepth(self):
+        """
+            Return the depth Russian roulette starts at, None if disabled
+        """
+        return self.roulette_depth
 
-        return result_direct_color + result_indirect_color
+    def setIrradianceCache(self, enable, max_error=0.3, min_radius=0.1,
+                           max_radius=10.0, max_record_num=100000):
+        """
+            Interpolate ambient occlusion and the diffuse environment light
+            from irradiance caches, hemisphere rays are only traced where
+            no cached record is close enough, see IrradianceCache. Glossy
+            materials still trace the environment light
+        """
+        self.ao_irradiance_cache = None
+        self.env_irradiance_cache = None
+        if enable is True:
+            self.ao_irradiance_cache = IrradianceCache(
+                max_error, min_radius, max_radius, max_record_num)
+            self.env_irradiance_cache = IrradianceCache(
+                max_error, min_radius, max_radius, max_record_num)
+
+    def setAOBake(self, bake):
+        """
+            Read ambient occlusion of the baked shapes from an AOBake
+            instead of tracing it, None traces all shapes
+        """
+        self.ao_bake = bake
+
+    def getAOBake(self):
+        return self.ao_bake
+
+    def getAOIrradianceCache(self):
+        return self.ao_irradiance_cache
+
+    def getEnvIrradianceCache(self):
+        return self.env_irradiance_cache
+
+    def getOcclusionCacheStats(self):
+        caches = [("ao", self.ao_occlusion_cache),
+                  ("env", self.env_occlusion_cache)]
+        for index, cache in enumerate(self.area_light_occlusion_caches):
+            caches.append(("area_light_%d" % (index,), cache))
+        if self.ao_irradiance_cache is not None:
+            caches.append(("ao_irradiance", self.ao_irradiance_cache))
+            caches.append(("env_irradiance", self.env_irradiance_cache))
+        stats = {}
+        for name, cache in caches:
+            stats[name] = (cache.getQueryNum(), cache.getHitNum())
+        return stats
+
+    def resetOcclusionCacheStats(self):
+        self.ao_occlusion_cache.resetStats()
+        self.env_occlusion_cache.resetStats()
+        for cache in self.area_light_occlusion_caches:
+            cache.resetStats()
+        if self.ao_irradiance_cache is not None:
+            self.ao_irradiance_cache.resetStats()
+            self.env_irradiance_cache.resetStats()
 
+    def shade(self, shadeInfo):
+        """
+            Direct lighting of the hit point plus the direct lighting seen
+            along its chain of mirror bounces. The chain is followed in a
+            loop, throughput is the product of the mirror BRDFs so far
+        """
+        result_color = None
+        throughput = None
+        while True:
+            emission_mat = shadeInfo.getMaterial().getEmission()
+            if emission_mat is not None:
+                color = emission_mat.getCe() * emission_mat.getKe()
+            else:
+                # Direct Lighting
+                color = self.__direct(shadeInfo)
+
+            if throughput is None:
+                result_color = color
+            else:
+                result_color.iaddProduct(throughput, color, 1.0)
+            if emission_mat is not None:
+                return result_color
+
+            # InDirect Lighting
+            mirror_mat = shadeInfo.material.getMirror()
+            if (mirror_mat is None
+                or shadeInfo.depth >= shadeInfo.tracer.getDepth()):
+                return result_color
+            mirror_brdf = mirror_mat.getBRDF(None, None, None, None)
+            if throughput is None:
+                throughput = mirror_brdf
+            else:
+                throughput = throughput.modulate(mirror_brdf)
+            if (self.roulette_depth is not None
+                and shadeInfo.depth + 1 >= self.roulette_depth):
+                survival = min(max(throughput.r, throughput.g, throughput.b), 1.0)
+                if survival <= 0.0 or random.random() >= survival:
+                    return result_color
+                throughput = throughput.scale(1.0 / survival)
+
+            new_shade_info = self.__trace_mirror(shadeInfo)
+            if new_shade_info is None:
+                return result_color
+            new_shade_info.depth = shadeInfo.depth + 1
+            shadeInfo = new_shade_info
 
     def __direct(self, shadeInfo):
+        if self.stats is not None:
+            return self.__direct_timed(shadeInfo)
+
         # Environment Light
         result_env_color = self.__env_light(shadeInfo)
             
@@ -177,57 +357,62 @@ class Phong(Shader):
         # Area Light
         result_area_color = self.__area_light(shadeInfo)
 
-        return (result_env_color + result_ambient_color
-                + result_parallel_color + result_area_color)
+        return (result_env_color.iadd(result_ambient_color)
+                .iadd(result_parallel_color).iadd(result_area_color))
+
+    def __direct_timed(self, shadeInfo):
+        """
+            __direct with the time of every light added to the stats
+        """
+        stats = self.stats
+        result_env_color = stats.timeStage(RenderStats.ENV_LIGHT,
+                                           self.__env_light, shadeInfo)
+        result_ambient_color = stats.timeStage(RenderStats.AMBIENT_LIGHT,
+                                               self.__ambient_light, shadeInfo)
+        result_parallel_color = stats.timeStage(RenderStats.PARALLEL_LIGHT_STAGE,
+                                                self.__parallel_light, shadeInfo)
+        result_area_color = stats.timeStage(RenderStats.AREA_LIGHT_STAGE,
+                                            self.__area_light, shadeInfo)
+        return (result_env_color.iadd(result_ambient_color)
+                .iadd(result_parallel_color).iadd(result_area_color))
+
+    def __trace_mirror(self, shadeInfo):
+        """
+            Return the ShadeInfo of the hit of the reflected ray, None if
+            it hits nothing
+        """
+        reflect_dir = Vector.reflect(shadeInfo.normal, shadeInfo.ray.d * (-1))
+        reflect_ray = Ray(shadeInfo.point, reflect_dir)
+        if self.stats is None:
+            return shadeInfo.tracer.hit_object(reflect_ray, shadeInfo.ep)
+        self.stats.countRay(RenderStats.MIRROR)
+        start = time.perf_counter()
+        new_shade_info = shadeInfo.tracer.hit_object(reflect_ray, shadeInfo.ep)
+        self.stats.addStageTime(RenderStats.MIRROR_HIT,
+                                time.perf_counter() - start)
+        return new_shade_info
 
-    def __indirect(self, shadeInfo):
-        result_indirect_color = Color(0.0, 0.0, 0.0)
-        
-        if shadeInfo.material.getMirror() is not None:
-            if shadeInfo.depth < shadeInfo.tracer.getDepth():
-                reflect_dir = Vector.reflect(shadeInfo.normal,
-                                             shadeInfo.ray.d * (-1))
-                reflect_ray = Ray(shadeInfo.point, reflect_dir)
-                new_shade_info = shadeInfo.tracer.hit_object(reflect_ray,
-                                                             shadeInfo.ep)
-                if new_shade_info is not None:
-                    new_shade_info.depth = shadeInfo.depth + 1
-                    incident_color = shadeInfo.tracer.calcColor(reflect_ray,
-                                                                new_shade_info)
-                    mirror_brdf = shadeInfo.material.getMirror().getBRDF(
-                        None, None, None, None
-                        )
-                    result_indirect_color = incident_color * mirror_brdf
-        
-        return result_indirect_color
-    
     def __env_light(self, shadeInfo):
         if shadeInfo.scene.getEnvLight() is None:
             return Color(0.0, 0.0, 0.0)
+        if isinstance(shadeInfo.scene.getEnvLight(), EnvMapLight):
+            return self.__env_map_light(shadeInfo)
+        if (self.env_irradiance_cache is not None
+            and shadeInfo.material.getGlossy() is None):
+            return self.__cached_env_light(shadeInfo)
+
+        if self.enable_packet is True:
+            return self.__env_light_packet(shadeInfo)
 
         env_light = shadeInfo.scene.getEnvLight()
         samplers = env_light.getSamplers()
         to_eye = shadeInfo.camera.getPos() - shadeInfo.point
         to_eye.normalize()        
 
-        # Calculate orthonormal basie
-        w = shadeInfo.normal
-        u = Vector.cross(Vector(0.0072, 1.0, 0.0034), w)  # slightly jitter up vector
-        u.normalize()
-        v = Vector.cross(w, u)
-
-        # Calculate samplers on hemisphere and store the direction
-        hemi_sphere_samplers=[]
-        for i in range(self.ao_sampler_num):
-            cos_phi = math.cos(samplers[i].x)
-            sin_phi = math.sin(samplers[i].x)
-            cos_theta = math.cos(samplers[i].y)
-            sin_theta = math.sin(samplers[i].y)
-            pu = sin_theta * cos_phi
-            pv = sin_theta * sin_phi
-            pw = cos_theta
-            direction = u * pu + v * pv + w * pw
-            hemi_sphere_samplers.append(direction)
+        hemi_sphere_samplers = self.__hemi_sphere_directions(shadeInfo.normal,
+                                                             samplers)
+        if self.stats is not None:
+            self.stats.countRay(RenderStats.ENV, len(hemi_sphere_samplers))
 
         result_env_colors = Color(0.0, 0.0, 0.0)
         env_light_color = env_light.getLightColor()
@@ -237,31 +422,149 @@ class Phong(Shader):
         
         for sampler in hemi_sphere_samplers:
             r = Ray(shadeInfo.point, sampler)
-            if shadeInfo.scene.isIntersection(r, shadeInfo.ep) is False:
+            if shadeInfo.scene.isIntersection(
+                r, shadeInfo.ep, self.env_occlusion_cache) is False:
                 cos = Vector.dot(shadeInfo.normal, sampler)
                 pdf = env_light.getPDF(cos)
 
                 # Diffuse
-                diffuse_color = env_light_color * diffuse_brdf * (cos / pdf)
-                result_env_colors = result_env_colors + diffuse_color
+                result_env_colors.iaddProduct(env_light_color, diffuse_brdf,
+                                              cos / pdf)
 
                 # Glossy
-                glossy_color = Color(0.0, 0.0, 0.0)
                 if shadeInfo.material.getGlossy() is not None:
                     glossy_brdf = shadeInfo.material.getGlossy().getBRDF(
                         shadeInfo.point, shadeInfo.normal, sampler, to_eye
                         )
-                    glossy_color = env_light_color * glossy_brdf * (cos / pdf)
-                    result_env_colors = result_env_colors + glossy_color
+                    result_env_colors.iaddProduct(env_light_color, glossy_brdf,
+                                                  cos / pdf)
+
+        return result_env_colors.iscale(1.0 / len(hemi_sphere_samplers))
+
+    def __env_map_light(self, shadeInfo):
+        """
+            Environment map light, the directions are importance sampled
+            from the map, the ones below the surface are not traced
+        """
+        env_light = shadeInfo.scene.getEnvLight()
+        samples = env_light.getSamples()
+        point = shadeInfo.point
+        normal = shadeInfo.normal
+        diffuse_brdf = shadeInfo.material.getDiffuse().getBRDF(
+            None, None, None, None
+            )
+        glossy = shadeInfo.material.getGlossy()
+        to_eye = None
+        if glossy is not None:
+            to_eye = shadeInfo.camera.getPos() - point
+            to_eye.normalize()
+
+        result_env_colors = Color(0.0, 0.0, 0.0)
+        for d, radiance, pdf in samples:
+            cos = Vector.dot(normal, d)
+            if cos <= 0.0 or pdf <= 0.0:
+                continue
+            if self.stats is not None:
+                self.stats.countRay(RenderStats.ENV)
+            if shadeInfo.scene.isIntersection(
+                Ray(point, d), shadeInfo.ep, self.env_occlusion_cache) is True:
+                continue
+
+            # Diffuse
+            result_env_colors.iaddProduct(radiance, diffuse_brdf, cos / pdf)
+
+            # Glossy
+            if glossy is not None:
+                glossy_brdf = glossy.getBRDF(point, normal, d, to_eye)
+                result_env_colors.iaddProduct(radiance, glossy_brdf, cos / pdf)
+
+        return result_env_colors.iscale(1.0 / len(samples))
+
+    def __env_light_packet(self, shadeInfo):
+        """
+            __env_light with the occlusion of all directions queried as
+            one packet
+        """
+        env_light = shadeInfo.scene.getEnvLight()
+        samplers = env_light.getSamplerArray()
+        directions = self.__hemi_sphere_packet(shadeInfo.normal, samplers)
+        if self.stats is not None:
+            self.stats.countRay(RenderStats.ENV, len(directions))
+        point = shadeInfo.point
+        visible = ~shadeInfo.scene.isIntersectionPacket(
+            numpy.array((point.x, point.y, point.z)), directions, shadeInfo.ep)
+
+        # The w of a local direction is its cosine to the normal
+        cos = samplers[visible, 2]
+        weights = cos / env_light.getPDF(cos)
+        result_env_colors = Color(0.0, 0.0, 0.0)
+        env_light_color = env_light.getLightColor()
+        diffuse_brdf = shadeInfo.material.getDiffuse().getBRDF(
+            None, None, None, None
+            )
+        result_env_colors.iaddProduct(env_light_color, diffuse_brdf,
+                                      float(weights.sum()))
 
-        result_env_colors = result_env_colors * (1.0 / len(hemi_sphere_samplers))
-        return result_env_colors
+        glossy = shadeInfo.material.getGlossy()
+        if glossy is not None:
+            to_eye = shadeInfo.camera.getPos() - point
+            to_eye.normalize()
+            glossy_weights = glossy.getBRDFPacket(
+                shadeInfo.normal, directions[visible], to_eye) * weights
+            result_env_colors.iaddProduct(env_light_color, glossy.getCs(),
+                                          float(glossy_weights.sum()))
+
+        return result_env_colors.iscale(1.0 / len(directions))
+
+    def __cached_env_light(self, shadeInfo):
+        """
+            Diffuse environment light, the irradiance is interpolated from
+            the irradiance cache or traced and added to it
+        """
+        cache = self.env_irradiance_cache
+        value = cache.lookup(shadeInfo.point, shadeInfo.normal)
+        if value is None:
+            env_light = shadeInfo.scene.getEnvLight()
+            env_light_color = env_light.getLightColor()
+            irradiance = Color(0.0, 0.0, 0.0)
+            inv_distance_sum = 0.0
+            if self.enable_packet is True:
+                samplers = env_light.getSamplerArray()
+            else:
+                samplers = env_light.getSamplers()
+            if self.stats is not None:
+                self.stats.countRay(RenderStats.ENV, len(samplers))
+            if self.enable_packet is True:
+                ts, indices = self.__hit_hemi_sphere_packet(shadeInfo, samplers)
+                cos = samplers[indices < 0, 2]
+                irradiance.iaddScaled(env_light_color,
+                                      float((cos / env_light.getPDF(cos)).sum()))
+                inv_distance_sum = float((1.0 / ts[indices >= 0]).sum())
+            else:
+                for d in self.__hemi_sphere_directions(shadeInfo.normal, samplers):
+                    shape, t = shadeInfo.scene.hitClosest(Ray(shadeInfo.point, d),
+                                                          shadeInfo.ep)
+                    if shape is None:
+                        cos = Vector.dot(shadeInfo.normal, d)
+                        irradiance.iaddScaled(env_light_color,
+                                              cos / env_light.getPDF(cos))
+                    else:
+                        inv_distance_sum = inv_distance_sum + 1.0 / t
+            irradiance.iscale(1.0 / len(samplers))
+            value = (irradiance.r, irradiance.g, irradiance.b)
+            cache.add(shadeInfo.point, shadeInfo.normal, value,
+                      len(samplers) / max(inv_distance_sum, 1e-9))
+
+        diffuse_brdf = shadeInfo.material.getDiffuse().getBRDF(
+            None, None, None, None
+            )
+        return diffuse_brdf.modulate(Color(value[0], value[1], value[2]))
 
     def __ambient_light(self, shadeInfo):
         if shadeInfo.scene.getAmbientLight() is None:
             return Color(0.0, 0.0, 0.0)
-        ambient_ratio = self.__ambient_occluder__(shadeInfo)
-        ambient_color = self.__ambient_shade__(shadeInfo)
+        ambient_ratio = self.__ambient_occluder(shadeInfo)
+        ambient_color = self.__ambient_shade(shadeInfo)
         ambient_color = ambient_color * ambient_ratio
         return ambient_color
 
@@ -269,7 +572,7 @@ class Phong(Shader):
         if shadeInfo.scene.getParallelLight() is None:
             return Color(0.0, 0.0, 0.0)
 
-        is_in_shadow = self.__check_in_parallel_light_shadow__(shadeInfo)
+        is_in_shadow = self.__check_in_parallel_light_shadow(shadeInfo)
         if is_in_shadow is True:
             return Color(0.0, 0.0, 0.0)
 
@@ -310,44 +613,191 @@ class Phong(Shader):
         
         result_areas = Color(0.0, 0.0, 0.0)
         area_lights = shadeInfo.scene.getAreaLights()
-        for area_light in area_lights:
+        while len(self.area_light_occlusion_caches) < len(area_lights):
+            self.area_light_occlusion_caches.append(OcclusionCache())
+        if self.area_light_sample_num > 0 and len(area_lights) > 0:
+            return self.__sample_area_lights(shadeInfo, to_eye, diffuse_brdf)
+
+        point = shadeInfo.point
+        normal = shadeInfo.normal
+        glossy = shadeInfo.material.getGlossy()
+        enable_mis = glossy is not None and self.glossy_lobe_sample_num > 0
+        for index, area_light in enumerate(area_lights):
             result_area = Color(0.0, 0.0, 0.0)
+            occlusion_cache = self.area_light_occlusion_caches[index]
             area_light_samplers = area_light.getSamplers()
+            light_shape = area_light.getShape()
+            light_ep = light_shape.getEp()
+            light_normal = light_shape.genNormal(shadeInfo)
+            pdf = area_light.getPDF()
+            emission_light_color = area_light.getLightColor()
+            if self.stats is not None:
+                self.stats.countRay(RenderStats.AREA_LIGHT,
+                                    len(area_light_samplers))
             for area_light_sampler in area_light_samplers:
                 visibility = shadeInfo.scene.isTwoPointsVisible(
-                    shadeInfo.point,shadeInfo.ep, area_light_sampler,
-                    area_light.getShape().getEp()
+                    point, shadeInfo.ep, area_light_sampler, light_ep,
+                    occlusion_cache
                     )
                 if visibility is True:
-                    pp = area_light_sampler - shadeInfo.point
-                    light_dir = Vector(pp.x, pp.y, pp.z)
-                    light_dir.normalize()
-                    pdf = area_light.getPDF()
-                    cos_theta = Vector.dot(light_dir, shadeInfo.normal)
-                    cos_phi = Vector.dot(
-                        light_dir * (-1),
-                        area_light.getShape().genNormal(shadeInfo)
-                        )
-                    geoterm = cos_theta * cos_phi / pp.lengthSqure()
+                    px = area_light_sampler.x - point.x
+                    py = area_light_sampler.y - point.y
+                    pz = area_light_sampler.z - point.z
+                    distance_squre = px * px + py * py + pz * pz
+                    distance = math.sqrt(distance_squre)
+                    light_dir = Vector(px / distance, py / distance,
+                                       pz / distance)
+                    cos_theta = Vector.dot(light_dir, normal)
+                    cos_phi = -Vector.dot(light_dir, light_normal)
+                    geoterm = cos_theta * cos_phi / distance_squre
                     if cos_theta > 0.0 and cos_phi > 0.0:
-                        emission_material = area_light.getShape().getMaterial().getEmission()
-                        emission_light_color = emission_material.getCe()
-                        emission_light_color = emission_light_color * emission_material.getKe()
-                        
                         # Diffuse
-                        result_area = result_area + emission_light_color * diffuse_brdf * (geoterm / pdf)
-                        
-                        # Glossy
-                        if shadeInfo.material.getGlossy() is not None:
-                            glossy_brdf = shadeInfo.material.getGlossy().getBRDF(
-                                shadeInfo.point, shadeInfo.normal, light_dir, to_eye
-                                )
-                            result_area = result_area + emission_light_color * glossy_brdf * (geoterm / pdf)
-            result_area = result_area * (1.0 / len(area_light_samplers))
-            result_areas = result_areas + result_area
+                        result_area.iaddProduct(emission_light_color,
+                                                diffuse_brdf, geoterm / pdf)
 
+                        # Glossy
+                        if glossy is not None:
+                            glossy_brdf = glossy.getBRDF(point, normal,
+                                                         light_dir, to_eye)
+                            glossy_weight = geoterm / pdf
+                            if enable_mis is True:
+                                glossy_weight = glossy_weight * self.__mis_weight(
+                                    pdf * distance_squre / cos_phi,
+                                    len(area_light_samplers),
+                                    glossy.getPDF(normal, light_dir, to_eye),
+                                    self.glossy_lobe_sample_num)
+                            result_area.iaddProduct(emission_light_color,
+                                                    glossy_brdf, glossy_weight)
+            result_areas.iaddScaled(result_area, 1.0 / len(area_light_samplers))
+
+        if enable_mis is True and len(area_lights) > 0:
+            result_areas.iadd(self.__sample_glossy_lobe(shadeInfo, to_eye, glossy))
         return result_areas
 
+    def __sample_area_lights(self, shadeInfo, to_eye, diffuse_brdf):
+        """
+            Estimate the light of all area lights with a fixed number of
+            shadow rays, the cost does not grow with the number of lights
+        """
+        scene = shadeInfo.scene
+        area_lights = scene.getAreaLights()
+        table = scene.getAreaLightTable()
+        if table is None:
+            return Color(0.0, 0.0, 0.0)
+        point = shadeInfo.point
+        normal = shadeInfo.normal
+        glossy = shadeInfo.material.getGlossy()
+        enable_mis = glossy is not None and self.glossy_lobe_sample_num > 0
+        result_area = Color(0.0, 0.0, 0.0)
+        num = self.area_light_sample_num
+        for k in range(num):
+            # Stratify the light choice over the samples
+            index = table.sample((k + random.random()) / num)
+            area_light = area_lights[index]
+            light_shape = area_light.getShape()
+            light_point = area_light.samplePoint(random.random(), random.random())
+            px = light_point.x - point.x
+            py = light_point.y - point.y
+            pz = light_point.z - point.z
+            distance_squre = px * px + py * py + pz * pz
+            distance = math.sqrt(distance_squre)
+            light_dir = Vector(px / distance, py / distance, pz / distance)
+
+            # Lights facing away contribute nothing, skip the shadow ray
+            cos_theta = Vector.dot(light_dir, normal)
+            if cos_theta <= 0.0:
+                continue
+            cos_phi = -Vector.dot(light_dir, light_shape.genNormal(shadeInfo))
+            if cos_phi <= 0.0:
+                continue
+
+            if self.stats is not None:
+                self.stats.countRay(RenderStats.AREA_LIGHT)
+            visibility = scene.isTwoPointsVisible(
+                point, shadeInfo.ep, light_point, light_shape.getEp(),
+                self.area_light_occlusion_caches[index]
+                )
+            if visibility is False:
+                continue
+
+            pdf = area_light.getPDF() * table.getProbability(index)
+            weight = cos_theta * cos_phi / distance_squre / pdf
+            emission_light_color = area_light.getLightColor()
+
+            # Diffuse
+            result_area.iaddProduct(emission_light_color, diffuse_brdf, weight)
+
+            # Glossy
+            if glossy is not None:
+                glossy_brdf = glossy.getBRDF(point, normal, light_dir, to_eye)
+                if enable_mis is True:
+                    weight = weight * self.__mis_weight(
+                        pdf * distance_squre / cos_phi, num,
+                        glossy.getPDF(normal, light_dir, to_eye),
+                        self.glossy_lobe_sample_num)
+                result_area.iaddProduct(emission_light_color, glossy_brdf, weight)
+        result_area.iscale(1.0 / num)
+
+        if enable_mis is True:
+            result_area.iadd(self.__sample_glossy_lobe(shadeInfo, to_eye, glossy))
+        return result_area
+
+    def __sample_glossy_lobe(self, shadeInfo, to_eye, glossy):
+        """
+            Glossy light of the area lights hit by directions sampled from
+            the glossy lobe, the MIS counterpart of the light samples
+        """
+        scene = shadeInfo.scene
+        area_lights = scene.getAreaLights()
+        point = shadeInfo.point
+        normal = shadeInfo.normal
+        result_glossy = Color(0.0, 0.0, 0.0)
+        num = self.glossy_lobe_sample_num
+        for k in range(num):
+            light_dir, brdf_pdf = glossy.sampleDirection(
+                normal, to_eye, (k + random.random()) / num, random.random())
+            cos_theta = Vector.dot(light_dir, normal)
+            if cos_theta <= 0.0 or brdf_pdf <= 0.0:
+                continue
+
+            if self.stats is not None:
+                self.stats.countRay(RenderStats.AREA_LIGHT)
+            shape, t = scene.hitClosest(Ray(point, light_dir), shadeInfo.ep)
+            if shape is None:
+                continue
+            index = scene.getAreaLightIndex(shape)
+            if index is None:
+                continue
+            cos_phi = -Vector.dot(light_dir, shape.genNormal(shadeInfo))
+            if cos_phi <= 0.0:
+                continue
+
+            # Density and number of the light samples that could have
+            # picked the same point
+            area_light = area_lights[index]
+            if self.area_light_sample_num > 0:
+                light_pdf = (area_light.getPDF()
+                             * scene.getAreaLightTable().getProbability(index))
+                light_num = self.area_light_sample_num
+            else:
+                light_pdf = area_light.getPDF()
+                light_num = area_light.getSamplerNum()
+            weight = self.__mis_weight(brdf_pdf, num,
+                                       light_pdf * t * t / cos_phi, light_num)
+            glossy_brdf = glossy.getBRDF(point, normal, light_dir, to_eye)
+            result_glossy.iaddProduct(area_light.getLightColor(), glossy_brdf,
+                                      cos_theta * weight / brdf_pdf)
+        return result_glossy.iscale(1.0 / num)
+
+    def __mis_weight(self, pdf, num, other_pdf, other_num):
+        """
+            Power heuristic weight of a sample of a strategy taking num
+            samples, pdfs are per solid angle
+        """
+        a = pdf * num
+        b = other_pdf * other_num
+        return a * a / (a * a + b * b)
+
     def __ambient_shade(self, shadeInfo):
         ambient_mat = shadeInfo.material.getAmbient()
         brdf = ambient_mat.getBRDF(None, None, None, None)
@@ -360,49 +810,108 @@ class Phong(Shader):
             return False
         parallel_light_dir = parallel_light.d * (-1)
         shadow_ray = Ray(shadeInfo.point, parallel_light_dir)
+        if self.stats is not None:
+            self.stats.countRay(RenderStats.PARALLEL_LIGHT)
         return shadeInfo.scene.isIntersection(shadow_ray, shadeInfo.ep)
 
     def __ambient_occluder(self, shadeInfo):
         if self.enable_ao is False:
             return 1.0
-        
-        # Calculate orthonormal basie
-        w = shadeInfo.normal
-        u = Vector.cross(Vector(0.0072, 1.0, 0.0034), w)  # slightly jitter up vector
-        u.normalize()
-        v = Vector.cross(w, u)
-
-        # Genrate samplers
-        self.ao_sampler.genSamplersInUnitSqure(self.ao_sampler_num)
-        self.ao_sampler.mapToHemiSphere(1.0)
-        samplers = self.ao_sampler.getSamplers()
-
-        # Calculate samplers on hemisphere
-        hemi_sphere_samplers=[]
-        for i in range(self.ao_sampler_num):
-            cos_phi = math.cos(samplers[i].x)
-            sin_phi = math.sin(samplers[i].x)
-            cos_theta = math.cos(samplers[i].y)
-            sin_theta = math.sin(samplers[i].y)
-            pu = sin_theta * cos_phi
-            pv = sin_theta * sin_phi
-            pw = cos_theta
-            point = shadeInfo.point + u * pu + v * pv + w * pw
-            hemi_sphere_samplers.append(point)
-
-        # Calculate ambient ratio
+
+        if self.ao_bake is not None:
+            visibility = self.ao_bake.lookup(shadeInfo.shape, shadeInfo.point)
+            if visibility is not None:
+                return min(0.1 + visibility, 1.0)
+
+        cache = self.ao_irradiance_cache
+        if cache is not None:
+            value = cache.lookup(shadeInfo.point, shadeInfo.normal)
+            if value is not None:
+                return value[0]
+
+        # Take the next precomputed set of hemisphere directions
+        if self.enable_packet is True:
+            samplers = self.ao_sampler.getNextHemiSphereArray(
+                self.ao_sampler_num, 1.0
+                )
+        else:
+            samplers = self.ao_sampler.getNextHemiSphereSamplers(
+                self.ao_sampler_num, 1.0
+                )
+
+        # Calculate ambient ratio, the irradiance cache also needs the
+        # distance of the occluders
         ratio = 0.1
         ratio_step = 1.0 / self.ao_sampler_num
-        for sampler in hemi_sphere_samplers:
-            d = sampler - shadeInfo.point
-            d.normalize()
-            ray = Ray(shadeInfo.point, d)
-            if shadeInfo.scene.isIntersection(ray, shadeInfo.ep) is False:
-                ratio = ratio + ratio_step
+        inv_distance_sum = 0.0
+        if self.stats is not None:
+            self.stats.countRay(RenderStats.AO, len(samplers))
+        if self.enable_packet is True and cache is None:
+            point = shadeInfo.point
+            blocked = shadeInfo.scene.isIntersectionPacket(
+                numpy.array((point.x, point.y, point.z)),
+                self.__hemi_sphere_packet(shadeInfo.normal, samplers),
+                shadeInfo.ep)
+            ratio = ratio + ratio_step * (len(samplers)
+                                          - int(numpy.count_nonzero(blocked)))
+        elif self.enable_packet is True:
+            ts, indices = self.__hit_hemi_sphere_packet(shadeInfo, samplers)
+            ratio = ratio + ratio_step * int(numpy.count_nonzero(indices < 0))
+            inv_distance_sum = float((1.0 / ts[indices >= 0]).sum())
+        else:
+            for d in self.__hemi_sphere_directions(shadeInfo.normal, samplers):
+                ray = Ray(shadeInfo.point, d)
+                if cache is None:
+                    if shadeInfo.scene.isIntersection(
+                        ray, shadeInfo.ep, self.ao_occlusion_cache) is False:
+                        ratio = ratio + ratio_step
+                else:
+                    shape, t = shadeInfo.scene.hitClosest(ray, shadeInfo.ep)
+                    if shape is None:
+                        ratio = ratio + ratio_step
+                    else:
+                        inv_distance_sum = inv_distance_sum + 1.0 / t
 
         if ratio > 1.0:
             ratio = 1.0
+        if cache is not None:
+            cache.add(shadeInfo.point, shadeInfo.normal, (ratio,),
+                      len(samplers) / max(inv_distance_sum, 1e-9))
         return ratio
+
+    def __hemi_sphere_packet(self, normal, samplers):
+        """
+            Vectorized __hemi_sphere_directions, map the (N, 3) numpy
+            array of (u, v, w) samplers to world directions around the
+            normal with one product by the basis
+        """
+        u, v, w = Vector.orthonormalBasis(normal)
+        basis = numpy.array(((u.x, u.y, u.z), (v.x, v.y, v.z), (w.x, w.y, w.z)))
+        return samplers.dot(basis)
+
+    def __hit_hemi_sphere_packet(self, shadeInfo, samplers):
+        """
+            Return the (t, index) arrays of Scene.hitClosestPacket for the
+            samplers mapped around the normal of the shading point
+        """
+        point = shadeInfo.point
+        return shadeInfo.scene.hitClosestPacket(
+            numpy.array((point.x, point.y, point.z)),
+            self.__hemi_sphere_packet(shadeInfo.normal, samplers),
+            shadeInfo.ep)[:2]
+
+    def __hemi_sphere_directions(self, normal, samplers):
+        """
+            Map (u, v, w) hemisphere samplers to world directions around
+            the normal
+        """
+        u, v, w = Vector.orthonormalBasis(normal)
+        directions = []
+        for pu, pv, pw in samplers:
+            directions.append(Vector(u.x * pu + v.x * pv + w.x * pw,
+                                     u.y * pu + v.y * pv + w.y * pw,
+                                     u.z * pu + v.z * pv + w.z * pw))
+        return directions
             
         
 if __name__ == "__main__":
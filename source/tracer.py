@@ -9,10 +9,19 @@
 """
 
 
+import math
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from camera import *
 from color import *
 from light import *
 from material import *
+from renderstats import *
 from sampler import *
 from scene import *
 from shade import *
@@ -31,57 +40,267 @@ class Tracer(object):
         self.sampler = sampler
         self.sampler_num = sampler_num
         self.trace_ok = False
+        self.enable_packet = False
+        self.enable_adaptive = False
+        self.adaptive_min_num = 4
+        self.adaptive_max_num = 64
+        self.adaptive_threshold = 0.01
+        self.pixel_sampler_num = 0
+        self.spp_buf = []
+        self.tile_spp_buf = []
+        self.stats = None
+
+    def setEnablePacket(self, enable):
+        """
+            Trace the primary rays of a tile as one numpy packet, it falls
+            back to the ray by ray path if numpy is not installed
+        """
+        self.enable_packet = enable and numpy is not None
+
+    def setAdaptive(self, enable, min_num=4, max_num=64, threshold=0.01):
+        """
+            Adaptive supersampling, every pixel takes batches of min_num
+            samples until the standard error of the pixel luminance is
+            below threshold or max_num samples are taken
+        """
+        self.enable_adaptive = enable
+        self.adaptive_min_num = min_num
+        self.adaptive_max_num = max_num
+        self.adaptive_threshold = threshold
+
+    def setStats(self, stats):
+        """
+            Count rays and time the shading stages in a RenderStats, see
+            RenderStats. None disables the instrumentation
+        """
+        self.stats = stats
+        self.scene.setStats(stats)
+        self.shader.setStats(stats)
+
+    def getStats(self):
+        return self.stats
+
+    def isAdaptive(self):
+        return self.enable_adaptive
+
+    def getSppBuf(self):
+        """
+            Return the samples per pixel map of the last trace
+        """
+        return self.spp_buf
+
+    def getTileSppBuf(self):
+        """
+            Return the samples per pixel map of the last traceTile
+        """
+        return self.tile_spp_buf
 
     def getDepth(self):
         return self.depth
 
+    def getSamplerNum(self):
+        return self.sampler_num
+
     def isTraceOk(self):
         return self.trace_ok
     
+    def getScene(self):
+        return self.scene
+
+    def getShader(self):
+        return self.shader
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
     def trace(self, color_buf):
+        """
+            Trace the whole image into color_buf, a flat r,g,b list or a
+            FrameBuffer
+        """
         print("Tracer Process: Start")
+        if self.stats is not None:
+            self.stats.start(self.width * self.height)
+        self.spp_buf = [self.sampler_num] * (self.width * self.height)
         for y in range(self.height):
-            for x in range(self.width):
-                color = Color(0.0,0.0, 0.0)
-                self.sampler.genSamplersInUnitSqure(self.sampler_num)
-                for sampler in self.sampler.getSamplers():
-                    trace_x = x - 0.5 + sampler.x
-                    trace_y = y - 0.5 + sampler.y
-                    ray = self.__genRay(trace_x, trace_y)
-                    shadeInfo = self.hit_object(ray)
-                    color = color + self.calcColor(ray, shadeInfo)
-                color = color * (1.0 / self.sampler_num)
-                color_buf[y * self.width * 3 + x * 3 + 0] = color.r
-                color_buf[y * self.width * 3 + x * 3 + 1] = color.g
-                color_buf[y * self.width * 3 + x * 3 + 2] = color.b
+            if self.enable_packet is True and self.enable_adaptive is False:
+                row_buf = self.__traceTilePacket(0, y, self.width, y + 1,
+                                                 self.sampler_num)
+                color_buf[y * self.width * 3:(y + 1) * self.width * 3] = row_buf
+            else:
+                for x in range(self.width):
+                    color = self.tracePixel(x, y)
+                    color_buf[y * self.width * 3 + x * 3 + 0] = color.r
+                    color_buf[y * self.width * 3 + x * 3 + 1] = color.g
+                    color_buf[y * self.width * 3 + x * 3 + 2] = color.b
+                    self.spp_buf[y * self.width + x] = self.pixel_sampler_num
             ratio = 100.0 * y / self.height
             print("Tracer Process: %f" % (ratio,))
+            if self.stats is not None:
+                self.stats.addProgress(self.width)
         print("Tracer Process: End")
+        if self.stats is not None:
+            self.stats.stop()
+
+    def traceTile(self, x0, y0, x1, y1, sampler_num=None):
+        """
+            Trace the pixels in [x0, x1) x [y0, y1), return the colors
+            as a flat list of r,g,b values in row order of the tile.
+            sampler_num overrides the samples per pixel of the tracer
+        """
+        if sampler_num is None:
+            sampler_num = self.sampler_num
+
+        if self.enable_packet is True and self.enable_adaptive is False:
+            self.tile_spp_buf = [sampler_num] * ((x1 - x0) * (y1 - y0))
+            return self.__traceTilePacket(x0, y0, x1, y1, sampler_num)
 
-    def __genRay(self, x, y):
-        ratio_x = 1.0 * x / self.width - 0.5
-        ratio_y = 0.5 - 1.0 * y / self.height
-        scene_x = ratio_x * self.camera.getViewWidth()
-        scene_y = ratio_y * self.camera.getViewHeight()
-        target = self.camera.getViewCenter() + self.camera.getViewXAxis() * scene_x + self.camera.getViewYAxis() * scene_y
-        direction = target - self.camera.getPos()
+        tile_buf = []
+        self.tile_spp_buf = []
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                color = self.tracePixel(x, y, sampler_num)
+                tile_buf.append(color.r)
+                tile_buf.append(color.g)
+                tile_buf.append(color.b)
+                self.tile_spp_buf.append(self.pixel_sampler_num)
+        return tile_buf
+
+    def tracePixel(self, x, y, sampler_num=None):
+        if self.enable_adaptive is True:
+            return self.__tracePixelAdaptive(x, y)
+
+        if sampler_num is None:
+            sampler_num = self.sampler_num
+        color = Color(0.0,0.0, 0.0)
+        for sampler in self.sampler.getNextSamplers(sampler_num):
+            color.iadd(self.__traceSample(x, y, sampler))
+        color.iscale(1.0 / sampler_num)
+        self.pixel_sampler_num = sampler_num
+        return color
+
+    def __tracePixelAdaptive(self, x, y):
+        color = Color(0.0, 0.0, 0.0)
+        num = 0
+        mean = 0.0
+        m2 = 0.0
+        while num < self.adaptive_max_num:
+            for sampler in self.sampler.getNextSamplers(self.adaptive_min_num):
+                sample_color = self.__traceSample(x, y, sampler)
+                color.iadd(sample_color)
+
+                # Running mean and variance of the luminance
+                num = num + 1
+                luminance = sample_color.getLuminance()
+                delta = luminance - mean
+                mean = mean + delta / num
+                m2 = m2 + delta * (luminance - mean)
+
+            if num > 1 and math.sqrt(m2 / ((num - 1) * num)) <= self.adaptive_threshold:
+                break
+        self.pixel_sampler_num = num
+        return color.iscale(1.0 / num)
+
+    def __traceSample(self, x, y, sampler):
+        ray = self.__genRay(x, y, sampler.x, sampler.y)
+        if self.stats is None:
+            shadeInfo = self.hit_object(ray)
+        else:
+            self.stats.countRay(RenderStats.PRIMARY)
+            start = time.perf_counter()
+            shadeInfo = self.hit_object(ray)
+            self.stats.addStageTime(RenderStats.PRIMARY_HIT,
+                                    time.perf_counter() - start)
+        return self.calcColor(ray, shadeInfo)
+
+    def __traceTilePacket(self, x0, y0, x1, y1, sampler_num):
+        # Generate all subpixel samples of the tile
+        xs = []
+        ys = []
+        sample_xs = []
+        sample_ys = []
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                for sampler in self.sampler.getNextSamplers(sampler_num):
+                    xs.append(x)
+                    ys.append(y)
+                    sample_xs.append(sampler.x)
+                    sample_ys.append(sampler.y)
+
+        # Intersect the whole packet, then shade hit by hit
+        pos = self.camera.getPos()
+        origin = numpy.array((pos.x, pos.y, pos.z))
+        directions = self.__genRayPacket(xs, ys, sample_xs, sample_ys)
+        if self.stats is not None:
+            self.stats.countRay(RenderStats.PRIMARY, len(xs))
+            start = time.perf_counter()
+        ts, indices, faces = self.scene.hitClosestPacket(origin, directions,
+                                                         0.0, 10000000.0)
+        if self.stats is not None:
+            self.stats.addStageTime(RenderStats.PRIMARY_HIT,
+                                    time.perf_counter() - start)
+        shapes = self.scene.getAllShapes()
+        ts = ts.tolist()
+        indices = indices.tolist()
+        faces = faces.tolist()
+        directions = directions.tolist()
+
+        tile_buf = []
+        ray_index = 0
+        for pixel in range((x1 - x0) * (y1 - y0)):
+            color = Color(0.0, 0.0, 0.0)
+            for i in range(sampler_num):
+                index = indices[ray_index]
+                if index >= 0:
+                    ray = Ray(pos, Vector(*directions[ray_index]))
+                    point = (ray.d * ts[ray_index]).iadd(ray.o)
+                    face = faces[ray_index]
+                    shadeInfo = self.__collect_shade_info(
+                        shapes[index], point, ray, face if face >= 0 else None)
+                    color.iadd(self.calcColor(ray, shadeInfo))
+                ray_index = ray_index + 1
+            color.iscale(1.0 / sampler_num)
+            tile_buf.append(color.r)
+            tile_buf.append(color.g)
+            tile_buf.append(color.b)
+        return tile_buf
+
+    def __genRayPacket(self, xs, ys, sample_xs, sample_ys):
+        """
+            Vectorized __genRay, return normalized directions as (N, 3)
+        """
+        cols, rows, step_x, step_y = self.camera.getRayTable(self.width,
+                                                             self.height)
+        directions = (numpy.array(cols)[xs] + numpy.array(rows)[ys]
+                      + numpy.outer(sample_xs, step_x)
+                      + numpy.outer(sample_ys, step_y))
+        lengths = numpy.sqrt(numpy.sum(directions * directions, axis=1))
+        return directions / numpy.where(lengths == 0.0, 1.0, lengths)[:, None]
+
+    def __genRay(self, x, y, sx, sy):
+        """
+            Ray through the subpixel (sx, sy) of the pixel (x, y), read from
+            the ray table of the camera
+        """
+        cols, rows, step_x, step_y = self.camera.getRayTable(self.width,
+                                                             self.height)
+        col = cols[x]
+        row = rows[y]
+        direction = Vector(col[0] + row[0] + step_x[0] * sx + step_y[0] * sy,
+                           col[1] + row[1] + step_x[1] * sx + step_y[1] * sy,
+                           col[2] + row[2] + step_x[2] * sx + step_y[2] * sy)
         direction.normalize()
         return Ray(self.camera.getPos(), direction)
 
     def hit_object(self, ray, ep = 0.0):
-        shadeInfo = None
-        shapes = self.scene.getAllShapes()
-        min_length = 10000000.0
-        for shape in shapes:
-            isIntersected, point, t = shape.isIntersection(ray)
-            if t < ep:
-                continue # Avoid self intersection
-            if isIntersected is True:
-                cur_len = (point - ray.o).length()
-                if cur_len < min_length:
-                    min_length = cur_len
-                    shadeInfo = self.__collect_shade_info(shape, point, ray)
-        return shadeInfo
+        shape, t, face = self.scene.hitClosestFace(ray, ep, 10000000.0)
+        if shape is None:
+            return None
+        point = (ray.d * t).iadd(ray.o)
+        return self.__collect_shade_info(shape, point, ray, face)
 
     def calcColor(self, ray, shadeInfo):
         color = Color(0.0, 0.0, 0.0)
@@ -91,9 +310,10 @@ class Tracer(object):
         color = self.shader.shade(shadeInfo)
         return color
 
-    def __collect_shade_info(self, shape, point, ray):
+    def __collect_shade_info(self, shape, point, ray, face):
         shadeInfo = ShadeInfo()
-        shadeInfo.normal = shape.genNormal(point)
+        shadeInfo.normal = shape.genHitNormal(point, face)
+        shadeInfo.shape = shape
         shadeInfo.material = shape.getMaterial()
         shadeInfo.scene = self.scene
         shadeInfo.point = point
@@ -16,6 +16,8 @@ __all__ = ["Vector", "Vector2"]
 
 
 class Vector2(object):
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -25,6 +27,14 @@ class Vector2(object):
 
 
 class Vector(object):
+    """
+        3D vector. The operators return new vectors, the in place methods
+        iadd, isub, iscale and iaddScaled modify the vector and return it,
+        they are used in the hot loops to avoid temporary vectors
+    """
+
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -40,6 +50,15 @@ class Vector(object):
                       v0.z * v1.x - v0.x * v1.z,
                       v0.x * v1.y - v0.y * v1.x)
 
+    @staticmethod
+    def orthonormalBasis(w):
+        """
+            Return (u, v, w), an orthonormal basis around the unit vector w
+        """
+        u = Vector.cross(Vector(0.0072, 1.0, 0.0034), w)  # slightly jitter up vector
+        u.normalize()
+        return u, Vector.cross(w, u), w
+
     @staticmethod
     def reflect(n, l):
         ln = Vector.dot(n, l)
@@ -53,12 +72,48 @@ class Vector(object):
     def __sub__(self, v):
         return Vector(self.x - v.x, self.y - v.y, self.z - v.z)
 
-    def __mul__(self, v):
-        return Vector(self.x * v.x, self.y * v.y, self.z * v.z)
-
     def __mul__(self, num):
         return Vector(self.x * num, self.y * num, self.z * num)
 
+    def __neg__(self):
+        return Vector(-self.x, -self.y, -self.z)
+
+    def copy(self):
+        return Vector(self.x, self.y, self.z)
+
+    def set(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+        return self
+
+    def iadd(self, v):
+        self.x = self.x + v.x
+        self.y = self.y + v.y
+        self.z = self.z + v.z
+        return self
+
+    def isub(self, v):
+        self.x = self.x - v.x
+        self.y = self.y - v.y
+        self.z = self.z - v.z
+        return self
+
+    def iscale(self, num):
+        self.x = self.x * num
+        self.y = self.y * num
+        self.z = self.z * num
+        return self
+
+    def iaddScaled(self, v, num):
+        """
+            self = self + v * num
+        """
+        self.x = self.x + v.x * num
+        self.y = self.y + v.y * num
+        self.z = self.z + v.z * num
+        return self
+
     def length(self):
         return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
@@ -73,6 +128,15 @@ class Vector(object):
         self.y /= l
         self.z /= l
 
+    def normalized(self):
+        """
+            Return a normalized copy, the vector itself is not modified
+        """
+        l = self.length()
+        if l == 0.0:
+            l = 1.0
+        return Vector(self.x / l, self.y / l, self.z / l)
+
 
 if __name__ == "__main__":
     d = Vector(-1, -1, 1)
@@ -10,74 +10,90 @@
 
 
 import math
+import os
 import time
 
-import pygame
-from pygame.locals import *
+try:
+    import pygame
+    from pygame.locals import *
+except ImportError:
+    pygame = None
+
+from imagewriter import *
 
 
 __all__ = ["Window",]
 
 
 class Window:
-    def __init__(self, width, height):
+    def __init__(self, width, height, enable_display=True):
         self.width = width
         self.height = height
+        self.surface = None
+        self.enable_display = enable_display and pygame is not None
+
+    def open(self):
+        """
+            Create the display window if it is not open yet, does nothing
+            when the display is disabled
+        """
+        if self.enable_display is True and self.surface is None:
+            pygame.init()
+            self.surface = pygame.display.set_mode((self.width, self.height), 0, 24)
+
+    def close(self):
+        if self.surface is not None:
+            pygame.quit()
+            self.surface = None
+
+    def isOpen(self):
+        return self.surface is not None
+
+    def drawTile(self, x0, y0, x1, y1, tile_buf):
+        """
+            Draw the colors of the pixels in [x0, x1) x [y0, y1) with one
+            blit, tile_buf holds r,g,b values in row order of the tile
+        """
+        self.open()
+        if self.surface is None:
+            return
+        image = pygame.image.frombuffer(toRGB8(tile_buf),
+                                        (x1 - x0, y1 - y0), "RGB")
+        self.surface.blit(image, (x0, y0))
+        pygame.display.update(pygame.Rect(x0, y0, x1 - x0, y1 - y0))
+
+    def processEvents(self):
+        """
+            Handle the pending window events, return False once the
+            window is closed. A window without display never closes
+        """
+        if self.enable_display is False:
+            return True
+        if self.surface is None:
+            return False
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                self.close()
+                return False
+        return True
 
     def update(self, color_buf):
-        pygame.init()
-        surface = pygame.display.set_mode((self.width, self.height), 0, 24)
-        cur_col = 0
-        cur_row = 0        
-        while True:
-            is_quit = False
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    is_quit = True
-                    break
-            if is_quit is True:
-                pygame.quit()
-                break
-
-            if cur_row >= self.height:
-                pygame.display.update()
-                continue
-            
-            # Display current tracer result
-            r = math.floor(color_buf[cur_row * self.width * 3
-                                    + cur_col * 3 + 0] * 255)
-            g = math.floor(color_buf[cur_row * self.width * 3
-                                    + cur_col * 3 + 1] * 255)
-            b = math.floor(color_buf[cur_row * self.width * 3
-                                    + cur_col * 3 + 2] * 255)
-            if r > 255:
-                r = 255
-            if g > 255:
-                g = 255
-            if b > 255:
-                b = 255
-            surface.set_at((cur_col,cur_row), (r,g,b))
-            cur_col = cur_col + 1
-            if cur_col >= self.width:
-                cur_col = 0
-                cur_row = cur_row + 1
-            
-            pygame.display.update()
+        if self.enable_display is False:
+            return
+        self.drawTile(0, 0, self.width, self.height, color_buf)
+        while self.processEvents() is True:
+            time.sleep(0.05)
 
     def save(self, img_name, color_buf, width, height):
-        surface = pygame.Surface((width, height))
-        for y in range(self.height):
-            for x in range(self.width):
-                r = math.floor(color_buf[y * self.width * 3 + x * 3 + 0] * 255)
-                g = math.floor(color_buf[y * self.width * 3 + x * 3 + 1] * 255)
-                b = math.floor(color_buf[y * self.width * 3 + x * 3 + 2] * 255)
-                if r > 255:
-                    r = 255
-                if g > 255:
-                    g = 255
-                if b > 255:
-                    b = 255
-                surface.set_at((x,y), (r,g,b))
+        """
+            Save the color buffer, .ppm, .bmp and .png are written without
+            pygame, other formats go through pygame.image.save
+        """
+        ext = os.path.splitext(img_name)[1].lower()
+        if ext in (".ppm", ".bmp", ".png") or pygame is None:
+            saveImage(img_name, color_buf, width, height)
+            return
+        surface = pygame.image.frombuffer(toRGB8(color_buf), (width, height), "RGB")
         pygame.image.save(surface, img_name)
 
     def getWidth(self):
@@ -0,0 +1,15 @@
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Tests of the renderer, the flat modules of source are put on the
+           import path. Run with python -m unittest or python -m pytest
+"""
+
+
+import os
+import sys
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "source"))
@@ -0,0 +1,157 @@
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: BVH queries against a linear scan of the same shapes
+"""
+
+
+import random
+import unittest
+from array import array
+
+from bvh import *
+from scene import *
+from vector import *
+
+
+def jitter(rng, p):
+    return p + Vector(rng.uniform(-3.0, 3.0), rng.uniform(-3.0, 3.0),
+                      rng.uniform(-3.0, 3.0))
+
+
+def createShapes(rng, num):
+    """
+        Spheres and triangles spread in a box, with some overlap
+    """
+    shapes = []
+    for i in range(num):
+        center = Vector(rng.uniform(-20.0, 20.0), rng.uniform(-20.0, 20.0),
+                        rng.uniform(-20.0, 20.0))
+        if i % 3 == 0:
+            shapes.append(Triangle(jitter(rng, center), jitter(rng, center),
+                                   jitter(rng, center), None))
+        else:
+            shapes.append(Sphere(center, rng.uniform(0.2, 2.5), None))
+    return shapes
+
+
+def createRays(rng, num):
+    """
+        Rays from inside and outside the box of createShapes
+    """
+    rays = []
+    for i in range(num):
+        o = Vector(rng.uniform(-30.0, 30.0), rng.uniform(-30.0, 30.0),
+                   rng.uniform(-30.0, 30.0))
+        d = Vector(rng.gauss(0.0, 1.0), rng.gauss(0.0, 1.0),
+                   rng.gauss(0.0, 1.0))
+        d.normalize()
+        rays.append(Ray(o, d))
+    return rays
+
+
+def hitShape(shape, ray, t_min, t_max):
+    return shape.hitT(ray, t_min, t_max)
+
+
+def linearClosestHit(shapes, ray, t_min, t_max):
+    closest = None
+    for shape in shapes:
+        t = shape.hitT(ray, t_min, t_max)
+        if t is not None:
+            t_max = t
+            closest = shape
+    return closest, t_max
+
+
+class BVHTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(2)
+        self.shapes = createShapes(rng, 300)
+        self.rays = createRays(rng, 400)
+        self.bvh = BVH(self.shapes, [shape.getBoundingBox().getBounds()
+                                     for shape in self.shapes])
+
+    def testClosestHit(self):
+        hit_num = 0
+        for ray in self.rays:
+            shape, t = self.bvh.closestHit(ray, hitShape, 0.001, 1e9)
+            expected_shape, expected_t = linearClosestHit(self.shapes, ray,
+                                                          0.001, 1e9)
+            self.assertIs(shape, expected_shape)
+            self.assertEqual(t, expected_t)
+            if shape is not None:
+                hit_num = hit_num + 1
+        self.assertGreater(hit_num, 50)
+
+    def testClosestHitRange(self):
+        for ray in self.rays:
+            shape, t = self.bvh.closestHit(ray, hitShape, 5.0, 25.0)
+            expected_shape, expected_t = linearClosestHit(self.shapes, ray,
+                                                          5.0, 25.0)
+            self.assertIs(shape, expected_shape)
+            self.assertEqual(t, expected_t)
+
+    def testAnyHit(self):
+        for ray in self.rays:
+            shape = self.bvh.anyHit(ray, hitShape, 0.001, 15.0)
+            expected_shape, expected_t = linearClosestHit(self.shapes, ray,
+                                                          0.001, 15.0)
+            self.assertEqual(shape is None, expected_shape is None)
+            if shape is not None:
+                self.assertIsNotNone(shape.hitT(ray, 0.001, 15.0))
+
+    def testFlatBounds(self):
+        bounds = array("d")
+        for shape in self.shapes:
+            bounds.extend(shape.getBoundingBox().getBounds())
+        bvh = BVH(None, bounds)
+        for ray in self.rays[:100]:
+            item, t = bvh.closestHit(
+                ray, lambda item, ray, t_min, t_max:
+                self.shapes[item].hitT(ray, t_min, t_max), 0.001, 1e9)
+            shape, expected_t = self.bvh.closestHit(ray, hitShape, 0.001, 1e9)
+            self.assertIs(None if item is None else self.shapes[item], shape)
+            self.assertEqual(t, expected_t)
+
+
+class SceneBVHTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        self.scene = Scene()
+        self.linear_scene = Scene()
+        self.linear_scene.setEnableBVH(False)
+        shapes = createShapes(rng, 100)
+        shapes.append(Plane(Vector(0.0, -15.0, 0.0), Vector(0.0, 1.0, 0.0),
+                            None))
+        for shape in shapes:
+            self.scene.addShape(shape)
+            self.linear_scene.addShape(shape)
+        self.rays = createRays(rng, 300)
+
+    def testUsesBVH(self):
+        self.assertGreater(self.scene.getBVH().getNodeNum(), 1)
+        self.assertEqual(self.linear_scene.getBVH().getNodeNum(), 0)
+
+    def testHitClosest(self):
+        for ray in self.rays:
+            self.assertEqual(self.scene.hitClosest(ray, 0.001),
+                             self.linear_scene.hitClosest(ray, 0.001))
+
+    def testIsIntersection(self):
+        for ray in self.rays:
+            self.assertEqual(self.scene.isIntersection(ray, 0.001),
+                             self.linear_scene.isIntersection(ray, 0.001))
+
+    def testIsTwoPointsVisible(self):
+        rng = random.Random(4)
+        for ray in self.rays:
+            p = ray.o + ray.d * rng.uniform(1.0, 40.0)
+            self.assertEqual(
+                self.scene.isTwoPointsVisible(ray.o, 0.001, p, 0.001),
+                self.linear_scene.isTwoPointsVisible(ray.o, 0.001, p, 0.001))
+
+
+if __name__ == "__main__":
+    unittest.main()
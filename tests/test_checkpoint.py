@@ -0,0 +1,109 @@
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: Interrupt renders after a checkpoint and resume them
+"""
+
+
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from benchmark import *
+from checkpoint import *
+from render import *
+from tracer import *
+from window import *
+
+
+WIDTH = 16
+HEIGHT = 16
+TILE_SIZE = 4
+TILE_NUM = (WIDTH // TILE_SIZE) * (HEIGHT // TILE_SIZE)
+
+
+class Interrupt(Exception):
+    pass
+
+
+def interruptAfter(save_num):
+    """
+        Patch Checkpoint.save to raise Interrupt once the checkpoint has
+        been written save_num times, like a render killed right after
+    """
+    save = Checkpoint.save
+    calls = []
+
+    def interruptingSave(self, *args):
+        save(self, *args)
+        calls.append(None)
+        if len(calls) == save_num:
+            raise Interrupt()
+    return mock.patch.object(Checkpoint, "save", interruptingSave)
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.checkpoint_name = os.path.join(self.dir.name, "render.ckpt")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def createRender(self, worker_num=1, progressive=False):
+        random.seed(1)
+        tracer = createBallsScene(WIDTH, HEIGHT, 1, 4, 4)
+        render = Render(Window(WIDTH, HEIGHT, False), tracer,
+                        os.path.join(self.dir.name, "result.bmp"),
+                        worker_num, TILE_SIZE)
+        if progressive is True:
+            render.setProgressive(True, 3, 4)
+        render.setCheckpoint(self.checkpoint_name, 0.0)
+        render.setResume(True)
+        return render
+
+    def resume(self, render, save_num):
+        """
+            Render until the save_num-th checkpoint, then render again
+            from it. Return the number of tiles traced by the second render
+        """
+        with interruptAfter(save_num):
+            with self.assertRaises(Interrupt):
+                render.render()
+        self.assertTrue(os.path.exists(self.checkpoint_name))
+
+        traced = []
+        trace_tile = Tracer.traceTile
+
+        def countedTraceTile(tracer, *args):
+            traced.append(args)
+            return trace_tile(tracer, *args)
+        with mock.patch.object(Tracer, "traceTile", countedTraceTile):
+            render.render()
+        self.assertFalse(os.path.exists(self.checkpoint_name))
+        return len(traced)
+
+    def testTiles(self):
+        render = self.createRender()
+        self.assertEqual(self.resume(render, 5), TILE_NUM - 5)
+        self.assertEqual(list(render.getSppBuf()), [1] * (WIDTH * HEIGHT))
+
+    def testProgressive(self):
+        render = self.createRender(progressive=True)
+        # Pass 0 saves once per tile and once at its end, stop in pass 1
+        self.assertEqual(self.resume(render, TILE_NUM + 4),
+                         TILE_NUM - 3 + TILE_NUM)
+        self.assertEqual(list(render.getSppBuf()),
+                         [1 + 4 + 4] * (WIDTH * HEIGHT))
+
+    def testWorkers(self):
+        render = self.createRender(worker_num=2)
+        self.resume(render, 5)
+        self.assertEqual(list(render.getSppBuf()), [1] * (WIDTH * HEIGHT))
+
+
+if __name__ == "__main__":
+    unittest.main()
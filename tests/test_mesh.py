@@ -0,0 +1,140 @@
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: TriangleMesh against the same faces as Triangle shapes
+"""
+
+
+import os
+import random
+import tempfile
+import unittest
+from array import array
+
+from scene import *
+from vector import *
+
+
+OBJ = """# Unit square of two faces in a quad, a triangle with v/vt/vn
+v 0.0 0.0 0.0
+v 1.0 0.0 0.0
+v 1.0 1.0 0.0
+v 0.0 1.0 0.0
+vt 0.0 0.0
+vn 0.0 0.0 1.0
+f 1 2 3 4
+v 0.0 0.0 1.0
+f -1/1/1 1/1/1 2/1/1
+"""
+
+
+def createTriangleSoup(rng, num):
+    """
+        Return (vertices, indices) of num triangles spread in a box
+    """
+    vertices = array("d")
+    indices = array("i")
+    for i in range(num):
+        center = (rng.uniform(-20.0, 20.0), rng.uniform(-20.0, 20.0),
+                  rng.uniform(-20.0, 20.0))
+        for k in range(3):
+            indices.append(len(vertices) // 3)
+            vertices.extend(c + rng.uniform(-3.0, 3.0) for c in center)
+    return vertices, indices
+
+
+def unit(v):
+    v = v.copy()
+    v.normalize()
+    return v
+
+
+class TriangleMeshTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(5)
+        vertices, indices = createTriangleSoup(rng, 300)
+        self.mesh = TriangleMesh(vertices, indices, None)
+        self.triangles = []
+        for face in range(self.mesh.getFaceNum()):
+            k = face * 3
+            self.triangles.append(Triangle(self.mesh.getVertex(indices[k]),
+                                           self.mesh.getVertex(indices[k + 1]),
+                                           self.mesh.getVertex(indices[k + 2]),
+                                           None))
+        self.rays = []
+        for i in range(400):
+            o = Vector(rng.uniform(-30.0, 30.0), rng.uniform(-30.0, 30.0),
+                       rng.uniform(-30.0, 30.0))
+            d = Vector(rng.gauss(0.0, 1.0), rng.gauss(0.0, 1.0),
+                       rng.gauss(0.0, 1.0))
+            d.normalize()
+            self.rays.append(Ray(o, d))
+
+    def closestTriangle(self, ray):
+        closest = None
+        t_max = float("inf")
+        for face, triangle in enumerate(self.triangles):
+            t = triangle.hitT(ray, 0.0, t_max)
+            if t is not None:
+                t_max = t
+                closest = face
+        return closest, t_max
+
+    def testHitFace(self):
+        hit_num = 0
+        for ray in self.rays:
+            t, face = self.mesh.hitFace(ray)
+            expected_face, expected_t = self.closestTriangle(ray)
+            self.assertEqual(face, expected_face)
+            if face is not None:
+                hit_num = hit_num + 1
+                self.assertAlmostEqual(t, expected_t, delta=1e-9 * t)
+                self.assertEqual(self.mesh.hitT(ray), t)
+        self.assertGreater(hit_num, 20)
+
+    def testNormal(self):
+        for ray in self.rays:
+            t, face = self.mesh.hitFace(ray)
+            if face is None:
+                continue
+            point = ray.o + ray.d * t
+            normal = self.mesh.genHitNormal(point, face)
+            expected = unit(self.triangles[face].genNormal(point))
+            self.assertAlmostEqual(Vector.dot(normal, expected), 1.0, places=9)
+            # Without the face the face is searched by the point
+            searched = self.mesh.genNormal(point)
+            self.assertAlmostEqual(abs(Vector.dot(searched, expected)), 1.0,
+                                   places=6)
+
+    def testSceneHitFace(self):
+        scene = Scene()
+        scene.addShape(self.mesh)
+        for ray in self.rays[:100]:
+            shape, t, face = scene.hitClosestFace(ray)
+            expected_t, expected_face = self.mesh.hitFace(ray)
+            self.assertEqual(face, expected_face)
+            if face is None:
+                self.assertIsNone(shape)
+            else:
+                self.assertIs(shape, self.mesh)
+                self.assertEqual(t, expected_t)
+
+
+class OBJTest(unittest.TestCase):
+    def testLoad(self):
+        with tempfile.TemporaryDirectory() as dir_name:
+            file_name = os.path.join(dir_name, "square.obj")
+            with open(file_name, "w") as f:
+                f.write(OBJ)
+            mesh = TriangleMesh.createFromOBJ(file_name, None)
+        self.assertEqual(mesh.getVertexNum(), 5)
+        self.assertEqual(list(mesh.indices), [0, 1, 2, 0, 2, 3, 4, 0, 1])
+        ray = Ray(Vector(0.25, 0.75, -1.0), Vector(0.0, 0.0, 1.0))
+        t, face = mesh.hitFace(ray)
+        self.assertEqual(face, 1)
+        self.assertAlmostEqual(t, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+    Declaration: Copyright (c), by i_dovelemon, 2017. All right reserved.
+    Author: i_dovelemon[1322600812@qq.com]
+    Date: 2026/10/18
+    Brief: NumPy ray packets against the scalar ray path
+"""
+
+
+import random
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from camera import *
+from color import *
+from light import *
+from material import *
+from sampler import *
+from scene import *
+from shade import *
+from tracer import *
+from vector import *
+
+
+def createScene(rng, sphere_num):
+    """
+        Spheres, a square, a two triangle mesh and a plane, with a BVH
+        once there are enough shapes
+    """
+    s = Scene()
+    s.addShape(Plane(Vector(0.0, -5.0, 0.0), Vector(0.0, 1.0, 0.0), None))
+    s.addShape(Squre(Vector(0.0, 0.0, 60.0), 30.0, Vector(0.0, 0.0, -1.0),
+                     None))
+    s.addShape(TriangleMesh([-4.0, -4.0, 20.0, 4.0, -4.0, 20.0,
+                             -4.0, 4.0, 20.0, 4.0, 4.0, 20.0],
+                            [0, 1, 2, 1, 3, 2], None))
+    for i in range(sphere_num):
+        s.addShape(Sphere(Vector(rng.uniform(-30.0, 30.0),
+                                 rng.uniform(-4.0, 20.0),
+                                 rng.uniform(5.0, 80.0)),
+                          rng.uniform(0.5, 3.0), None))
+    return s
+
+
+def createDirections(num):
+    directions = numpy.random.RandomState(1).normal(size=(num, 3))
+    directions[:, 2] = numpy.abs(directions[:, 2]) + 0.5
+    return directions / numpy.linalg.norm(directions, axis=1)[:, None]
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class ScenePacketTest(unittest.TestCase):
+    def checkScene(self, scene):
+        origin = numpy.array((0.0, 2.0, 0.0))
+        directions = createDirections(512)
+        ts, indices, faces = scene.hitClosestPacket(origin, directions, 0.001)
+        blocked = scene.isIntersectionPacket(origin, directions, 0.001, 30.0)
+        shapes = scene.getAllShapes()
+        for i in range(len(directions)):
+            ray = Ray(Vector(*origin.tolist()), Vector(*directions[i].tolist()))
+            shape, t, face = scene.hitClosestFace(ray, 0.001)
+            if shape is None:
+                self.assertEqual(indices[i], -1)
+            else:
+                self.assertIs(shapes[indices[i]], shape)
+                self.assertAlmostEqual(ts[i], t, delta=1e-9 * t)
+            self.assertEqual(faces[i], -1 if face is None else face)
+            self.assertEqual(blocked[i],
+                             scene.hitClosest(ray, 0.001, 30.0)[0] is not None)
+        # Every kind of shape is hit by some rays
+        self.assertTrue(numpy.any(faces >= 0))
+        self.assertTrue(numpy.any(indices == 0))
+        self.assertTrue(numpy.any(indices == 1))
+
+    def testLinearScene(self):
+        scene = createScene(random.Random(1), 2)
+        self.assertEqual(scene.getBVH().getNodeNum(), 0)
+        self.checkScene(scene)
+
+    def testBVHScene(self):
+        scene = createScene(random.Random(1), 200)
+        self.assertGreater(scene.getBVH().getNodeNum(), 1)
+        self.checkScene(scene)
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TracerPacketTest(unittest.TestCase):
+    def createTracer(self, width, height):
+        """
+            Lit by an ambient and a parallel light only, the shading draws
+            no random numbers and both paths use the pixel samplers in
+            the same order
+        """
+        s = Scene()
+        s.setAmbientLight(AmbientLight(0.5, Color(1.0, 1.0, 1.0)))
+        d = Vector(0.3, -1.0, 0.4)
+        d.normalize()
+        s.setParallelLight(ParallelLight(1.0, Color(1.0, 1.0, 1.0), d))
+        mat = Material.createGlossy(0.3, 0.8, Color(1.0, 0.5, 0.2), 0.1,
+                                    Color(1.0, 1.0, 1.0), 2.0)
+        s.addShape(Plane(Vector(0.0, -8.0, 0.0), Vector(0.0, 1.0, 0.0), mat))
+        mat = Material.createMirror(0.1, 0.5, Color(0.2, 0.4, 1.0), 0.3,
+                                    Color(1.0, 1.0, 1.0))
+        s.addShape(Sphere(Vector(-6.0, 0.0, 0.0), 6.0, mat))
+        mat = Material.createGlossy(0.2, 0.6, Color(0.3, 1.0, 0.3), 0.4,
+                                    Color(1.0, 1.0, 1.0), 8.0)
+        s.addShape(TriangleMesh([4.0, -8.0, 0.0, 14.0, -8.0, 0.0,
+                                 9.0, 6.0, 4.0], [0, 1, 2], mat))
+        c = Camera(Vector(0.0, 20.0, -60.0), Vector(0.0, 0.0, 0.0), 0.01,
+                   170.0, 1.0 * width / height)
+        return Tracer(s, c, width, height, Phong(MultiJitteredSampler()), 4,
+                      MultiJitteredSampler(), 4)
+
+    def testSameImage(self):
+        images = []
+        for enable in (False, True):
+            random.seed(7)
+            tracer = self.createTracer(12, 12)
+            tracer.setEnablePacket(enable)
+            images.append(numpy.array(tracer.traceTile(0, 0, 12, 12)))
+        self.assertGreater(numpy.ptp(images[0]), 0.1)
+        self.assertTrue(numpy.allclose(images[0], images[1], rtol=1e-9,
+                                       atol=1e-12))
+
+
+if __name__ == "__main__":
+    unittest.main()